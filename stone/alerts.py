@@ -0,0 +1,378 @@
+import json
+import os
+import smtplib
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from email.message import EmailMessage
+
+URGENT_LEVELS = ('Severe', 'Moderate')
+
+
+class AlertStore:
+    """
+    SQLite-backed index of urgent analyses plus a notification outbox.
+
+    Every Severe or Moderate analysis is added to urgent_cases as it is
+    made, so the alerts page reads one indexed table instead of scanning all
+    history. Severe analyses also queue a message per doctor contact
+    channel, unless a message to the same recipient about the same patient
+    on that channel was queued or sent within the dedupe window, so
+    repeated Severe scans notify only once.
+    """
+
+    def __init__(self, db_path='alerts.db', dedupe_window_seconds=24 * 3600, moderate_window_seconds=7 * 86400):
+        self.db_path = db_path
+        self.dedupe_window_seconds = dedupe_window_seconds
+        self.moderate_window_seconds = moderate_window_seconds
+        self._init_db()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS urgent_cases (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    patient_id TEXT NOT NULL,
+                    level TEXT NOT NULL,
+                    stone_count INTEGER NOT NULL,
+                    total_burden_mm REAL NOT NULL,
+                    largest_stone_mm REAL NOT NULL,
+                    created_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_urgent_level_time ON urgent_cases (level, created_at);
+
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    dedupe_key TEXT NOT NULL UNIQUE,
+                    channel TEXT NOT NULL,
+                    recipient TEXT NOT NULL,
+                    subject TEXT NOT NULL,
+                    body TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    lease_until REAL NOT NULL DEFAULT 0,
+                    last_error TEXT NOT NULL DEFAULT '',
+                    created_at REAL NOT NULL,
+                    sent_at REAL
+                );
+                CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at);
+                CREATE INDEX IF NOT EXISTS idx_outbox_recipient ON outbox (channel, recipient, created_at);
+            """)
+
+    @staticmethod
+    def _build_messages(patient_id, stone_count, total_burden_mm, largest_stone_mm, contact, created_at):
+        scanned = datetime.fromtimestamp(created_at).strftime('%Y-%m-%d %H:%M')
+        messages = []
+        if (contact.get('doctor_email') or '').strip():
+            messages.append(('email', contact['doctor_email'].strip(),
+                             f"Urgent: severe kidney stone scan for patient {patient_id}",
+                             f"A scan analysed on {scanned} for patient {patient_id} was classified as Severe.\n\n"
+                             f"Stones detected: {stone_count}\n"
+                             f"Total stone burden: {total_burden_mm:.1f} mm\n"
+                             f"Largest stone: {largest_stone_mm:.1f} mm\n\n"
+                             f"Please review the patient's results."))
+        if (contact.get('doctor_phone') or '').strip():
+            messages.append(('sms', contact['doctor_phone'].strip(),
+                             f"Severe scan for patient {patient_id}",
+                             f"StoneSense: patient {patient_id} scan on {scanned} is Severe "
+                             f"({stone_count} stones, largest {largest_stone_mm:.1f} mm). Please review."))
+        return messages
+
+    def record_analysis(self, patient_id, severity_level, stone_count, total_burden_mm, largest_stone_mm,
+                        contact=None, created_at=None):
+        """
+        Index an urgent analysis and queue notifications for Severe ones.
+
+        Returns:
+            Number of notifications newly queued (duplicates are ignored)
+        """
+        if severity_level not in URGENT_LEVELS:
+            return 0
+        try:
+            created_at = created_at if created_at is not None else time.time()
+            messages = []
+            if severity_level == 'Severe' and contact:
+                messages = self._build_messages(patient_id, stone_count, total_burden_mm, largest_stone_mm,
+                                                contact, created_at)
+
+            queued = 0
+            with self._connect() as conn:
+                # The first write takes the database write lock, so the duplicate check below
+                # and the insert after it cannot interleave with another worker's
+                conn.execute(
+                    "INSERT INTO urgent_cases (patient_id, level, stone_count, total_burden_mm, largest_stone_mm, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (patient_id, severity_level, stone_count, total_burden_mm, largest_stone_mm, created_at)
+                )
+                for channel, recipient, subject, body in messages:
+                    prefix = f"{patient_id}|{channel}|{recipient}|"
+                    duplicate = conn.execute(
+                        "SELECT 1 FROM outbox WHERE channel = ? AND recipient = ? AND created_at > ? "
+                        "AND status IN ('pending', 'sending', 'sent') AND substr(dedupe_key, 1, ?) = ? LIMIT 1",
+                        (channel, recipient, created_at - self.dedupe_window_seconds, len(prefix), prefix)
+                    ).fetchone()
+                    if duplicate:
+                        continue
+                    cursor = conn.execute(
+                        "INSERT OR IGNORE INTO outbox (dedupe_key, channel, recipient, subject, body, next_attempt_at, created_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (f"{prefix}{created_at!r}", channel, recipient, subject, body, created_at, created_at)
+                    )
+                    queued += cursor.rowcount
+            return queued
+        except Exception as e:
+            print(f"Error recording urgent case: {e}")
+            return 0
+
+    def get_urgent_cases(self, limit=100):
+        """Severe analyses plus Moderate ones from the recent window, newest first"""
+        try:
+            with self._connect() as conn:
+                conn.row_factory = sqlite3.Row
+                rows = conn.execute(
+                    "SELECT * FROM urgent_cases WHERE level = 'Severe' OR (level = 'Moderate' AND created_at >= ?) "
+                    "ORDER BY created_at DESC LIMIT ?",
+                    (time.time() - self.moderate_window_seconds, limit)
+                ).fetchall()
+            cases = []
+            for row in rows:
+                case = dict(row)
+                case['created_at'] = datetime.fromtimestamp(case['created_at']).isoformat()
+                cases.append(case)
+            return cases
+        except Exception as e:
+            print(f"Error reading urgent cases: {e}")
+            return []
+
+    def claim_batch(self, limit, lease_seconds=60):
+        """
+        Atomically take up to limit due messages for sending.
+
+        Claimed messages are leased; if the claiming worker dies they become
+        due again when the lease runs out.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.isolation_level = None
+            conn.row_factory = sqlite3.Row
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT id, channel, recipient, subject, body, attempts FROM outbox "
+                "WHERE (status = 'pending' AND next_attempt_at <= ?) OR (status = 'sending' AND lease_until <= ?) "
+                "ORDER BY next_attempt_at LIMIT ?",
+                (now, now, limit)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE outbox SET status = 'sending', lease_until = ? WHERE id = ?",
+                [(now + lease_seconds, row['id']) for row in rows]
+            )
+            conn.execute("COMMIT")
+            return [dict(row) for row in rows]
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def mark_sent(self, message_ids):
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE outbox SET status = 'sent', sent_at = ?, last_error = '' WHERE id = ?",
+                [(time.time(), message_id) for message_id in message_ids]
+            )
+
+    def mark_failed(self, message, error, max_attempts, retry_backoff):
+        """Schedule a retry with exponential backoff, or give up after max_attempts"""
+        attempts = message['attempts'] + 1
+        status = 'failed' if attempts >= max_attempts else 'pending'
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, last_error = ?, next_attempt_at = ? WHERE id = ?",
+                (status, attempts, str(error)[:500], time.time() + retry_backoff * 2 ** (attempts - 1), message['id'])
+            )
+        return status
+
+    def get_stats(self):
+        with self._connect() as conn:
+            outbox = dict(conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+            cases = dict(conn.execute("SELECT level, COUNT(*) FROM urgent_cases GROUP BY level").fetchall())
+        return {'outbox': outbox, 'urgent_cases': cases}
+
+
+class SmtpEmailSender:
+    """Sends a batch of emails over a single SMTP connection"""
+
+    def __init__(self, host='127.0.0.1', port=1025, sender='alerts@stonesense.local',
+                 username=None, password=None, use_tls=False, timeout=10):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.timeout = timeout
+
+    def send_batch(self, messages):
+        """Returns one entry per message: None if sent, else the error"""
+        try:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        except (OSError, smtplib.SMTPException) as e:
+            return [e] * len(messages)
+
+        results = []
+        with smtp:
+            try:
+                if self.use_tls:
+                    smtp.starttls()
+                if self.username:
+                    smtp.login(self.username, self.password or '')
+            except smtplib.SMTPException as e:
+                return [e] * len(messages)
+            for message in messages:
+                email = EmailMessage()
+                email['From'] = self.sender
+                email['To'] = message['recipient']
+                email['Subject'] = message['subject']
+                email.set_content(message['body'])
+                try:
+                    smtp.send_message(email)
+                    results.append(None)
+                except (OSError, smtplib.SMTPException) as e:
+                    results.append(e)
+        return results
+
+
+class LogSmsSender:
+    """SMS stub: appends each text message as a JSON line to a local file"""
+
+    def __init__(self, path='sms_outbox.log'):
+        self.path = path
+
+    def send_batch(self, messages):
+        try:
+            with open(self.path, 'a', encoding='utf-8') as file:
+                for message in messages:
+                    file.write(json.dumps({'to': message['recipient'], 'body': message['body'],
+                                           'sent_at': datetime.now().isoformat()}) + '\n')
+            return [None] * len(messages)
+        except OSError as e:
+            return [e] * len(messages)
+
+
+class NotificationWorker:
+    """
+    Background sender for the outbox: claims due messages in batches, sends
+    each channel's batch through its sender and records success or
+    schedules a retry. /predict only inserts rows and calls wake().
+    """
+
+    def __init__(self, store, senders, batch_size=50, poll_interval=5.0, max_attempts=5, retry_backoff=30.0):
+        self.store = store
+        self.senders = senders
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.stats = {'batches': 0, 'sent': 0, 'retries_scheduled': 0, 'gave_up': 0}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        """Send one batch of due messages; returns how many were claimed"""
+        batch = self.store.claim_batch(self.batch_size)
+        if not batch:
+            return 0
+
+        by_channel = {}
+        for message in batch:
+            by_channel.setdefault(message['channel'], []).append(message)
+
+        sent, retries, gave_up = [], 0, 0
+        for channel, messages in by_channel.items():
+            sender = self.senders.get(channel)
+            results = sender.send_batch(messages) if sender else [f"No sender for channel {channel}"] * len(messages)
+            for message, error in zip(messages, results):
+                if error is None:
+                    sent.append(message['id'])
+                elif self.store.mark_failed(message, error, self.max_attempts, self.retry_backoff) == 'failed':
+                    gave_up += 1
+                else:
+                    retries += 1
+        self.store.mark_sent(sent)
+
+        with self._lock:
+            self.stats['batches'] += 1
+            self.stats['sent'] += len(sent)
+            self.stats['retries_scheduled'] += retries
+            self.stats['gave_up'] += gave_up
+        return len(batch)
+
+    def wake(self):
+        """Check the outbox now instead of at the next poll"""
+        self._wake.set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stop.is_set():
+                try:
+                    claimed = self.run_once()
+                except Exception as e:
+                    print(f"Error sending notifications: {e}")
+                    claimed = 0
+                if claimed < self.batch_size:
+                    self._wake.wait(self.poll_interval)
+                    self._wake.clear()
+
+        self._thread = threading.Thread(target=run, name='notification-worker', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats.update(self.store.get_stats())
+        return stats
+
+
+def alerts_from_env():
+    """Create the alert store and notification worker configured through ALERT_*, SMTP_* and SMS_* variables"""
+    store = AlertStore(
+        os.getenv('ALERTS_DB', 'alerts.db'),
+        dedupe_window_seconds=float(os.getenv('ALERT_DEDUPE_HOURS', '24')) * 3600,
+        moderate_window_seconds=float(os.getenv('ALERT_MODERATE_WINDOW_DAYS', '7')) * 86400
+    )
+    senders = {
+        'email': SmtpEmailSender(
+            host=os.getenv('SMTP_HOST', '127.0.0.1'),
+            port=int(os.getenv('SMTP_PORT', '1025')),
+            sender=os.getenv('SMTP_SENDER', 'alerts@stonesense.local'),
+            username=os.getenv('SMTP_USERNAME') or None,
+            password=os.getenv('SMTP_PASSWORD') or None,
+            use_tls=os.getenv('SMTP_TLS', 'false').lower() == 'true'
+        ),
+        'sms': LogSmsSender(os.getenv('SMS_OUTBOX_PATH', 'sms_outbox.log'))
+    }
+    worker = NotificationWorker(
+        store, senders,
+        batch_size=int(os.getenv('ALERT_BATCH_SIZE', '50')),
+        poll_interval=float(os.getenv('ALERT_POLL_INTERVAL', '5')),
+        max_attempts=int(os.getenv('ALERT_MAX_ATTEMPTS', '5')),
+        retry_backoff=float(os.getenv('ALERT_RETRY_BACKOFF', '30'))
+    )
+    return store, worker
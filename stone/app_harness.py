@@ -0,0 +1,56 @@
+"""
+In-process harness for the Flask app: imports flask_app without the YOLO
+weights or background workers and points its stores at a test directory,
+so routes can be driven through app.test_client()
+"""
+
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+import stone_inference
+from alerts import AlertStore
+from blob_store import BlobStore
+from patient_data_manager import PatientDataManager
+from scan_history import ScanHistoryStore
+from simple_user_manager import SimpleUserDataManager
+
+class StubDetector:
+    """Stands in for the YOLO model at import time; tests replace flask_app.detect_stones"""
+
+    def predict(self, *args, **kwargs):
+        raise RuntimeError("Stub detector: patch flask_app.detect_stones or analyze_images in the test")
+
+def load_app():
+    """Import flask_app once per process, with its import-time files in a throwaway directory"""
+    if 'flask_app' in sys.modules:
+        return sys.modules['flask_app']
+    # A placeholder key keeps the real one in .env out of tests
+    defaults = {'ALERT_WORKER': 'false', 'STORAGE_SWEEP_INTERVAL': '0', 'COHORT_STATS_SNAPSHOT': '',
+                'OPENROUTER_API_KEY': 'test-key'}
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+    if stone_inference._model is None:
+        stone_inference._model = StubDetector()
+
+    import_dir = tempfile.mkdtemp(prefix='stone-app-')
+    atexit.register(shutil.rmtree, import_dir, True)
+    cwd = os.getcwd()
+    os.chdir(import_dir)
+    try:
+        import flask_app
+    finally:
+        os.chdir(cwd)
+    return flask_app
+
+def app_client(workdir):
+    """(flask_app module, test client) with the user, patient, scan, alert and upload stores in workdir"""
+    flask_app = load_app()
+    flask_app.user_manager = SimpleUserDataManager(os.path.join(workdir, 'user_data.csv'),
+                                                   os.path.join(workdir, 'doctor_contacts.csv'))
+    flask_app.patient_manager = PatientDataManager(os.path.join(workdir, 'patient_data.csv'))
+    flask_app.scan_history = ScanHistoryStore(os.path.join(workdir, 'scan_history'))
+    flask_app.alert_store = AlertStore(os.path.join(workdir, 'alerts.db'))
+    flask_app.upload_store = BlobStore(os.path.join(workdir, 'uploads'))
+    return flask_app, flask_app.app.test_client()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark PatientDataManager.search_patients (trigram index) against a linear CSV scan
+
+Usage:
+    python benchmark_patient_search.py                 # 10k, 100k and 1M patients
+    python benchmark_patient_search.py --sizes 10000
+"""
+
+import argparse
+import csv
+import os
+import random
+import tempfile
+import time
+from patient_data_manager import PatientDataManager, PATIENT_FIELDS
+
+FIRST_NAMES = ['James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda',
+               'David', 'Elizabeth', 'Priya', 'Arjun', 'Wei', 'Fatima', 'Carlos', 'Sofia']
+LAST_NAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis',
+              'Reddy', 'Sharma', 'Chen', 'Khan', 'Lopez', 'Rossi', 'Novak', 'Okafor']
+
+def write_patients(path, count):
+    """Write a synthetic patient CSV with count rows"""
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.DictWriter(file, fieldnames=PATIENT_FIELDS, restval='')
+        writer.writeheader()
+        for i in range(count):
+            first, last = random.choice(FIRST_NAMES), f"{random.choice(LAST_NAMES)}{i % 997}"
+            writer.writerow({
+                'patient_id': f"PT-{i:08X}", 'first_name': first, 'last_name': last,
+                'email': f"{first.lower()}.{last.lower()}{i}@example.com",
+                'registration_date': '2025-09-21 10:00:00', 'total_scans': 0
+            })
+
+def linear_search(path, term):
+    """The search PatientDataManager used before indexing"""
+    term = term.lower()
+    with open(path, 'r', encoding='utf-8') as file:
+        return [row for row in csv.DictReader(file)
+                if term in row['first_name'].lower() or term in row['last_name'].lower()
+                or term in row['email'].lower() or term in row['patient_id'].lower()]
+
+def timed(fn, terms):
+    """Return per-search latencies in milliseconds"""
+    latencies = []
+    for term in terms:
+        started = time.perf_counter()
+        fn(term)
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return latencies
+
+def percentile(values, pct):
+    return values[min(len(values) - 1, int(pct / 100 * len(values)))]
+
+def run(count, searches, linear_searches):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'patient_data.csv')
+        write_patients(path, count)
+        manager = PatientDataManager(path)
+
+        started = time.perf_counter()
+        manager.search_index.refresh()
+        build_s = time.perf_counter() - started
+
+        # Selective terms (an ID, a full email) and broad ones (a surname stem)
+        selective = [random.choice([f"PT-{random.randrange(count):08X}", f"{random.randrange(count)}@example"])
+                     for _ in range(searches)]
+        broad = [f"{random.choice(LAST_NAMES)}{random.randrange(997)}" for _ in range(searches)]
+        indexed = timed(lambda term: manager.search_patients(term, limit=20), selective)
+        indexed_broad = timed(lambda term: manager.search_patients(term, limit=20), broad)
+        linear = timed(lambda term: linear_search(path, term), selective[:linear_searches])
+
+        print(f"{count:>9,} patients | index build {build_s:7.2f}s | "
+              f"selective p50 {percentile(indexed, 50):6.2f}ms p99 {percentile(indexed, 99):6.2f}ms | "
+              f"broad p50 {percentile(indexed_broad, 50):6.2f}ms | "
+              f"linear scan p50 {percentile(linear, 50):9.1f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark PatientDataManager search')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--searches', type=int, default=1_000)
+    parser.add_argument('--linear-searches', type=int, default=10)
+    args = parser.parse_args()
+
+    print("🚀 Patient search benchmark\n")
+    for count in args.sizes:
+        run(count, args.searches, args.linear_searches)
+
+if __name__ == "__main__":
+    main()
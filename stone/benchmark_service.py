@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+Load-test the Flask service end to end
+
+Concurrent clients drive /predict, /generate-report, /chat and the
+user/doctor endpoints over HTTP with a weighted request mix built from
+data/test. By default the app is started in-process in a scratch directory
+with the LLM pointed at mock_llm_server, so runs are reproducible and
+offline; --url targets a server that is already running instead (pass
+--pid to sample its memory).
+
+Results (throughput, latency percentiles, error rates, RSS) are saved per
+commit under runs/bench/, and --baseline compares against an earlier run
+and exits non-zero on regressions.
+
+Usage:
+    python benchmark_service.py --concurrency 8 --duration 30
+    python benchmark_service.py --mix predict=1 chat=1 --baseline runs/bench/service-1a2b3c4.json
+    python benchmark_service.py --url http://localhost:5000 --pid 12345
+"""
+
+import argparse
+import base64
+import http.client
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+import numpy as np
+from evaluate_detector import load_dataset
+from safe_io import atomic_write
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MIX = {'predict': 4, 'report': 1, 'chat': 2, 'save_user': 1, 'get_user': 2, 'doctor': 1}
+QUESTIONS = [
+    "How much water should I drink?",
+    "What foods should I avoid?",
+    "When should I see a doctor?",
+    "Can this stone pass on its own?"
+]
+LATENCY_PERCENTILES = (50, 90, 95, 99)
+
+
+def multipart_body(fields, files):
+    """multipart/form-data body and content type; files maps field -> (filename, bytes, content type)"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data, content_type) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: {content_type}\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Workload:
+    """
+    Request bodies for the mix, prepared once from an image/label split so
+    the clients only spend time on HTTP during the run
+    """
+
+    def __init__(self, image_dir, label_dir, limit=32):
+        self.scans = []
+        for sample in load_dataset(image_dir, label_dir)[:limit]:
+            with open(sample['path'], 'rb') as file:
+                data = file.read()
+            detections = [{
+                'id': i,
+                'bbox': [round(float(value), 1) for value in box],
+                'confidence': 0.85,
+                'diameter_px': float(max(box[2] - box[0], box[3] - box[1])),
+                'diameter_mm': round(float(max(box[2] - box[0], box[3] - box[1]) * sample['pixel_to_mm']), 2),
+                'type': 'kidney_stone',
+                'position': 'middle-left'
+            } for i, box in enumerate(sample['boxes'], 1)]
+            self.scans.append({'filename': os.path.basename(sample['path']), 'data': data, 'detections': detections})
+        if not self.scans:
+            raise ValueError(f"No images found in {image_dir}")
+
+    def request(self, operation, rng, state):
+        """(method, path, body, headers) for one request of the given operation"""
+        scan = rng.choice(self.scans)
+        if operation == 'predict':
+            body, content_type = multipart_body({'patient_id': f"BENCH{rng.randrange(50):03d}"},
+                                                {'image': (scan['filename'], scan['data'], 'image/jpeg')})
+            return 'POST', '/predict', body, {'Content-Type': content_type}
+        if operation == 'report':
+            detections = scan['detections'] or [{'id': 1, 'bbox': [10, 10, 20, 20], 'confidence': 0.85, 'diameter_px': 10.0,
+                                                 'diameter_mm': 3.5, 'type': 'kidney_stone', 'position': 'middle-left'}]
+            payload = {
+                'detections': detections,
+                'summary': {'total_stones': len(detections)},
+                'annotated_image': 'data:image/jpeg;base64,' + base64.b64encode(scan['data']).decode('ascii'),
+                'user_id': rng.choice(state['users']) if state['users'] else ''
+            }
+            return 'POST', '/generate-report', json.dumps(payload).encode(), {'Content-Type': 'application/json'}
+        if operation == 'chat':
+            stones = [{'id': stone['id'], 'diameter_mm': f"{stone['diameter_mm']:.2f} mm", 'position': stone['position'],
+                       'confidence': '85.0%', 'type': stone['type']} for stone in scan['detections'][:3]]
+            payload = {'question': rng.choice(QUESTIONS), 'stones_data': stones}
+            return 'POST', '/chat', json.dumps(payload).encode(), {'Content-Type': 'application/json'}
+        if operation == 'save_user':
+            user_id = f"bench_{state['worker']}_{len(state['users'])}"
+            state['users'].append(user_id)
+            payload = {'user_id': user_id, 'first_name': 'Bench', 'last_name': 'User',
+                       'email': f"{user_id}@example.com", 'phone': '555-000-0000', 'date_of_birth': '1990-01-01'}
+            return 'POST', '/save-user-data', json.dumps(payload).encode(), {'Content-Type': 'application/json'}
+        if operation == 'get_user':
+            user_id = rng.choice(state['users']) if state['users'] else 'bench_missing'
+            return 'GET', f'/get-user-data/{user_id}', None, {}
+        if operation == 'doctor':
+            user_id = rng.choice(state['users']) if state['users'] else f"bench_{state['worker']}_doctor"
+            payload = {'user_id': user_id, 'doctor_phone': '555-111-2222', 'doctor_email': f"dr_{user_id}@example.com"}
+            return 'POST', '/save-doctor-contact', json.dumps(payload).encode(), {'Content-Type': 'application/json'}
+        raise ValueError(f"Unknown operation '{operation}'")
+
+
+class ServiceClient:
+    """One keep-alive HTTP connection per worker, reopened after errors"""
+
+    def __init__(self, base_url, timeout=60):
+        parts = urlsplit(base_url)
+        self.host, self.port, self.timeout = parts.hostname, parts.port or 80, timeout
+        self.connection = None
+
+    def send(self, method, path, body=None, headers=None):
+        """Returns (status, response bytes); status is 0 when the request failed at the HTTP level"""
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self.connection.request(method, path, body=body, headers=headers or {})
+            response = self.connection.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException) as e:
+            self.close()
+            return 0, str(e).encode()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def read_rss(pid):
+    """Resident set size of pid in bytes (Linux /proc), or this process's peak RSS elsewhere"""
+    try:
+        with open(f'/proc/{pid}/status', encoding='ascii') as file:
+            for line in file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if pid == os.getpid():
+        try:
+            import resource
+        except ImportError:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    return None
+
+
+class RssSampler:
+    """Samples a process's RSS on a background thread"""
+
+    def __init__(self, pid, interval=0.25):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            rss = read_rss(self.pid)
+            if rss is not None:
+                self.samples.append(rss)
+            if self._stop.wait(self.interval):
+                return
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        if not self.samples:
+            return None
+        return {'start_mb': round(self.samples[0] / 2**20, 1), 'peak_mb': round(max(self.samples) / 2**20, 1),
+                'end_mb': round(self.samples[-1] / 2**20, 1)}
+
+
+def summarize(records, elapsed):
+    """Throughput, error rate and latency percentiles for a list of (status, seconds) records"""
+    if not records:
+        return {'requests': 0, 'errors': 0, 'error_rate': 0.0, 'throughput_rps': 0.0}
+    statuses = np.array([status for status, _ in records])
+    milliseconds = np.array([seconds for _, seconds in records]) * 1000
+    errors = int(((statuses == 0) | (statuses >= 400)).sum())
+    summary = {
+        'requests': len(records),
+        'errors': errors,
+        'error_rate': round(errors / len(records), 4),
+        'throughput_rps': round(len(records) / elapsed, 2) if elapsed else 0.0,
+        'mean_ms': round(float(milliseconds.mean()), 2)
+    }
+    summary.update({f"p{q}_ms": round(float(np.percentile(milliseconds, q)), 2) for q in LATENCY_PERCENTILES})
+    return summary
+
+
+def run_load(base_url, workload, mix=None, concurrency=4, duration=10.0, max_requests=None, warmup=1.0, seed=0, pid=None):
+    """
+    Drive the service from concurrency workers for duration seconds (or
+    until max_requests have been sent). Requests finishing in the first
+    warmup seconds are sent but not counted.
+
+    Returns:
+        dict with an overall summary, one summary per operation, status counts and RSS
+    """
+    mix = mix or DEFAULT_MIX
+    operations, weights = list(mix), list(mix.values())
+    records = {operation: [] for operation in operations}
+    statuses = {}
+    lock = threading.Lock()
+    sent = [0]
+    sampler = RssSampler(pid) if pid else None
+    if sampler:
+        sampler.start()
+
+    started = time.perf_counter()
+    measure_from = started + warmup
+    deadline = measure_from + duration
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        state = {'worker': index, 'users': []}
+        client = ServiceClient(base_url)
+        while time.perf_counter() < deadline:
+            with lock:
+                if max_requests is not None and sent[0] >= max_requests:
+                    break
+                sent[0] += 1
+            operation = rng.choices(operations, weights)[0]
+            method, path, body, headers = workload.request(operation, rng, state)
+            request_started = time.perf_counter()
+            status, _ = client.send(method, path, body, headers)
+            finished = time.perf_counter()
+            if finished >= measure_from:
+                with lock:
+                    records[operation].append((status, finished - request_started))
+                    statuses[str(status)] = statuses.get(str(status), 0) + 1
+        client.close()
+
+    threads = [threading.Thread(target=worker, args=(index,), daemon=True) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - max(measure_from, started)
+
+    return {
+        'config': {'concurrency': concurrency, 'duration': duration, 'warmup': warmup, 'mix': mix, 'seed': seed},
+        'overall': summarize([record for operation in operations for record in records[operation]], elapsed),
+        'operations': {operation: summarize(records[operation], elapsed) for operation in operations},
+        'status_counts': statuses,
+        'rss': sampler.stop() if sampler else None
+    }
+
+
+def compare_to_baseline(result, baseline, tolerance=0.2):
+    """
+    Regressions against a saved run: p95 latency or peak RSS up, or
+    throughput down, by more than tolerance (a fraction), or error rate up
+    by more than a percentage point.
+
+    Returns:
+        list of human-readable regression descriptions (empty when none)
+    """
+    regressions = []
+    for name, current in [('overall', result['overall'])] + list(result['operations'].items()):
+        previous = baseline['overall'] if name == 'overall' else baseline.get('operations', {}).get(name)
+        if not previous or not previous.get('requests') or not current.get('requests'):
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95_ms']} -> {current['p95_ms']} ms")
+        if current['error_rate'] > previous['error_rate'] + 0.01:
+            regressions.append(f"{name}: error rate {previous['error_rate']:.2%} -> {current['error_rate']:.2%}")
+        if name == 'overall' and current['throughput_rps'] < previous['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"overall: throughput {previous['throughput_rps']} -> {current['throughput_rps']} req/s")
+    if result.get('rss') and baseline.get('rss') and result['rss']['peak_mb'] > baseline['rss']['peak_mb'] * (1 + tolerance):
+        regressions.append(f"peak RSS {baseline['rss']['peak_mb']} -> {result['rss']['peak_mb']} MB")
+    return regressions
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def save_result(result, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    atomic_write(path, lambda file: json.dump(result, file, indent=2))
+    return path
+
+
+def print_result(result):
+    print(f"{'Operation':<12}{'Requests':>10}{'Errors':>8}{'Req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, summary in [('overall', result['overall'])] + list(result['operations'].items()):
+        if summary['requests']:
+            print(f"{name:<12}{summary['requests']:>10}{summary['errors']:>8}{summary['throughput_rps']:>9}"
+                  f"{summary['p50_ms']:>10}{summary['p95_ms']:>10}{summary['p99_ms']:>10}")
+    if result['rss']:
+        print(f"RSS: {result['rss']['start_mb']} MB at start, {result['rss']['peak_mb']} MB peak, {result['rss']['end_mb']} MB at end")
+    print(f"Status codes: {result['status_counts']}")
+
+
+def start_in_process(workdir, llm_latency=0.2, llm_token_delay=0.01):
+    """
+    Start the mock LLM and the Flask app (threaded WSGI server) in this
+    process, with all data files in workdir.
+
+    Returns:
+        (base_url, shutdown function)
+    """
+    from mock_llm_server import start_mock_server
+    from werkzeug.serving import make_server
+
+    llm_server, llm_url = start_mock_server(latency=llm_latency, token_delay=llm_token_delay)
+    os.environ['LLM_BASE_URL'] = llm_url
+    os.environ.setdefault('OPENROUTER_API_KEY', 'benchmark')
+    os.environ.setdefault('ALERT_WORKER', 'false')
+    # flask_app keeps its uploads, reports and CSV/SQLite files relative to the working directory
+    os.chdir(workdir)
+    from flask_app import app
+
+    # Per-request access logging would be measured along with the app
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def shutdown():
+        server.shutdown()
+        llm_server.shutdown()
+    return f"http://127.0.0.1:{server.server_port}", shutdown
+
+
+def parse_mix(items):
+    """['predict=4', 'chat=1'] -> {'predict': 4.0, 'chat': 1.0}"""
+    mix = {}
+    for item in items:
+        name, _, weight = item.partition('=')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the stone detection service')
+    parser.add_argument('--url', help='benchmark a running server instead of starting the app in-process')
+    parser.add_argument('--pid', type=int, help='process to sample RSS from with --url')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=3)
+    parser.add_argument('--requests', type=int, default=None, help='stop after this many requests')
+    parser.add_argument('--mix', nargs='*', default=[f"{name}={weight}" for name, weight in DEFAULT_MIX.items()],
+                        help='operation=weight among predict, report, chat, save_user, get_user, doctor')
+    parser.add_argument('--images', default=os.path.join(HERE, 'data', 'test', 'images'))
+    parser.add_argument('--labels', default=os.path.join(HERE, 'data', 'test', 'labels'))
+    parser.add_argument('--llm-latency', type=float, default=0.2, help='mock LLM seconds before the first byte')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='result file (default runs/bench/service-<commit>.json)')
+    parser.add_argument('--baseline', help='earlier result file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    workload = Workload(args.images, args.labels)
+    mix = parse_mix(args.mix)
+    commit = current_commit()
+    output = os.path.abspath(args.output or os.path.join(HERE, 'runs', 'bench', f"service-{commit}.json"))
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+
+    shutdown = None
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.url:
+            base_url, pid = args.url.rstrip('/'), args.pid
+        else:
+            base_url, shutdown = start_in_process(workdir, args.llm_latency)
+            pid = os.getpid()
+        print(f"🚀 Load test: {base_url}, {args.concurrency} clients, {args.duration}s, mix {mix}\n")
+        try:
+            result = run_load(base_url, workload, mix, args.concurrency, args.duration, args.requests,
+                              args.warmup, args.seed, pid)
+        finally:
+            if shutdown:
+                shutdown()
+                os.chdir(HERE)
+
+    result.update(commit=commit, mode='remote' if args.url else 'in-process', timestamp=time.strftime('%Y-%m-%dT%H:%M:%S'))
+    print_result(result)
+    print(f"\nResults saved to {save_result(result, output)}")
+
+    if baseline_path:
+        with open(baseline_path, encoding='utf-8') as file:
+            baseline = json.load(file)
+        regressions = compare_to_baseline(result, baseline, args.tolerance)
+        print(f"\nCompared with {baseline.get('commit', baseline_path)}:")
+        for regression in regressions:
+            print(f"❌ {regression}")
+        if regressions:
+            raise SystemExit(1)
+        print("✅ No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Compare the CSV and SQLite storage backends under concurrent writers
+
+Each writer process saves users and doctor contacts through the backend's
+manager; afterwards every user is looked up and missing rows are reported.
+
+Usage:
+    python benchmark_storage.py --writers 8 --users-per-writer 500
+"""
+
+import argparse
+import csv
+import os
+import random
+import tempfile
+import time
+from multiprocessing import Pool
+from simple_user_manager import SimpleUserDataManager, DOCTOR_FIELDS
+from sqlite_storage import SQLiteUserDataManager
+
+def make_manager(backend, workdir):
+    if backend == 'sqlite':
+        return SQLiteUserDataManager(os.path.join(workdir, 'stone_data.db'))
+    return SimpleUserDataManager(
+        os.path.join(workdir, 'user_data.csv'),
+        os.path.join(workdir, 'doctor_contacts.csv')
+    )
+
+def writer(args):
+    """Save users and doctor contacts from one process; returns elapsed seconds"""
+    backend, workdir, writer_id, count = args
+    manager = make_manager(backend, workdir)
+    started = time.perf_counter()
+    for i in range(count):
+        user_id = f"w{writer_id}_u{i}"
+        manager.save_user_data({
+            'user_id': user_id, 'first_name': 'Bench', 'last_name': f"User{i}",
+            'email': f"{user_id}@example.com", 'phone': '555-000-0000',
+            'date_of_birth': '1990-01-01'
+        })
+        if i % 10 == 0:
+            manager.save_doctor_contact({'user_id': user_id, 'doctor_email': f"dr_{user_id}@example.com"})
+    return time.perf_counter() - started
+
+def run(backend, writers, users_per_writer, lookups):
+    with tempfile.TemporaryDirectory() as workdir:
+        make_manager(backend, workdir)  # create files/schema up front
+
+        started = time.perf_counter()
+        with Pool(writers) as pool:
+            pool.map(writer, [(backend, workdir, w, users_per_writer) for w in range(writers)])
+        write_s = time.perf_counter() - started
+        total = writers * users_per_writer
+
+        manager = make_manager(backend, workdir)
+        missing = sum(
+            1 for w in range(writers) for i in range(users_per_writer)
+            if manager.get_user_by_id(f"w{w}_u{i}") is None
+        )
+        missing_contacts = sum(
+            1 for w in range(writers) for i in range(0, users_per_writer, 10)
+            if manager.get_doctor_contact(f"w{w}_u{i}") is None
+        )
+
+        keys = [f"w{random.randrange(writers)}_u{random.randrange(users_per_writer)}" for _ in range(lookups)]
+        started = time.perf_counter()
+        for key in keys:
+            manager.get_user_by_id(key)
+        lookup_s = time.perf_counter() - started
+
+        print(f"{backend:>6} | {total / write_s:9.0f} writes/s | {lookups / lookup_s:9.0f} lookups/s | "
+              f"lost users {missing} | lost doctor contacts {missing_contacts}")
+
+def run_contact_saves(existing_contacts, saves):
+    """Measure CSV doctor contact save latency with a given number of existing contacts"""
+    with tempfile.TemporaryDirectory() as workdir:
+        with open(os.path.join(workdir, 'doctor_contacts.csv'), 'w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            writer.writerow(DOCTOR_FIELDS)
+            for i in range(existing_contacts):
+                writer.writerow([f"seed_{i}", '', 'dr@example.com', '2025-09-21'])
+        manager = make_manager('csv', workdir)
+        manager.get_doctor_contact('seed_0')  # load the index before timing
+
+        latencies = []
+        for i in range(saves):
+            started = time.perf_counter()
+            manager.save_doctor_contact({'user_id': f"seed_{random.randrange(existing_contacts)}", 'doctor_phone': str(i)})
+            latencies.append((time.perf_counter() - started) * 1000)
+        manager.doctor_contacts.stop_compactor()
+        latencies.sort()
+        print(f"{existing_contacts:>9,} contacts | save p50 {latencies[len(latencies) // 2]:.3f}ms "
+              f"p99 {latencies[int(len(latencies) * 0.99)]:.3f}ms max {latencies[-1]:.3f}ms | "
+              f"{manager.doctor_contacts.compactions} background compactions")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CSV vs SQLite storage backends')
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--users-per-writer', type=int, default=500)
+    parser.add_argument('--lookups', type=int, default=10_000)
+    parser.add_argument('--backends', nargs='*', default=['csv', 'sqlite'])
+    parser.add_argument('--contact-sizes', type=int, nargs='*', default=[1_000, 10_000, 100_000])
+    # Past the compaction threshold at every size (1,000 changes or 10% of the contacts),
+    # so background compactions run while saves are timed
+    parser.add_argument('--contact-saves', type=int, default=25_000)
+    args = parser.parse_args()
+
+    print(f"🚀 Storage benchmark: {args.writers} writers x {args.users_per_writer} users\n")
+    for backend in args.backends:
+        run(backend, args.writers, args.users_per_writer, args.lookups)
+
+    if args.contact_sizes:
+        print("\nDoctor contact save latency (CSV change log)")
+        for size in args.contact_sizes:
+            run_contact_saves(size, args.contact_saves)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Benchmark user lookups in SimpleUserDataManager against a linear CSV scan
+
+Usage:
+    python benchmark_user_lookup.py                 # 10k, 100k and 1M users
+    python benchmark_user_lookup.py --sizes 10000
+"""
+
+import argparse
+import csv
+import os
+import random
+import tempfile
+import time
+from simple_user_manager import SimpleUserDataManager, USER_FIELDS
+
+def write_users(path, count):
+    """Write a synthetic user CSV with count rows"""
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(USER_FIELDS)
+        for i in range(count):
+            writer.writerow([
+                f"user_{i:07d}", "First", f"Last{i}", f"user{i}@example.com",
+                "555-000-0000", "1990-01-01", "2025-09-21"
+            ])
+
+def linear_lookup(path, user_id):
+    """The lookup SimpleUserDataManager used before indexing"""
+    with open(path, 'r', encoding='utf-8') as file:
+        for row in csv.DictReader(file):
+            if row['user_id'] == user_id:
+                return row
+    return None
+
+def timed(fn, keys):
+    """Return per-lookup latencies in microseconds"""
+    latencies = []
+    for key in keys:
+        started = time.perf_counter()
+        fn(key)
+        latencies.append((time.perf_counter() - started) * 1e6)
+    latencies.sort()
+    return latencies
+
+def percentile(values, pct):
+    return values[min(len(values) - 1, int(pct / 100 * len(values)))]
+
+def run(count, lookups, linear_lookups):
+    with tempfile.TemporaryDirectory() as tmp:
+        users_path = os.path.join(tmp, 'user_data.csv')
+        write_users(users_path, count)
+        manager = SimpleUserDataManager(users_path, os.path.join(tmp, 'doctor_contacts.csv'))
+
+        started = time.perf_counter()
+        manager.user_index.refresh()
+        load_s = time.perf_counter() - started
+
+        ids = [f"user_{random.randrange(count):07d}" for _ in range(lookups)]
+        emails = [f"user{random.randrange(count)}@example.com" for _ in range(lookups)]
+        by_id = timed(manager.get_user_by_id, ids)
+        by_email = timed(manager.get_user_by_email, emails)
+        linear = timed(lambda key: linear_lookup(users_path, key), ids[:linear_lookups])
+
+        print(f"{count:>9,} users | index load {load_s:7.3f}s | "
+              f"by id p50 {percentile(by_id, 50):6.1f}us p99 {percentile(by_id, 99):6.1f}us | "
+              f"by email p50 {percentile(by_email, 50):6.1f}us | "
+              f"linear scan p50 {percentile(linear, 50) / 1000:9.1f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark SimpleUserDataManager lookups')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--lookups', type=int, default=10_000)
+    parser.add_argument('--linear-lookups', type=int, default=20)
+    args = parser.parse_args()
+
+    print("🚀 User lookup benchmark\n")
+    for count in args.sizes:
+        run(count, args.lookups, args.linear_lookups)
+
+if __name__ == "__main__":
+    main()
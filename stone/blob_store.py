@@ -0,0 +1,341 @@
+import hashlib
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+DIGEST_NAME = re.compile(r'^([0-9a-f]{64})(\.[a-z0-9]{1,5})?$')
+CHUNK_SIZE = 1024 * 1024
+
+
+class BlobStore:
+    """
+    Content-addressed file store with reference counting.
+
+    Files live under objects/<aa>/<bb>/<sha256><ext>, so identical content is
+    stored once whatever name it arrived under. Every put() adds a reference
+    of some kind (upload, annotated, report) that expires after that kind's
+    TTL; a blob is deleted once no references remain. When the store grows
+    past quota_bytes the oldest references are expired early. Reference
+    counts live in SQLite next to the files and every change to them runs in
+    a write transaction, so several workers can share one store.
+
+    Loose files from before the store existed (uploads saved under their
+    client filename, annotated_* and temp_annotated_* images, old reports)
+    are removed once older than legacy_ttl_seconds.
+    """
+
+    def __init__(self, root, ttl_seconds=None, quota_bytes=None, legacy_ttl_seconds=None, grace_seconds=60):
+        self.root = root
+        self.objects_dir = os.path.join(root, 'objects')
+        self.db_path = os.path.join(root, '.blobs.db')
+        self.ttl_seconds = ttl_seconds or {}
+        self.quota_bytes = quota_bytes
+        self.legacy_ttl_seconds = legacy_ttl_seconds
+        # References younger than this are never evicted for quota: their request may still be using the file
+        self.grace_seconds = grace_seconds
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"puts": 0, "deduplicated": 0, "bytes_written": 0, "bytes_deduplicated": 0,
+                      "sweeps": 0, "refs_expired": 0, "refs_evicted": 0, "blobs_deleted": 0,
+                      "bytes_deleted": 0, "legacy_files_deleted": 0}
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                "digest TEXT PRIMARY KEY, ext TEXT NOT NULL, size INTEGER NOT NULL, "
+                "refcount INTEGER NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS refs ("
+                "ref TEXT PRIMARY KEY, digest TEXT NOT NULL, kind TEXT NOT NULL, "
+                "created_at REAL NOT NULL, expires_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS refs_expiry ON refs (expires_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS refs_created ON refs (created_at)")
+        finally:
+            conn.close()
+
+    def _relative_path(self, digest, ext):
+        # Always '/'-separated: the path is also used in URLs and send_from_directory()
+        return '/'.join(('objects', digest[:2], digest[2:4], digest + ext))
+
+    def put(self, source, kind, ext=''):
+        """
+        Store bytes or a readable binary stream and add a reference to it.
+
+        Returns:
+            dict with 'ref' (pass to release()), 'digest', 'name' (for resolve()),
+            'path', 'relative_path', 'size' and whether it 'deduplicated'
+        """
+        ext = ext.lower() if ext and re.match(r'^\.[A-Za-z0-9]{1,5}$', ext) else ''
+        fd, temp_path = tempfile.mkstemp(dir=self.objects_dir, prefix='.incoming-')
+        try:
+            digest, size = hashlib.sha256(), 0
+            with os.fdopen(fd, 'wb') as file:
+                chunks = [source] if isinstance(source, (bytes, bytearray)) else iter(lambda: source.read(CHUNK_SIZE), b'')
+                for chunk in chunks:
+                    digest.update(chunk)
+                    file.write(chunk)
+                    size += len(chunk)
+                file.flush()
+                os.fsync(file.fileno())
+            digest = digest.hexdigest()
+
+            relative_path = self._relative_path(digest, ext)
+            path = os.path.join(self.root, relative_path)
+            ref, now = uuid.uuid4().hex, time.time()
+            ttl = self.ttl_seconds.get(kind)
+
+            placed = False
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute("SELECT ext FROM blobs WHERE digest = ?", (digest,)).fetchone()
+                if row is not None:
+                    # Same content under another extension keeps the first one
+                    relative_path = self._relative_path(digest, row[0])
+                    path = os.path.join(self.root, relative_path)
+                deduplicated = row is not None and os.path.exists(path)
+                if not deduplicated:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(temp_path, path)
+                    placed = True
+                if row is not None:
+                    conn.execute("UPDATE blobs SET refcount = refcount + 1 WHERE digest = ?", (digest,))
+                else:
+                    conn.execute(
+                        "INSERT INTO blobs (digest, ext, size, refcount, created_at) VALUES (?, ?, ?, 1, ?)",
+                        (digest, ext, size, now)
+                    )
+                conn.execute(
+                    "INSERT INTO refs (ref, digest, kind, created_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+                    (ref, digest, kind, now, now + ttl if ttl else None)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                # No row refers to the file we moved in (the write lock kept other puts out meanwhile)
+                if placed:
+                    os.remove(path)
+                raise
+            finally:
+                conn.close()
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        with self._lock:
+            self.stats["puts"] += 1
+            if deduplicated:
+                self.stats["deduplicated"] += 1
+                self.stats["bytes_deduplicated"] += size
+            else:
+                self.stats["bytes_written"] += size
+        return {'ref': ref, 'digest': digest, 'name': os.path.basename(path), 'path': path,
+                'relative_path': relative_path, 'size': size, 'deduplicated': deduplicated}
+
+    def release(self, ref):
+        """Drop a reference; the blob goes at the next sweep once nothing else refers to it"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            released = self._drop_refs(conn, [ref])
+            conn.execute("COMMIT")
+            return released > 0
+        except sqlite3.Error as e:
+            conn.execute("ROLLBACK")
+            print(f"Error releasing blob reference: {e}")
+            return False
+        finally:
+            conn.close()
+
+    def _drop_refs(self, conn, refs):
+        dropped = 0
+        for ref in refs:
+            row = conn.execute("SELECT digest FROM refs WHERE ref = ?", (ref,)).fetchone()
+            if row is None:
+                continue
+            conn.execute("DELETE FROM refs WHERE ref = ?", (ref,))
+            conn.execute("UPDATE blobs SET refcount = refcount - 1 WHERE digest = ?", (row[0],))
+            dropped += 1
+        return dropped
+
+    def resolve(self, name):
+        """Path relative to root for a '<digest><ext>' name, or None if it is not stored"""
+        match = DIGEST_NAME.match(name or '')
+        if not match:
+            return None
+        relative_path = self._relative_path(match.group(1), match.group(2) or '')
+        return relative_path if os.path.exists(os.path.join(self.root, relative_path)) else None
+
+    def sweep(self):
+        """Expire references past their TTL, enforce the quota and delete unreferenced blobs"""
+        now = time.time()
+        result = {"refs_expired": 0, "refs_evicted": 0, "blobs_deleted": 0, "bytes_deleted": 0, "legacy_files_deleted": 0}
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            expired = [row[0] for row in conn.execute(
+                "SELECT ref FROM refs WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))]
+            result["refs_expired"] = self._drop_refs(conn, expired)
+
+            if self.quota_bytes:
+                stored = conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs WHERE refcount > 0").fetchone()[0]
+                # Oldest references first; a blob's bytes are freed when its last reference goes
+                for ref, digest, size in conn.execute(
+                    "SELECT refs.ref, refs.digest, blobs.size FROM refs JOIN blobs ON blobs.digest = refs.digest "
+                    "WHERE refs.created_at < ? ORDER BY refs.created_at", (now - self.grace_seconds,)
+                ).fetchall():
+                    if stored <= self.quota_bytes:
+                        break
+                    result["refs_evicted"] += self._drop_refs(conn, [ref])
+                    if conn.execute("SELECT refcount FROM blobs WHERE digest = ?", (digest,)).fetchone()[0] == 0:
+                        stored -= size
+
+            for digest, ext, size in conn.execute("SELECT digest, ext, size FROM blobs WHERE refcount <= 0").fetchall():
+                try:
+                    os.remove(os.path.join(self.root, self._relative_path(digest, ext)))
+                except FileNotFoundError:
+                    pass
+                conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+                result["blobs_deleted"] += 1
+                result["bytes_deleted"] += size
+            conn.execute("COMMIT")
+        except Exception as e:
+            conn.execute("ROLLBACK")
+            print(f"Error sweeping blob store: {e}")
+        finally:
+            conn.close()
+
+        result["legacy_files_deleted"] = self._sweep_legacy(now)
+        with self._lock:
+            self.stats["sweeps"] += 1
+            for key, value in result.items():
+                self.stats[key] += value
+        return result
+
+    def _legacy_files(self):
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.startswith('.blobs.db'):
+                    yield entry
+
+    def _sweep_legacy(self, now):
+        # Temp files left behind by a put() that crashed
+        with os.scandir(self.objects_dir) as entries:
+            for entry in entries:
+                try:
+                    if entry.name.startswith('.incoming-') and now - entry.stat().st_mtime > 3600:
+                        os.remove(entry.path)
+                except OSError:
+                    pass
+
+        if self.legacy_ttl_seconds is None:
+            return 0
+        deleted = 0
+        for entry in self._legacy_files():
+            try:
+                if now - entry.stat().st_mtime > self.legacy_ttl_seconds:
+                    os.remove(entry.path)
+                    deleted += 1
+            except OSError as e:
+                print(f"Error removing {entry.path}: {e}")
+        return deleted
+
+    def get_stats(self):
+        """Disk usage: stored vs referenced bytes per kind, plus sweeper counters"""
+        conn = self._connect()
+        try:
+            blobs, stored_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+            kinds = {kind: {"refs": refs, "bytes": size} for kind, refs, size in conn.execute(
+                "SELECT refs.kind, COUNT(*), COALESCE(SUM(blobs.size), 0) FROM refs "
+                "JOIN blobs ON blobs.digest = refs.digest GROUP BY refs.kind")}
+            unreferenced = conn.execute("SELECT COUNT(*) FROM blobs WHERE refcount <= 0").fetchone()[0]
+        finally:
+            conn.close()
+
+        legacy_files, legacy_bytes = 0, 0
+        for entry in self._legacy_files():
+            legacy_files += 1
+            legacy_bytes += entry.stat().st_size
+
+        logical_bytes = sum(kind["bytes"] for kind in kinds.values())
+        with self._lock:
+            stats = dict(self.stats)
+        stats.update({
+            "blobs": blobs,
+            "unreferenced_blobs": unreferenced,
+            "stored_bytes": stored_bytes,
+            "referenced_bytes": logical_bytes,
+            "dedupe_ratio": round(logical_bytes / stored_bytes, 3) if stored_bytes else None,
+            "quota_bytes": self.quota_bytes,
+            "quota_used": round(stored_bytes / self.quota_bytes, 3) if self.quota_bytes else None,
+            "by_kind": kinds,
+            "legacy_files": legacy_files,
+            "legacy_bytes": legacy_bytes
+        })
+        return stats
+
+    def start(self, interval_seconds=600):
+        """Sweep every interval_seconds on a daemon thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval_seconds,), name='blob-sweeper', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self, interval_seconds):
+        while not self._stop.wait(interval_seconds):
+            self.sweep()
+
+
+def blob_stores_from_env(upload_folder, reports_folder):
+    """
+    Create the upload and report stores configured through environment variables:
+    UPLOAD_TTL_HOURS, ANNOTATED_TTL_HOURS, REPORT_TTL_HOURS, LEGACY_FILE_TTL_HOURS,
+    UPLOADS_QUOTA_MB, REPORTS_QUOTA_MB (0 for no quota) and STORAGE_SWEEP_INTERVAL seconds.
+    """
+    def hours(name, default):
+        return float(os.getenv(name, default)) * 3600
+
+    def quota(name):
+        megabytes = float(os.getenv(name, '1024'))
+        return int(megabytes * 1024 * 1024) if megabytes > 0 else None
+
+    legacy_ttl = hours('LEGACY_FILE_TTL_HOURS', '168')
+    uploads = BlobStore(
+        upload_folder,
+        ttl_seconds={'upload': hours('UPLOAD_TTL_HOURS', '168'), 'annotated': hours('ANNOTATED_TTL_HOURS', '24')},
+        quota_bytes=quota('UPLOADS_QUOTA_MB'),
+        legacy_ttl_seconds=legacy_ttl
+    )
+    reports = BlobStore(
+        reports_folder,
+        ttl_seconds={'report': hours('REPORT_TTL_HOURS', '720')},
+        quota_bytes=quota('REPORTS_QUOTA_MB'),
+        legacy_ttl_seconds=legacy_ttl
+    )
+    interval = float(os.getenv('STORAGE_SWEEP_INTERVAL', '600'))
+    if interval > 0:
+        uploads.start(interval)
+        reports.start(interval)
+    return uploads, reports
@@ -0,0 +1,204 @@
+import csv
+import io
+import os
+import threading
+import time
+from safe_io import FileLock, GroupCommitWriter, atomic_write
+
+
+class ChangeLogTable:
+    """
+    Keyed CSV table updated through an append-only change log.
+
+    Upserts append one row to <csv>.log (O(1) I/O) and update an in-memory
+    index; reads are last-write-wins over the base CSV followed by the log.
+    compact() folds the log into the base CSV with an atomic temp-file +
+    rename and truncates the log. Appends and compaction hold an exclusive
+    cross-process lock on <csv>.lock; reloads hold a shared one.
+
+    Compaction runs on a background thread, periodically and whenever the
+    log reaches compact_threshold entries or compact_ratio of the table
+    (whichever is larger), so upserts never pay for the O(n) rewrite and
+    its cost per upsert stays constant as the table grows.
+    """
+
+    def __init__(self, csv_file_path, fields, key_field, compact_threshold=1000, compact_ratio=0.1):
+        self.csv_file_path = csv_file_path
+        self.log_path = csv_file_path + '.log'
+        self.fields = fields
+        self.key_field = key_field
+        self.compact_threshold = compact_threshold
+        self.compact_ratio = compact_ratio
+        self.file_lock = FileLock(csv_file_path + '.lock')
+        self.rows = {}
+        self.log_entries = 0
+        self.compactions = 0
+        self._base_signature = None
+        self._log_offset = 0
+        self._lock = threading.RLock()
+        self._compactor = None
+        self._compactor_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._compact_requested = threading.Event()
+        self.log_writer = GroupCommitWriter(
+            self.log_path, self.file_lock, state_lock=self._lock,
+            before_commit=self._refresh_locked,
+            after_commit=lambda *_: self._read_log_tail()
+        )
+
+    @staticmethod
+    def _signature(path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    @staticmethod
+    def _size(path):
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+
+    def refresh(self):
+        """Pick up appends and compactions made by other processes"""
+        with self._lock:
+            # Fast path without the file lock: nothing changed on disk
+            if (self._base_signature is not None
+                    and self._signature(self.csv_file_path) == self._base_signature
+                    and self._size(self.log_path) == self._log_offset):
+                return
+            with self.file_lock.acquire(shared=True):
+                self._refresh_locked()
+
+    def _refresh_locked(self):
+        base_signature = self._signature(self.csv_file_path)
+        log_size = self._size(self.log_path)
+        if base_signature != self._base_signature or log_size < self._log_offset:
+            # Base was rewritten (or first load): rebuild from scratch
+            rows = {}
+            if base_signature is not None:
+                with open(self.csv_file_path, 'r', newline='', encoding='utf-8') as file:
+                    for row in csv.DictReader(file):
+                        rows[row[self.key_field]] = row
+            self.rows = rows
+            self._base_signature = base_signature
+            self._log_offset = 0
+            self.log_entries = 0
+        self._read_log_tail()
+
+    def _read_log_tail(self):
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, 'rb') as file:
+            file.seek(self._log_offset)
+            data = file.read()
+        # Only consume complete lines; a torn final line is left for later
+        end = data.rfind(b'\n') + 1
+        if end == 0:
+            return
+        for values in csv.reader(io.StringIO(data[:end].decode('utf-8'), newline='')):
+            if len(values) != len(self.fields):
+                continue
+            row = dict(zip(self.fields, values))
+            self.rows[row[self.key_field]] = row
+            self.log_entries += 1
+        self._log_offset += end
+
+    def get(self, key):
+        """Return a copy of the latest row for key, or None"""
+        with self._lock:
+            self.refresh()
+            row = self.rows.get(key)
+            return dict(row) if row is not None else None
+
+    def upsert(self, row):
+        """Append a change for row[key_field]; the latest write wins"""
+        line = io.StringIO()
+        csv.writer(line).writerow([row.get(field, '') for field in self.fields])
+        self.log_writer.append(line.getvalue())
+        with self._lock:
+            needs_compaction = self.compact_threshold and self.log_entries >= max(
+                self.compact_threshold, self.compact_ratio * len(self.rows))
+        if needs_compaction:
+            # Hand the rewrite to the compactor thread instead of blocking this request
+            self._compact_requested.set()
+            self.start_compactor()
+
+    def compact(self):
+        """
+        Fold the change log into the base CSV atomically and truncate the log.
+
+        The rows are written to a staging file without holding the locks;
+        only the rename and the rewrite of entries logged meanwhile happen
+        under them, so upserts are not blocked for the O(n) write.
+        """
+        with self._lock, self.file_lock.acquire():
+            self._refresh_locked()
+            if self.log_entries == 0:
+                return False
+            # Rows are replaced, never mutated, so a shallow snapshot is stable
+            rows = list(self.rows.values())
+            base_signature, log_offset = self._base_signature, self._log_offset
+
+        def write_rows(file):
+            writer = csv.writer(file)
+            writer.writerow(self.fields)
+            for start in range(0, len(rows), 1000):
+                writer.writerows([row.get(field, '') for field in self.fields] for row in rows[start:start + 1000])
+                # Yield the GIL so request threads are not held up for a whole switch interval
+                time.sleep(0)
+
+        staging_path = f"{self.csv_file_path}.compact-{os.getpid()}-{threading.get_ident()}"
+        try:
+            atomic_write(staging_path, write_rows)
+            with self._lock, self.file_lock.acquire():
+                self._refresh_locked()
+                if self._base_signature != base_signature:
+                    return False  # another process compacted meanwhile
+                # Entries appended after the snapshot stay in the log; replaying them
+                # over the new base is harmless if we crash between the two replaces
+                with open(self.log_path, 'rb') as file:
+                    file.seek(log_offset)
+                    tail = file.read(self._log_offset - log_offset)
+                os.replace(staging_path, self.csv_file_path)
+                atomic_write(self.log_path, lambda file: file.write(tail), binary=True)
+                self._base_signature = self._signature(self.csv_file_path)
+                self._log_offset = len(tail)
+                self.log_entries = tail.count(b'\n')
+                self.compactions += 1
+                return True
+        finally:
+            if os.path.exists(staging_path):
+                os.remove(staging_path)
+
+    def start_compactor(self, interval_seconds=None):
+        """
+        Start the daemon compactor thread: it compacts every interval_seconds
+        (if set) and whenever upsert() signals that the log is over the threshold
+        """
+        with self._compactor_lock:
+            if self._compactor is not None:
+                return
+
+            def run():
+                while True:
+                    self._compact_requested.wait(interval_seconds or None)
+                    if self._stop.is_set():
+                        return
+                    self._compact_requested.clear()
+                    try:
+                        self.compact()
+                    except Exception as e:
+                        print(f"Error compacting {self.csv_file_path}: {e}")
+
+            self._compactor = threading.Thread(target=run, name='change-log-compactor', daemon=True)
+            self._compactor.start()
+
+    def stop_compactor(self):
+        """Stop the compactor thread, waiting for a compaction in progress"""
+        self._stop.set()
+        self._compact_requested.set()
+        if self._compactor is not None:
+            self._compactor.join()
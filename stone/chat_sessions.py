@@ -0,0 +1,147 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token) used for history budgeting"""
+    return max(1, len(text or "") // 4)
+
+
+def _shorten(text, limit):
+    text = " ".join((text or "").split())
+    return text if len(text) <= limit else text[:limit - 3].rstrip() + "..."
+
+
+class ChatSession:
+    """
+    Server-side conversation about one analysis.
+
+    The system prompt and scan context messages are built once when the
+    session is created. Earlier turns are kept verbatim until they exceed
+    token_budget, after which the oldest are folded into a short summary.
+    """
+
+    def __init__(self, session_id, context, base_messages, token_budget=1500):
+        self.session_id = session_id
+        self.context = context
+        self.base_messages = base_messages
+        self.token_budget = token_budget
+        self.history = []
+        self.summary_points = []
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.usage = {"turns": 0, "prompt_tokens": 0, "completion_tokens": 0, "compactions": 0}
+        self.lock = threading.Lock()
+
+    def build_messages(self, user_query):
+        """Messages for the next request: static prefix, summary of older turns, recent turns, new question"""
+        messages = list(self.base_messages)
+        if self.summary_points:
+            messages.append({
+                "role": "system",
+                "content": "Summary of earlier conversation:\n" + "\n".join(self.summary_points)
+            })
+        for question, answer in self.history:
+            messages.append({"role": "user", "content": question})
+            messages.append({"role": "assistant", "content": answer})
+        messages.append({"role": "user", "content": user_query})
+        return messages
+
+    def record_turn(self, question, answer, prompt_tokens=None, completion_tokens=None):
+        """Append a completed turn, update token usage and compact the history if needed"""
+        self.history.append((question, answer))
+        self.usage["turns"] += 1
+        self.usage["prompt_tokens"] += prompt_tokens or 0
+        self.usage["completion_tokens"] += completion_tokens if completion_tokens is not None else estimate_tokens(answer)
+        self.last_used = time.time()
+        self._compact()
+
+    def history_tokens(self):
+        return sum(estimate_tokens(q) + estimate_tokens(a) for q, a in self.history)
+
+    def _compact(self):
+        # Keep at least the latest turn verbatim so follow-ups can refer to it
+        while len(self.history) > 1 and self.history_tokens() > self.token_budget:
+            question, answer = self.history.pop(0)
+            self.summary_points.append(f"• Asked: {_shorten(question, 120)} Answered: {_shorten(answer, 200)}")
+            self.usage["compactions"] += 1
+
+        summary_budget = self.token_budget // 3
+        while len(self.summary_points) > 1 and estimate_tokens("\n".join(self.summary_points)) > summary_budget:
+            self.summary_points.pop(0)
+
+    def to_dict(self):
+        return {
+            "session_id": self.session_id,
+            "created_at": self.created_at,
+            "last_used": self.last_used,
+            "history_turns": len(self.history),
+            "summarized_turns": len(self.summary_points),
+            "history_tokens": self.history_tokens(),
+            "token_budget": self.token_budget,
+            "usage": dict(self.usage)
+        }
+
+
+class ChatSessionStore:
+    """In-process store of chat sessions, expired after ttl_seconds of inactivity"""
+
+    def __init__(self, max_sessions=1000, ttl_seconds=3600, token_budget=1500):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.token_budget = token_budget
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, context, base_messages):
+        """Create a session for an analysis and return it"""
+        chat_session = ChatSession(uuid.uuid4().hex, context, base_messages, self.token_budget)
+        with self._lock:
+            self._sessions[chat_session.session_id] = chat_session
+            self._evict()
+        return chat_session
+
+    def get(self, session_id):
+        """Return the session, or None if it does not exist or has expired"""
+        with self._lock:
+            chat_session = self._sessions.get(session_id)
+            if chat_session is None:
+                return None
+            if time.time() - chat_session.last_used > self.ttl_seconds:
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+            return chat_session
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def _evict(self):
+        now = time.time()
+        for session_id in [sid for sid, s in self._sessions.items() if now - s.last_used > self.ttl_seconds]:
+            del self._sessions[session_id]
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def get_stats(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return {
+            "active_sessions": len(sessions),
+            "turns": sum(s.usage["turns"] for s in sessions),
+            "prompt_tokens": sum(s.usage["prompt_tokens"] for s in sessions),
+            "completion_tokens": sum(s.usage["completion_tokens"] for s in sessions)
+        }
+
+
+def session_store_from_env():
+    """Create the chat session store configured through CHAT_SESSION_* environment variables"""
+    return ChatSessionStore(
+        max_sessions=int(os.getenv("CHAT_SESSION_MAX", "1000")),
+        ttl_seconds=int(os.getenv("CHAT_SESSION_TTL", "3600")),
+        token_budget=int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "1500"))
+    )
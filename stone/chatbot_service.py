@@ -1,16 +1,95 @@
 import os
-from openai import OpenAI
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
 from dotenv import load_dotenv
+from chat_sessions import session_store_from_env, estimate_tokens
+from intent_router import answer_from_rules
+from llm_client import client_from_env, LLMUnavailableError
+from response_cache import cache_from_env, make_cache_key
 
 load_dotenv()
 
-client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
+# Cache for health advice, keyed by normalized question + bucketed scan context
+response_cache = cache_from_env()
+
+# Answer counts and cumulative latency per tier (rules / cache / llm / fallback / error)
+tier_stats = {}
+_tier_lock = threading.Lock()
+
+# Multi-turn conversations, one per analysis, with token-budgeted history
+chat_sessions = session_store_from_env()
+
+# Outcome counters and (time-to-first-token, total time) samples for streamed chats
+stream_stats = Counter(completed=0, rules=0, cached=0, fallback=0, disconnected=0, error=0)
+_stream_timings = deque(maxlen=1000)
+_stream_lock = threading.Lock()
+
+# Bounded pool shared by all batch stone insight requests, so concurrent scans cannot flood the upstream
+STONE_INSIGHT_WORKERS = int(os.getenv('STONE_INSIGHT_WORKERS', '4'))
+STONE_INSIGHT_TIMEOUT = float(os.getenv('STONE_INSIGHT_TIMEOUT', '30'))
+_insight_executor = ThreadPoolExecutor(max_workers=STONE_INSIGHT_WORKERS, thread_name_prefix='stone-insight')
+
+HEALTH_ADVISOR_PROMPT = """You are an AI health advisor for kidney stones.
+
+Guidelines for responses:
+• Keep answers concise and clear
+• Use bullet points for recommendations  
+• Focus on practical advice
+• Be reassuring but factual
+• Base advice on the stone data provided
+• Structure responses with clear headings when appropriate
+• Use simple, patient-friendly language
+
+Format your responses with:
+- Clear headings followed by colons (e.g., "Dietary Recommendations:")
+- Bullet points using "•" for lists and recommendations
+- Short paragraphs for easy reading
+- Specific advice based on the scan data provided
+- Use measurements like "2-3 liters", "5mm", "2 times per day" 
+- Emphasize important terms like "urgent", "consult doctor", "avoid", "increase"
+
+Example response format:
+Treatment Recommendations:
+• Drink 2-3 liters of water daily
+• Limit sodium to less than 2300mg per day
+• Consider consulting a urologist if stones are larger than 4mm
+
+When to Seek Medical Attention:
+• Severe pain or cramping
+• Blood in urine
+• Fever or chills
+"""
+
+HEALTH_ADVICE_PARAMS = {
+    "temperature": 0.7,
+    "max_tokens": 1000,
+    "top_p": 1,
+    "frequency_penalty": 0.5,
+    "presence_penalty": 0.3,
+    "stop": None,
+    "response_format": { "type": "text" },
+    "seed": 42,  # For consistent responses
+    "extra_body": {
+        "safe_mode": False,  # Since we're providing medical advice
+        "route": "fallback"  # Use fallback if primary route is unavailable
+    }
+}
+
+# LLM_BASE_URL can point at a local OpenAI-compatible server (see mock_llm_server.py) for offline testing
+LLM_BASE_URL = os.getenv('LLM_BASE_URL', "https://openrouter.ai/api/v1")
+LLM_MODEL = os.getenv('LLM_MODEL', "x-ai/grok-4-fast:free")
+
+# Pooled client with deadlines, hedging to LLM_FALLBACK_MODEL and a circuit breaker (see llm_client.py)
+client = client_from_env(
+    base_url=LLM_BASE_URL,
     api_key=os.getenv('OPENROUTER_API_KEY'),
     default_headers={
         "HTTP-Referer": "https://stonesense.ai",
         "X-Title": "StoneSense AI Health Advisor"
-    }
+    },
+    default_model=LLM_MODEL
 )
 
 def create_context(stone_data):
@@ -53,83 +132,289 @@ def create_context(stone_data):
         }
     }
 
-def get_health_advice(stone_data, user_query):
-    """Get personalized health advice based on user's question"""
-    try:
-        context = create_context(stone_data)
-        
-        system_prompt = """You are an AI health advisor for kidney stones.
-
-Guidelines for responses:
-• Keep answers concise and clear
-• Use bullet points for recommendations  
-• Focus on practical advice
-• Be reassuring but factual
-• Base advice on the stone data provided
-• Structure responses with clear headings when appropriate
-• Use simple, patient-friendly language
-
-Format your responses with:
-- Clear headings followed by colons (e.g., "Dietary Recommendations:")
-- Bullet points using "•" for lists and recommendations
-- Short paragraphs for easy reading
-- Specific advice based on the scan data provided
-- Use measurements like "2-3 liters", "5mm", "2 times per day" 
-- Emphasize important terms like "urgent", "consult doctor", "avoid", "increase"
-
-Example response format:
-Treatment Recommendations:
-• Drink 2-3 liters of water daily
-• Limit sodium to less than 2300mg per day
-• Consider consulting a urologist if stones are larger than 4mm
+def build_fallback_advice(context):
+    """Rule-based answer built from the scan context, used when the LLM is unavailable"""
+    largest = context['size_analysis']['largest_stone']
+    lines = [
+        "Your Scan Summary:",
+        f"• {context['stone_count']} stone(s) detected, largest {largest:.1f}mm, average {context['size_analysis']['average_size']:.1f}mm",
+        f"• Left kidney: {context['distribution']['left_kidney']} stones, right kidney: {context['distribution']['right_kidney']} stones",
+        "",
+        "General Recommendations:",
+        "• Drink plenty of water (2-3 liters daily)"
+    ]
+    if largest > 5:
+        lines.append("• Consider consultation with urologist")
+    if largest > 10:
+        lines.append("• Urgent medical attention recommended")
+    lines.extend([
+        "• Monitor symptoms and pain levels",
+        "",
+        "When to Seek Medical Attention:",
+        "• Severe pain or cramping",
+        "• Blood in urine",
+        "• Fever or chills",
+        "",
+        "Our AI advisor is temporarily unavailable, so this is a general summary based on your scan. Please try again shortly for personalized advice."
+    ])
+    return "\n".join(lines)
 
-When to Seek Medical Attention:
-• Severe pain or cramping
-• Blood in urine
-• Fever or chills
-"""
-        
-        context_message = f"""Scan Data:
+def format_scan_context(context):
+    """Format the scan summary shown to the model"""
+    return f"""Scan Data:
         • Stones: {context['stone_count']} total
         • Size: {context['size_analysis']['largest_stone']:.1f}mm largest, {context['size_analysis']['average_size']:.1f}mm average
         • Left kidney: {context['distribution']['left_kidney']} stones
         • Right kidney: {context['distribution']['right_kidney']} stones
-        • Locations: {', '.join(f"Stone {s['id']} ({s['size']:.1f}mm) in {s['position']}" for s in context['stones'])}
+        • Locations: {', '.join(f"Stone {s['id']} ({s['size']:.1f}mm) in {s['position']}" for s in context['stones'])}"""
+
+def build_health_messages(context, user_query):
+    """Build the system and user messages for a health advice request"""
+    return [
+        {
+            "role": "system",
+            "content": HEALTH_ADVISOR_PROMPT
+        },
+        {
+            "role": "user",
+            "content": f"""{format_scan_context(context)}
 
         Q: {user_query}"""
+        }
+    ]
+
+def start_chat_session(stone_data):
+    """Create a server-side chat session for an analysis; the prompt and scan context are built once here"""
+    context = create_context(stone_data)
+    base_messages = [
+        {
+            "role": "system",
+            "content": HEALTH_ADVISOR_PROMPT
+        },
+        {
+            "role": "system",
+            "content": format_scan_context(context)
+        }
+    ]
+    return chat_sessions.create(context, base_messages)
+
+def get_chat_session(session_id):
+    """Get a chat session by ID, or None if unknown or expired"""
+    return chat_sessions.get(session_id)
+
+def answer_session_question(chat_session, user_query):
+    """
+    Answer a follow-up question within a chat session, reusing its context and history.
+    
+    Well-known intents are answered by the rules tier like single questions; the
+    response cache is skipped because session answers depend on the history.
+    
+    Returns:
+        (response, tier) where tier is one of "rules", "llm", "fallback" or "error"
+    """
+    started = time.perf_counter()
+    tier = "error"
+    with chat_session.lock:
+        try:
+            response, intent, confidence = answer_from_rules(user_query, chat_session.context)
+            if response is not None:
+                tier = "rules"
+                chat_session.record_turn(user_query, response)
+                return response, tier
+            
+            messages = chat_session.build_messages(user_query)
+            chat_completion = client.create_completion(
+                model=LLM_MODEL,
+                messages=messages,
+                **HEALTH_ADVICE_PARAMS
+            )
+            
+            response = chat_completion.choices[0].message.content or ""
+            usage = getattr(chat_completion, 'usage', None)
+            prompt_tokens = usage.prompt_tokens if usage else sum(estimate_tokens(m['content']) for m in messages)
+            completion_tokens = usage.completion_tokens if usage else None
+            chat_session.record_turn(user_query, response, prompt_tokens, completion_tokens)
+            tier = "llm"
+            return response, tier
         
-        chat_completion = client.chat.completions.create(
-            model="x-ai/grok-4-fast:free",
-            messages=[
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user",
-                    "content": context_message
-                }
-            ],
-            temperature=0.7,
-            max_tokens=1000,
-            top_p=1,
-            frequency_penalty=0.5,
-            presence_penalty=0.3,
-            stop=None,
-            response_format={ "type": "text" },
-            seed=42,  # For consistent responses
-            extra_body={
-                "safe_mode": False,  # Since we're providing medical advice
-                "route": "fallback"  # Use fallback if primary route is unavailable
-            }
+        except LLMUnavailableError:
+            tier = "fallback"
+            return build_fallback_advice(chat_session.context), tier
+        except Exception as e:
+            return f"I apologize, but I'm unable to process your question at the moment. Error: {str(e)}", tier
+        finally:
+            _record_tier(tier, time.perf_counter() - started)
+
+def get_session_advice(chat_session, user_query):
+    """Answer a follow-up question within a chat session"""
+    return answer_session_question(chat_session, user_query)[0]
+
+def answer_health_question(stone_data, user_query):
+    """
+    Answer a question through the cheapest tier that can handle it.
+    
+    Returns:
+        (response, tier) where tier is one of "rules", "cache", "llm", "fallback" or "error"
+    """
+    started = time.perf_counter()
+    tier = "error"
+    try:
+        context = create_context(stone_data)
+        
+        # Well-known intents are answered locally from templates
+        response, intent, confidence = answer_from_rules(user_query, context)
+        if response is not None:
+            tier = "rules"
+            return response, tier
+        
+        cache_key = make_cache_key("health_advice", user_query, context)
+        cached_response = response_cache.get(cache_key)
+        if cached_response is not None:
+            tier = "cache"
+            return cached_response, tier
+        
+        chat_completion = client.create_completion(
+            model=LLM_MODEL,
+            messages=build_health_messages(context, user_query),
+            **HEALTH_ADVICE_PARAMS
         )
         
-        return chat_completion.choices[0].message.content
+        response = chat_completion.choices[0].message.content
+        if response:
+            response_cache.set(cache_key, response)
+        tier = "llm"
+        return response, tier
+    
+    except LLMUnavailableError:
+        tier = "fallback"
+        return build_fallback_advice(context), tier
+    except Exception as e:
+        return f"I apologize, but I'm unable to process your question at the moment. Error: {str(e)}", tier
+    finally:
+        _record_tier(tier, time.perf_counter() - started)
+
+def get_health_advice(stone_data, user_query):
+    """Get personalized health advice based on user's question"""
+    return answer_health_question(stone_data, user_query)[0]
+
+def stream_health_advice(stone_data, user_query):
+    """
+    Stream personalized health advice as text chunks while the model generates it.
+    
+    Closing the generator (e.g. when the client disconnects) closes the upstream
+    stream. Time-to-first-token and total time are recorded for every stream.
+    """
+    started = time.perf_counter()
+    first_token_at = None
+    status = "completed"
+    stream = None
+    try:
+        context = create_context(stone_data)
+        
+        response, intent, confidence = answer_from_rules(user_query, context)
+        if response is not None:
+            status = "rules"
+            first_token_at = time.perf_counter()
+            yield response
+            return
+        
+        cache_key = make_cache_key("health_advice", user_query, context)
+        cached_response = response_cache.get(cache_key)
+        if cached_response is not None:
+            status = "cached"
+            first_token_at = time.perf_counter()
+            yield cached_response
+            return
+        
+        stream = client.create_completion(
+            model=LLM_MODEL,
+            messages=build_health_messages(context, user_query),
+            stream=True,
+            **HEALTH_ADVICE_PARAMS
+        )
+        
+        chunks = []
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            chunks.append(delta)
+            yield delta
+        
+        response = "".join(chunks)
+        if response:
+            response_cache.set(cache_key, response)
     
+    except LLMUnavailableError:
+        status = "fallback"
+        yield build_fallback_advice(context)
+    except GeneratorExit:
+        status = "disconnected"
+        raise
     except Exception as e:
-        return f"I apologize, but I'm unable to process your question at the moment. Error: {str(e)}"
+        status = "error"
+        yield f"I apologize, but I'm unable to process your question at the moment. Error: {str(e)}"
+    finally:
+        if stream is not None:
+            stream.close()
+        _record_stream(status, started, first_token_at)
+
+def _record_stream(status, started, first_token_at):
+    finished = time.perf_counter()
+    with _stream_lock:
+        stream_stats[status] += 1
+        if first_token_at is not None:
+            _stream_timings.append((first_token_at - started, finished - started))
 
-def get_stone_specific_info(stone):
+def _record_tier(tier, elapsed):
+    with _tier_lock:
+        entry = tier_stats.setdefault(tier, {"count": 0, "total_s": 0.0})
+        entry["count"] += 1
+        entry["total_s"] += elapsed
+
+def get_tier_stats():
+    """Get answer counts, average latency per tier and the share deflected from the LLM"""
+    with _tier_lock:
+        snapshot = {tier: dict(entry) for tier, entry in tier_stats.items()}
+    total = sum(entry["count"] for entry in snapshot.values())
+    tiers = {
+        tier: {"count": entry["count"], "avg_latency_s": round(entry["total_s"] / entry["count"], 4)}
+        for tier, entry in snapshot.items()
+    }
+    deflected = sum(snapshot.get(tier, {}).get("count", 0) for tier in ("rules", "cache"))
+    return {
+        "total": total,
+        "deflection_rate": round(deflected / total, 4) if total else 0.0,
+        "tiers": tiers
+    }
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return round(ordered[index], 4)
+
+def get_stream_stats():
+    """Get outcome counters and time-to-first-token / total-time percentiles for streamed chats"""
+    with _stream_lock:
+        stats = dict(stream_stats)
+        timings = list(_stream_timings)
+    ttft = [t[0] for t in timings]
+    total = [t[1] for t in timings]
+    stats.update({
+        "ttft_p50_s": _percentile(ttft, 50),
+        "ttft_p95_s": _percentile(ttft, 95),
+        "total_p50_s": _percentile(total, 50),
+        "total_p95_s": _percentile(total, 95)
+    })
+    return stats
+
+def get_stone_specific_info(stone, timeout=None):
     """Get specific information about an individual stone"""
     try:
         prompt = f"""As a kidney health advisor, provide brief, specific insights about this kidney stone:
@@ -139,8 +424,8 @@ def get_stone_specific_info(stone):
         
         Focus on what these measurements mean in practical terms and any relevant considerations for this specific stone location."""
         
-        chat_completion = client.chat.completions.create(
-            model="x-ai/grok-4-fast:free",
+        chat_completion = client.create_completion(
+            model=LLM_MODEL,
             messages=[
                 {
                     "role": "system",
@@ -162,10 +447,69 @@ def get_stone_specific_info(stone):
             extra_body={
                 "safe_mode": False,  # Since we're providing medical advice
                 "route": "fallback"  # Use fallback if primary route is unavailable
-            }
+            },
+            timeout=timeout
         )
         
         return chat_completion.choices[0].message.content
     
     except Exception as e:
-        return f"I apologize, but I'm unable to provide specific information about this stone at the moment. Error: {str(e)}"
\ No newline at end of file
+        return f"I apologize, but I'm unable to provide specific information about this stone at the moment. Error: {str(e)}"
+
+def stone_descriptor(stone):
+    """Descriptor used to share one insight between stones of the same size bucket and position"""
+    diameter = stone['diameter_mm']
+    size = float(diameter.split()[0]) if isinstance(diameter, str) else float(diameter)
+    return (round(size), stone['position'])
+
+def iter_stone_insights(stones_data, timeout=STONE_INSIGHT_TIMEOUT):
+    """
+    Fetch insights for every stone concurrently, yielding (stone_id, insight) as each completes.
+    
+    Stones with an identical (size bucket, position) descriptor share a single call.
+    Calls still running after timeout seconds are abandoned with an apology message.
+    Closing the generator early (e.g. the client disconnected) cancels calls not yet started.
+    """
+    groups = {}
+    for stone in stones_data:
+        groups.setdefault(stone_descriptor(stone), []).append(stone)
+    
+    futures = {
+        _insight_executor.submit(get_stone_specific_info, group[0], timeout): group
+        for group in groups.values()
+    }
+    pending = set(futures)
+    try:
+        for future in as_completed(futures, timeout=timeout):
+            pending.discard(future)
+            insight = future.result()
+            for stone in futures[future]:
+                yield stone['id'], insight
+    except FuturesTimeoutError:
+        for future in pending:
+            if future.done():
+                insight = future.result()
+            else:
+                future.cancel()
+                insight = "I apologize, but I'm unable to provide specific information about this stone at the moment. Error: request timed out"
+            for stone in futures[future]:
+                yield stone['id'], insight
+    finally:
+        for future in pending:
+            future.cancel()
+
+def get_batch_stone_insights(stones_data, timeout=STONE_INSIGHT_TIMEOUT):
+    """Get insights for all stones, keyed by stone ID"""
+    return dict(iter_stone_insights(stones_data, timeout))
+
+def get_llm_stats():
+    """Get call, hedging and circuit breaker metrics for the LLM client"""
+    return client.get_stats()
+
+def get_session_stats():
+    """Get active chat session count and aggregate token usage"""
+    return chat_sessions.get_stats()
+
+def get_cache_stats():
+    """Get hit-rate metrics for the health advice response cache"""
+    return response_cache.get_stats()
@@ -0,0 +1,300 @@
+import io
+import os
+import threading
+import time
+import numpy as np
+from safe_io import atomic_write
+
+# Fixed histogram bins: 0.5 mm up to 30 mm (the last bin also holds anything
+# larger) and 5% confidence steps
+SIZE_EDGES = np.append(np.arange(0.0, 30.5, 0.5), np.inf)
+CONFIDENCE_EDGES = np.linspace(0.0, 1.0, 21)
+SEVERITY_LEVELS = ('Normal', 'Moderate', 'Severe')
+SIDES = ('left', 'center', 'right')
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class TDigest:
+    """
+    Merging t-digest over NumPy arrays: a bounded set of weighted centroids,
+    small at the tails, that answers quantile queries approximately.
+    """
+
+    def __init__(self, compression=200, buffer_size=1000):
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self._buffer = []
+        self._buffered = 0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if not len(values):
+            return
+        self._buffer.append(values)
+        self._buffered += len(values)
+        self.count += len(values)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        if self._buffered >= self.buffer_size:
+            self._merge()
+
+    def _merge(self):
+        if not self._buffer:
+            return
+        means = np.concatenate([self.means] + self._buffer)
+        weights = np.concatenate([self.weights, np.ones(self._buffered)])
+        self._buffer, self._buffered = [], 0
+
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        cumulative = np.cumsum(weights)
+        q = (cumulative - weights / 2) / cumulative[-1]
+        # k1 scale function: each centroid may span at most one unit of k
+        k = self.compression / (2 * np.pi) * np.arcsin(2 * q - 1)
+        groups = np.floor(k - k[0]).astype(np.int64)
+        merged_weights = np.bincount(groups, weights)
+        keep = merged_weights > 0
+        self.means = np.bincount(groups, weights * means)[keep] / merged_weights[keep]
+        self.weights = merged_weights[keep]
+
+    def quantile(self, q):
+        self._merge()
+        if not self.count:
+            return None
+        mids = np.cumsum(self.weights) - self.weights / 2
+        return float(np.interp(q * self.count,
+                               np.concatenate([[0], mids, [self.count]]),
+                               np.concatenate([[self.min], self.means, [self.max]])))
+
+    def state(self, prefix):
+        self._merge()
+        return {f'{prefix}_means': self.means, f'{prefix}_weights': self.weights,
+                f'{prefix}_range': np.array([self.count, self.min, self.max])}
+
+    def load(self, prefix, data):
+        self.means = data[f'{prefix}_means']
+        self.weights = data[f'{prefix}_weights']
+        count, self.min, self.max = data[f'{prefix}_range']
+        self.count = int(count)
+
+
+class CohortAggregates:
+    """Running totals over a set of analyses; every field has a fixed size"""
+
+    def __init__(self):
+        self.scans = 0
+        self.size_histogram = np.zeros(len(SIZE_EDGES) - 1, dtype=np.int64)
+        self.confidence_histogram = np.zeros(len(CONFIDENCE_EDGES) - 1, dtype=np.int64)
+        self.severity_counts = np.zeros(len(SEVERITY_LEVELS), dtype=np.int64)
+        self.side_counts = np.zeros(len(SIDES), dtype=np.int64)
+        self.sums = np.zeros(3)  # diameter, confidence, burden
+        self.size_digest = TDigest()
+        self.burden_digest = TDigest()
+
+    def add(self, batch, severity_fn):
+        """Fold a ScanHistoryStore.read_since() batch into the totals"""
+        counts, diameters, confidences = batch['stone_counts'], batch['diameters'], batch['confidences']
+        if not len(counts):
+            return
+        scan_of_stone = np.repeat(np.arange(len(counts)), counts)
+        burdens = np.bincount(scan_of_stone, diameters, minlength=len(counts))
+
+        self.scans += len(counts)
+        self.size_histogram += np.histogram(diameters, SIZE_EDGES)[0]
+        self.confidence_histogram += np.histogram(np.clip(confidences, 0.0, 1.0), CONFIDENCE_EDGES)[0]
+        self.sums += [diameters.sum(), confidences.sum(), burdens.sum()]
+        self.size_digest.update(diameters)
+        self.burden_digest.update(burdens)
+
+        # Severity depends on (count, burden); group identical pairs so the
+        # classifier runs once per distinct pair rather than once per scan
+        pairs, inverse = np.unique(np.column_stack([counts, np.round(burdens, 4)]), axis=0, return_inverse=True)
+        levels = np.array([SEVERITY_LEVELS.index(severity_fn(int(count), float(burden))) for count, burden in pairs])
+        self.severity_counts += np.bincount(levels[inverse.ravel()], minlength=len(SEVERITY_LEVELS))
+
+        # Positions are "<vertical>-<horizontal>"
+        names, inverse = np.unique(batch['positions'].astype(str), return_inverse=True)
+        sides = np.array([SIDES.index(name.rsplit('-', 1)[-1]) if name.rsplit('-', 1)[-1] in SIDES else -1 for name in names])
+        stone_sides = sides[inverse.ravel()] if len(names) else np.empty(0, dtype=np.int64)
+        self.side_counts += np.bincount(stone_sides[stone_sides >= 0], minlength=len(SIDES))
+
+    def summary(self):
+        stones = int(self.size_histogram.sum())
+        left, right = (int(self.side_counts[SIDES.index(side)]) for side in ('left', 'right'))
+        return {
+            'analyses': self.scans,
+            'stones': stones,
+            'stones_per_analysis': round(stones / self.scans, 3) if self.scans else 0,
+            'severity': dict(zip(SEVERITY_LEVELS, self.severity_counts.tolist())),
+            'sides': dict(zip(SIDES, self.side_counts.tolist())),
+            'left_right_ratio': round(left / right, 3) if right else None,
+            'average_diameter_mm': round(self.sums[0] / stones, 3) if stones else 0,
+            'average_confidence': round(self.sums[1] / stones, 4) if stones else 0,
+            'average_burden_mm': round(self.sums[2] / self.scans, 3) if self.scans else 0,
+            'diameter_quantiles_mm': self._quantiles(self.size_digest),
+            'burden_quantiles_mm': self._quantiles(self.burden_digest),
+            'size_histogram': {'edges_mm': SIZE_EDGES[:-1].tolist(), 'counts': self.size_histogram.tolist()},
+            'confidence_histogram': {'edges': CONFIDENCE_EDGES[:-1].tolist(), 'counts': self.confidence_histogram.tolist()}
+        }
+
+    @staticmethod
+    def _quantiles(digest):
+        values = {f'p{round(q * 100)}': digest.quantile(q) for q in QUANTILES}
+        return {key: round(value, 3) if value is not None else None for key, value in values.items()}
+
+    def state(self):
+        return {
+            'scans': np.array([self.scans]), 'size_histogram': self.size_histogram,
+            'confidence_histogram': self.confidence_histogram, 'severity_counts': self.severity_counts,
+            'side_counts': self.side_counts, 'sums': self.sums,
+            **self.size_digest.state('size'), **self.burden_digest.state('burden')
+        }
+
+    def load(self, data):
+        self.scans = int(data['scans'][0])
+        for name in ('size_histogram', 'confidence_histogram', 'severity_counts', 'side_counts', 'sums'):
+            setattr(self, name, data[name])
+        self.size_digest.load('size', data)
+        self.burden_digest.load('burden', data)
+
+
+class CohortStats:
+    """
+    Cohort-wide distributions over every analysis in the scan history.
+
+    Totals are updated incrementally: each refresh folds in only the scans
+    appended since the last one, so queries cost the same however large the
+    history grows, and scans written by other workers are included too.
+    Snapshots record how many scans they cover, so a restart replays only
+    the tail of the history. recompute() rebuilds the totals from scratch to
+    check the incremental values.
+    """
+
+    def __init__(self, scan_history, severity_fn, snapshot_path=None, snapshot_interval=300):
+        self.scan_history = scan_history
+        self.severity_fn = severity_fn
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.aggregates = CohortAggregates()
+        self.applied_scans = 0
+        self.last_snapshot = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        if snapshot_path:
+            self.load_snapshot()
+
+    def refresh(self):
+        """Fold in scans recorded since the last refresh; returns how many were added"""
+        with self._lock:
+            batch = self.scan_history.read_since(self.applied_scans)
+            self.aggregates.add(batch, self.severity_fn)
+            added = batch['next_scan'] - self.applied_scans
+            self.applied_scans = batch['next_scan']
+            return added
+
+    def get_stats(self):
+        try:
+            self.refresh()
+            with self._lock:
+                stats = self.aggregates.summary()
+                stats['last_snapshot'] = self.last_snapshot
+            return stats
+        except Exception as e:
+            print(f"Error computing cohort stats: {e}")
+            return None
+
+    def recompute(self, until_scan=None):
+        """Full pass over the scan history, independent of the running totals"""
+        aggregates = CohortAggregates()
+        aggregates.add(self.scan_history.read_since(0, until_scan), self.severity_fn)
+        return aggregates.summary()
+
+    def verify(self):
+        """
+        Recompute over exactly the scans the running totals cover and compare.
+        Counts must match exactly; averages only up to rounding, and the
+        quantiles are reported side by side since digests merge in batches.
+        """
+        self.refresh()
+        with self._lock:
+            incremental = self.aggregates.summary()
+            covered = self.applied_scans
+        full = self.recompute(until_scan=covered)
+
+        mismatches = [key for key in ('analyses', 'stones', 'severity', 'sides', 'size_histogram', 'confidence_histogram')
+                      if incremental[key] != full[key]]
+        mismatches += [key for key in ('average_diameter_mm', 'average_confidence', 'average_burden_mm')
+                       if not np.isclose(incremental[key], full[key], rtol=1e-6, atol=1e-3)]
+        return {'incremental': incremental, 'full': full, 'consistent': not mismatches, 'mismatches': mismatches}
+
+    def save_snapshot(self):
+        if not self.snapshot_path:
+            return False
+        try:
+            with self._lock:
+                state = dict(self.aggregates.state(), applied_scans=np.array([self.applied_scans]))
+                buffer = io.BytesIO()
+                np.savez(buffer, **state)
+            atomic_write(self.snapshot_path, lambda file: file.write(buffer.getvalue()), binary=True)
+            self.last_snapshot = time.time()
+            return True
+        except Exception as e:
+            print(f"Error saving cohort stats snapshot: {e}")
+            return False
+
+    def load_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            with np.load(self.snapshot_path) as data:
+                applied = int(data['applied_scans'][0])
+                if applied > self.scan_history.get_stats()['scans']:
+                    # The history was reset or replaced; start over from it
+                    return False
+                aggregates = CohortAggregates()
+                aggregates.load(data)
+            with self._lock:
+                self.aggregates, self.applied_scans = aggregates, applied
+            self.last_snapshot = os.path.getmtime(self.snapshot_path)
+            return True
+        except Exception as e:
+            print(f"Error loading cohort stats snapshot: {e}")
+            return False
+
+    def start(self):
+        """Refresh and snapshot every snapshot_interval seconds on a daemon thread"""
+        if not self.snapshot_path or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='cohort-stats', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.save_snapshot()
+
+    def _run(self):
+        while not self._stop.wait(self.snapshot_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error refreshing cohort stats: {e}")
+            self.save_snapshot()
+
+
+def cohort_stats_from_env(scan_history, severity_fn):
+    """Create cohort statistics configured through COHORT_STATS_* environment variables"""
+    return CohortStats(
+        scan_history,
+        severity_fn,
+        snapshot_path=os.getenv('COHORT_STATS_SNAPSHOT', 'cohort_stats.npz') or None,
+        snapshot_interval=float(os.getenv('COHORT_STATS_SNAPSHOT_INTERVAL', '300'))
+    )
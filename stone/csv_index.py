@@ -0,0 +1,78 @@
+import csv
+import os
+import threading
+
+
+class CsvIndex:
+    """
+    In-memory hash indexes over a CSV file.
+
+    Rows are loaded once and reloaded only when the file's mtime or size
+    changes (e.g. another worker appended to it). Like a linear scan with
+    csv.DictReader, the first row for a key wins.
+    """
+
+    def __init__(self, csv_file_path, key_fields):
+        self.csv_file_path = csv_file_path
+        self.key_fields = key_fields
+        self.indexes = {field: {} for field in key_fields}
+        self.row_count = 0
+        self.lock = threading.RLock()
+        self._signature = None
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.csv_file_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def is_current(self):
+        """True if the indexes reflect the file as it is on disk now"""
+        return self._signature is not None and self._signature == self._file_signature()
+
+    def refresh(self):
+        """Reload the indexes if the file changed since they were built"""
+        with self.lock:
+            signature = self._file_signature()
+            if signature is not None and signature == self._signature:
+                return
+            indexes = {field: {} for field in self.key_fields}
+            row_count = 0
+            if signature is not None:
+                with open(self.csv_file_path, 'r', newline='', encoding='utf-8') as file:
+                    for row in csv.DictReader(file):
+                        row_count += 1
+                        for field in self.key_fields:
+                            indexes[field].setdefault(row.get(field, ''), row)
+            self.indexes = indexes
+            self.row_count = row_count
+            self._signature = signature
+
+    def lookup(self, field, value):
+        """Return a copy of the first row whose field equals value, or None"""
+        with self.lock:
+            self.refresh()
+            row = self.indexes[field].get(value)
+            return dict(row) if row is not None else None
+
+    def record_append(self, row, was_current):
+        """
+        Apply a row that was just appended to the file.
+
+        If the indexes were stale before the write, they are rebuilt on the
+        next lookup instead, so rows appended by other processes are not lost.
+        """
+        with self.lock:
+            if not was_current:
+                self._signature = None
+                return
+            for field in self.key_fields:
+                self.indexes[field].setdefault(row.get(field, ''), row)
+            self.row_count += 1
+            self._signature = self._file_signature()
+
+    def invalidate(self):
+        """Force a reload on the next lookup"""
+        with self.lock:
+            self._signature = None
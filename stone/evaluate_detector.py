@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+Evaluate stone detection backends on a YOLO-format test split
+
+Every backend runs over the same images; predictions are matched to the
+label boxes with vectorized IoU matrices and the report puts accuracy
+(mAP50, mAP50-95, recall, recall on small stones) next to latency
+percentiles, with deltas against the first backend, so a speed change
+can be accepted or rejected on numbers.
+
+Backends:
+    pytorch    the trained weights on whole images
+    onnx       the same weights exported to ONNX (exported next to the weights on first use)
+    quantized  the ONNX export with dynamic int8 weight quantization
+    tiled      overlapping tiles (stone_inference.tile_regions)
+    roi        the kidney ROI crops (kidney_roi, ROI_REGIONS)
+
+Crops run at --roi-imgsz, or by default at the size that keeps the scale
+whole images get at --imgsz (stone_inference.crop_imgsz).
+
+Usage:
+    python evaluate_detector.py --backends pytorch roi onnx --output runs/eval/report
+    python evaluate_detector.py --backends pytorch roi --fail-on-drop 0.01
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import numpy as np
+from PIL import Image
+from kidney_roi import read_label_file, roi_regions_from_env
+from safe_io import atomic_write
+from stone_inference import MODEL_WEIGHTS, box_iou, calculate_pixel_to_mm_scale, detect_boxes_roi, result_boxes, tile_regions
+
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+# Stones below this diameter usually pass on their own and are the easiest to miss
+SMALL_STONE_MM = 4.0
+LATENCY_PERCENTILES = (50, 90, 95, 99)
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def load_dataset(image_dir, label_dir):
+    """
+    Test images paired with their label boxes by file stem.
+
+    Returns:
+        list of dicts: path, width, height, boxes (n, 4 pixel x1, y1, x2, y2) and pixel_to_mm
+    """
+    samples = []
+    for path in sorted(glob.glob(os.path.join(image_dir, '*'))):
+        if not path.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        with Image.open(path) as image:
+            width, height = image.size
+        label_path = os.path.join(label_dir, os.path.splitext(os.path.basename(path))[0] + '.txt')
+        boxes = read_label_file(label_path) if os.path.exists(label_path) else np.empty((0, 4))
+        samples.append({
+            'path': path,
+            'width': width,
+            'height': height,
+            'boxes': boxes * np.array([width, height, width, height]),
+            'pixel_to_mm': calculate_pixel_to_mm_scale(width, height)
+        })
+    return samples
+
+
+def match_predictions(pred_boxes, gt_boxes, iou_thresholds=IOU_THRESHOLDS):
+    """
+    Match one image's predictions to its label boxes at every IoU threshold.
+
+    Pairs are taken highest IoU first and each prediction and label box is
+    used at most once (the matching ultralytics validation uses, so the
+    numbers compare with runs/detect/*/results.csv).
+
+    Returns:
+        (n_pred, n_thresholds) true-positive flags and (n_gt, n_thresholds) found flags
+    """
+    tp = np.zeros((len(pred_boxes), len(iou_thresholds)), dtype=bool)
+    found = np.zeros((len(gt_boxes), len(iou_thresholds)), dtype=bool)
+    if not len(pred_boxes) or not len(gt_boxes):
+        return tp, found
+
+    iou = box_iou(pred_boxes, gt_boxes)
+    for k, threshold in enumerate(iou_thresholds):
+        rows, columns = np.nonzero(iou >= threshold)
+        if not len(rows):
+            continue
+        order = np.argsort(iou[rows, columns], kind='stable')[::-1]
+        rows, columns = rows[order], columns[order]
+        # np.unique keeps the first (highest IoU) pair per prediction, then per label box
+        _, first = np.unique(rows, return_index=True)
+        first.sort()
+        rows, columns = rows[first], columns[first]
+        _, first = np.unique(columns, return_index=True)
+        tp[rows[first], k] = True
+        found[columns[first], k] = True
+    return tp, found
+
+
+def average_precision(tp, confidences, gt_count):
+    """COCO-style 101-point interpolated AP for each IoU threshold column of tp"""
+    if not len(tp) or not gt_count:
+        return np.zeros(tp.shape[1])
+    order = np.argsort(-confidences, kind='stable')
+    tp = tp[order]
+    true_positives = np.cumsum(tp, axis=0)
+    false_positives = np.cumsum(~tp, axis=0)
+    recall = true_positives / gt_count
+    precision = true_positives / (true_positives + false_positives)
+    # Precision envelope: best precision at any recall at least this high
+    envelope = np.flip(np.maximum.accumulate(np.flip(precision, axis=0), axis=0), axis=0)
+
+    points = np.linspace(0, 1, 101)
+    ap = np.empty(tp.shape[1])
+    for k in range(tp.shape[1]):
+        index = np.searchsorted(recall[:, k], points, side='left')
+        reached = index < len(recall)
+        ap[k] = np.where(reached, envelope[np.minimum(index, len(recall) - 1), k], 0.0).mean()
+    return ap
+
+
+def latency_summary(seconds):
+    """Per-image latency percentiles in milliseconds"""
+    milliseconds = np.asarray(seconds) * 1000
+    summary = {f"p{q}_ms": round(float(np.percentile(milliseconds, q)), 2) for q in LATENCY_PERCENTILES}
+    summary['mean_ms'] = round(float(milliseconds.mean()), 2)
+    summary['images_per_second'] = round(float(1000 / milliseconds.mean()), 2)
+    return summary
+
+
+def evaluate_backend(detect_fn, samples, conf_threshold=0.25, batch_size=1, warmup=3):
+    """
+    Run detect_fn over every sample and score it.
+
+    Args:
+        detect_fn: takes a list of RGB PIL images, returns (boxes, confidences) per image
+            with boxes as (n, 4) pixel x1, y1, x2, y2
+        conf_threshold: operating point for precision/recall (mAP uses every prediction)
+        warmup: untimed calls on the first image before measuring
+
+    Returns:
+        dict with the metrics and latency percentiles
+    """
+    if samples and warmup:
+        with Image.open(samples[0]['path']) as image:
+            warm_image = image.convert('RGB')
+        for _ in range(warmup):
+            detect_fn([warm_image])
+
+    latencies, tp_parts, confidence_parts = [], [], []
+    gt_count = small_count = small_found = operating_tp = operating_predictions = operating_found = 0
+    for start in range(0, len(samples), batch_size):
+        batch = samples[start:start + batch_size]
+        images = []
+        for sample in batch:
+            with Image.open(sample['path']) as image:
+                images.append(image.convert('RGB'))
+        started = time.perf_counter()
+        predictions = detect_fn(images)
+        latencies.extend([(time.perf_counter() - started) / len(batch)] * len(batch))
+
+        for sample, (boxes, confidences) in zip(batch, predictions):
+            boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+            confidences = np.asarray(confidences, dtype=np.float64).reshape(-1)
+            tp, _ = match_predictions(boxes, sample['boxes'])
+            tp_parts.append(tp)
+            confidence_parts.append(confidences)
+            gt_count += len(sample['boxes'])
+
+            # Precision/recall at the operating point, matched at IoU 0.5
+            kept = confidences >= conf_threshold
+            kept_tp, found = match_predictions(boxes[kept], sample['boxes'], IOU_THRESHOLDS[:1])
+            operating_tp += int(kept_tp.sum())
+            operating_predictions += int(kept.sum())
+            operating_found += int(found.sum())
+            diameters_mm = (sample['boxes'][:, 2:] - sample['boxes'][:, :2]).max(axis=1, initial=0) * sample['pixel_to_mm']
+            small = diameters_mm < SMALL_STONE_MM
+            small_count += int(small.sum())
+            small_found += int(found[small, 0].sum())
+
+    tp = np.concatenate(tp_parts) if tp_parts else np.zeros((0, len(IOU_THRESHOLDS)), dtype=bool)
+    confidences = np.concatenate(confidence_parts) if confidence_parts else np.empty(0)
+    ap = average_precision(tp, confidences, gt_count)
+    return {
+        'images': len(samples),
+        'stones': gt_count,
+        'small_stones': small_count,
+        'map50': round(float(ap[0]), 4),
+        'map50_95': round(float(ap.mean()), 4),
+        'precision': round(operating_tp / operating_predictions, 4) if operating_predictions else 0.0,
+        'recall': round(operating_found / gt_count, 4) if gt_count else 0.0,
+        'small_recall': round(small_found / small_count, 4) if small_count else None,
+        'latency': latency_summary(latencies) if latencies else {}
+    }
+
+
+def load_yolo(weights):
+    from ultralytics import YOLO
+    return YOLO(weights)
+
+
+def onnx_weights(weights, imgsz):
+    """Path of the ONNX export of weights, exporting it on first use"""
+    if weights.endswith('.onnx'):
+        return weights
+    path = os.path.splitext(weights)[0] + '.onnx'
+    if not os.path.exists(path):
+        path = load_yolo(weights).export(format='onnx', imgsz=imgsz)
+    return path
+
+
+def quantized_weights(weights, imgsz):
+    """Path of a dynamic int8 quantization of the ONNX export, created on first use"""
+    source = onnx_weights(weights, imgsz)
+    path = os.path.splitext(source)[0] + '.int8.onnx'
+    if not os.path.exists(path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(source, path, weight_type=QuantType.QUInt8)
+    return path
+
+
+def whole_image(model, imgsz, conf):
+    def detect(images):
+        results = model.predict(source=images, imgsz=imgsz, conf=conf, save=False, verbose=False)
+        return [result_boxes(result)[:2] for result in results]
+    return detect
+
+
+def cropped(model, regions, imgsz, roi_imgsz, conf):
+    def detect(images):
+        return [(boxes, confidences) for boxes, confidences, _ in
+                detect_boxes_roi(images, regions, roi_imgsz, model=model, full_imgsz=imgsz, conf=conf)]
+    return detect
+
+
+def make_backend(name, weights=MODEL_WEIGHTS, imgsz=640, roi_imgsz=None, conf=0.001):
+    """detect_fn for evaluate_backend; conf is the floor the model reports down to"""
+    if name == 'pytorch':
+        return whole_image(load_yolo(weights), imgsz, conf)
+    if name == 'onnx':
+        return whole_image(load_yolo(onnx_weights(weights, imgsz)), imgsz, conf)
+    if name == 'quantized':
+        return whole_image(load_yolo(quantized_weights(weights, imgsz)), imgsz, conf)
+    if name == 'tiled':
+        return cropped(load_yolo(weights), tile_regions(), imgsz, roi_imgsz, conf)
+    if name == 'roi':
+        return cropped(load_yolo(weights), roi_regions_from_env(), imgsz, roi_imgsz, conf)
+    raise ValueError(f"Unknown backend '{name}'")
+
+
+def compare(results):
+    """Each backend's metric changes against the first one"""
+    baseline = results[0]
+    deltas = {}
+    for result in results[1:]:
+        deltas[result['backend']] = {
+            metric: round(result[metric] - baseline[metric], 4)
+            for metric in ('map50', 'map50_95', 'recall', 'small_recall')
+            if result[metric] is not None and baseline[metric] is not None
+        }
+        if result['latency'].get('p50_ms') and baseline['latency'].get('p50_ms'):
+            deltas[result['backend']]['p50_speedup'] = round(baseline['latency']['p50_ms'] / result['latency']['p50_ms'], 2)
+    return deltas
+
+
+def markdown_report(report):
+    lines = [
+        f"# Detector evaluation ({report['dataset']['images']} images, {report['dataset']['stones']} stones, "
+        f"{report['dataset']['small_stones']} under {SMALL_STONE_MM:g} mm)",
+        '',
+        f"Operating point conf >= {report['conf_threshold']}, batch size {report['batch_size']}.",
+        '',
+        '| Backend | mAP50 | mAP50-95 | Precision | Recall | Small recall | p50 ms | p95 ms | p99 ms | img/s |',
+        '|---|---|---|---|---|---|---|---|---|---|'
+    ]
+    for result in report['results']:
+        latency = result['latency']
+        small = '-' if result['small_recall'] is None else f"{result['small_recall']:.3f}"
+        lines.append(
+            f"| {result['backend']} | {result['map50']:.3f} | {result['map50_95']:.3f} | {result['precision']:.3f} | "
+            f"{result['recall']:.3f} | {small} | {latency.get('p50_ms', '-')} | {latency.get('p95_ms', '-')} | "
+            f"{latency.get('p99_ms', '-')} | {latency.get('images_per_second', '-')} |"
+        )
+    if report['deltas']:
+        lines += ['', f"Changes against {report['results'][0]['backend']}:", '']
+        for backend, delta in report['deltas'].items():
+            lines.append(f"- {backend}: " + ', '.join(f"{metric} {value:+g}" for metric, value in delta.items()))
+    return '\n'.join(lines) + '\n'
+
+
+def run_evaluation(backends, samples, conf_threshold=0.25, batch_size=1, warmup=3):
+    """
+    Evaluate (name, detect_fn) pairs on the same samples.
+
+    Returns:
+        report dict with per-backend results and deltas against the first backend
+    """
+    results = []
+    for name, detect_fn in backends:
+        result = evaluate_backend(detect_fn, samples, conf_threshold, batch_size, warmup)
+        result['backend'] = name
+        results.append(result)
+    return {
+        'dataset': {key: results[0][key] for key in ('images', 'stones', 'small_stones')} if results else {},
+        'conf_threshold': conf_threshold,
+        'batch_size': batch_size,
+        'iou_thresholds': [round(float(threshold), 2) for threshold in IOU_THRESHOLDS],
+        'results': results,
+        'deltas': compare(results) if len(results) > 1 else {}
+    }
+
+
+def save_report(report, output):
+    """Write output.json and output.md; returns both paths"""
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    json_path, markdown_path = output + '.json', output + '.md'
+    atomic_write(json_path, lambda file: json.dump(report, file, indent=2))
+    atomic_write(markdown_path, lambda file: file.write(markdown_report(report)))
+    return json_path, markdown_path
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='Evaluate stone detection backends on a YOLO-format test split')
+    parser.add_argument('--backends', nargs='*', default=['pytorch'], help='pytorch, onnx, quantized, tiled, roi')
+    parser.add_argument('--weights', default=MODEL_WEIGHTS)
+    parser.add_argument('--images', default=os.path.join(here, 'data', 'test', 'images'))
+    parser.add_argument('--labels', default=os.path.join(here, 'data', 'test', 'labels'))
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--roi-imgsz', type=int, default=int(os.getenv('ROI_IMGSZ') or 0) or None)
+    parser.add_argument('--conf', type=float, default=0.25, help='operating point for precision/recall')
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--output', default=os.path.join(here, 'runs', 'eval', 'report'))
+    parser.add_argument('--fail-on-drop', type=float, default=None,
+                        help='exit non-zero if any backend loses more than this much mAP50-95 or small-stone recall')
+    args = parser.parse_args()
+
+    samples = load_dataset(args.images, args.labels)
+    print(f"Evaluating {len(samples)} images from {args.images}")
+    backends = [(name, make_backend(name, args.weights, args.imgsz, args.roi_imgsz)) for name in args.backends]
+    report = run_evaluation(backends, samples, args.conf, args.batch_size, args.warmup)
+    print(markdown_report(report))
+    print(f"Report written to {', '.join(save_report(report, args.output))}")
+
+    if args.fail_on_drop is not None:
+        regressions = [backend for backend, delta in report['deltas'].items()
+                       if min(delta.get('map50_95', 0), delta.get('small_recall', 0)) < -args.fail_on_drop]
+        if regressions:
+            print(f"Accuracy dropped by more than {args.fail_on_drop} for: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,16 @@
 import os
 import base64
+import csv
+import hmac
 import io
-from flask import Flask, request, render_template, send_file, jsonify, session
+import itertools
+import json
+import tempfile
+import pandas as pd
+from flask import Flask, request, render_template, send_file, send_from_directory, jsonify, session, Response, stream_with_context
 from flask_cors import CORS
 from PIL import Image as PILImage
 from PIL import ImageDraw, ImageFont
-from ultralytics import YOLO
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
@@ -14,45 +19,65 @@ from reportlab.pdfgen import canvas
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
 from reportlab.lib.utils import ImageReader
 from datetime import datetime
-from chatbot_service import get_health_advice, get_stone_specific_info
-from simple_user_manager import SimpleUserDataManager
+from chatbot_service import answer_health_question, get_stone_specific_info, iter_stone_insights, stream_health_advice, get_cache_stats, get_stream_stats, get_llm_stats, start_chat_session, get_chat_session, answer_session_question, get_session_stats, get_tier_stats
+from storage import create_user_manager, create_patient_manager
+from patient_data_manager import PATIENT_FIELDS, read_patient_ndjson
+from scan_history import scan_history_from_env
+from server_sessions import session_interface_from_env
+from alerts import alerts_from_env
+from cohort_stats import cohort_stats_from_env
+from blob_store import blob_stores_from_env
+from stone_inference import get_model, calculate_pixel_to_mm_scale, calculate_severity, get_stone_position, detect_stones, summarize_stones, analyze_images
+from kidney_roi import roi_settings_from_env
+from series_analysis import analyze_series, order_slices
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 app.secret_key = 'your_secret_key_here'  # Required for session
+# Session data lives server-side and the cookie only carries its ID (SESSION_BACKEND=cookie restores Flask's cookie sessions)
+if os.getenv('SESSION_BACKEND', 'server').lower() == 'server':
+    app.session_interface = session_interface_from_env()
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['REPORTS_FOLDER'] = 'reports'
+# Keep a copy of every generated report in REPORTS_FOLDER (set PERSIST_REPORTS=false to serve from memory only)
+app.config['PERSIST_REPORTS'] = os.getenv('PERSIST_REPORTS', 'true').lower() == 'true'
+# Let a front proxy push report bytes: X-Sendfile (Apache/lighttpd) or an nginx internal location prefix
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', 'false').lower() == 'true'
+app.config['REPORTS_ACCEL_PREFIX'] = os.getenv('REPORTS_ACCEL_PREFIX', '')
+# Multi-slice series: slices per model call and the largest accepted stack
+app.config['SERIES_BATCH_SIZE'] = int(os.getenv('SERIES_BATCH_SIZE', '16'))
+app.config['SERIES_MAX_SLICES'] = int(os.getenv('SERIES_MAX_SLICES', '1000'))
+# Two-stage detection on kidney crops (ROI_MODE=prior, ROI_REGIONS, ROI_IMGSZ; see kidney_roi)
+app.config['ROI_SETTINGS'] = roi_settings_from_env()
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['REPORTS_FOLDER'], exist_ok=True)
 
-# Initialize simple user data manager
-user_manager = SimpleUserDataManager()
+# Uploads and persisted reports are stored content-addressed with per-kind TTLs and size
+# quotas enforced by a background sweeper (UPLOAD_TTL_HOURS, UPLOADS_QUOTA_MB, ... see blob_store)
+upload_store, report_store = blob_stores_from_env(app.config['UPLOAD_FOLDER'], app.config['REPORTS_FOLDER'])
+
+# Load YOLO model (MODEL_WEIGHTS, see stone_inference)
+stone_detection_model = get_model()
+
+# Initialize user and patient data managers (CSV or SQLite, see STORAGE_BACKEND)
+user_manager = create_user_manager()
+patient_manager = create_patient_manager()
+
+# Every analysis is kept for longitudinal queries (SCAN_HISTORY_DIR); scans
+# without a patient_id are stored under '' and only feed the cohort statistics
+scan_history = scan_history_from_env()
+
+# Cohort distributions folded incrementally from the scan history and
+# snapshotted to disk (COHORT_STATS_SNAPSHOT, COHORT_STATS_SNAPSHOT_INTERVAL)
+cohort_stats = cohort_stats_from_env(scan_history, lambda count, burden: calculate_severity(count, burden)['level'])
+cohort_stats.start()
+
+# Severe/recent-Moderate analyses are indexed for the alerts page; Severe ones notify the doctor
+# from a background outbox worker (ALERTS_DB, SMTP_*, SMS_OUTBOX_PATH, ALERT_*)
+alert_store, notification_worker = alerts_from_env()
+if os.getenv('ALERT_WORKER', 'true').lower() == 'true':
+    notification_worker.start()
 
-def calculate_pixel_to_mm_scale(image_width, image_height):
-    """
-    Calculate a more accurate pixel-to-mm scale factor for medical imaging.
-    
-    For kidney stone imaging, typical scale factors are:
-    - CT scans: 0.1-0.3 mm/pixel (depending on slice thickness and FOV)
-    - Ultrasound: 0.05-0.2 mm/pixel (depending on depth and transducer)
-    - X-ray: 0.1-0.4 mm/pixel (depending on technique and magnification)
-    
-    This function provides a more reasonable estimate based on image dimensions.
-    """
-    # Assume typical kidney imaging field of view
-    # Standard abdominal CT FOV is about 35-50cm
-    # Standard kidney dimensions: 10-12cm length, 5-7cm width
-    
-    # If image is very large (>1000px), likely high-resolution scan
-    if max(image_width, image_height) > 1000:
-        return 0.15  # Fine resolution CT or high-res ultrasound
-    # If image is medium (500-1000px), standard resolution
-    elif max(image_width, image_height) > 500:
-        return 0.25  # Standard CT or ultrasound
-    # If image is small (<500px), lower resolution or cropped
-    else:
-        return 0.35  # Lower resolution or zoomed view
-        
 def draw_annotations_on_image(image_path, detections, output_path):
     """
     Draw yellow bounding boxes on the image for detected stones.
@@ -126,19 +151,33 @@ def draw_annotations_on_image(image_path, detections, output_path):
     img.save(output_path, "JPEG", quality=95)
     return output_path
 
-def image_to_base64(image_path):
-    """Convert image to base64 string for JSON response"""
-    with open(image_path, "rb") as img_file:
-        img_data = img_file.read()
-        base64_string = base64.b64encode(img_data).decode('utf-8')
-        return f"data:image/jpeg;base64,{base64_string}"
+def image_to_base64(image):
+    """Convert an image (path or in-memory buffer) to base64 string for JSON response"""
+    if isinstance(image, io.BytesIO):
+        img_data = image.getvalue()
+    else:
+        with open(image, "rb") as img_file:
+            img_data = img_file.read()
+    base64_string = base64.b64encode(img_data).decode('utf-8')
+    return f"data:image/jpeg;base64,{base64_string}"
+
+def generate_pdf_report(stones_data, annotated_image_path, user_data=None, output=None):
+    """
+    Build the PDF report.
 
-def generate_pdf_report(stones_data, annotated_image_path, user_data=None):
+    Args:
+        output: Optional binary file-like object to write the PDF into. When omitted
+            the report is written to REPORTS_FOLDER.
+
+    Returns:
+        The report filename
+    """
     report_filename = f"kidney_scan_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-    report_path = os.path.join(app.config['REPORTS_FOLDER'], report_filename)
+    if output is None:
+        output = os.path.join(app.config['REPORTS_FOLDER'], report_filename)
     
     doc = SimpleDocTemplate(
-        report_path,
+        output,
         pagesize=letter,
         rightMargin=72,
         leftMargin=72,
@@ -210,7 +249,7 @@ def generate_pdf_report(stones_data, annotated_image_path, user_data=None):
     elements.append(Spacer(1, 30))
 
     # Add the annotated image
-    if os.path.exists(annotated_image_path):
+    if annotated_image_path and os.path.exists(annotated_image_path):
         # Calculate image size to fit within margins while maintaining aspect ratio
         img = Image(annotated_image_path)
         aspect = img.imageWidth / float(img.imageHeight)
@@ -340,49 +379,6 @@ def generate_pdf_report(stones_data, annotated_image_path, user_data=None):
     doc.build(elements)
     return report_filename
 
-# Load YOLO model
-model_weights_path = 'C:\\Users\\dell\\Desktop\\stones\\stone\\runs\\detect\\train2\\weights\\best.pt'  # Use the local model file
-stone_detection_model = YOLO(model_weights_path)
-
-# Severity classification function
-def calculate_severity(stone_count, total_burden_mm):
-    """
-    Calculate severity based on historical thresholds:
-    Normal: ≤ 2 stones AND total burden < 5mm
-    Moderate: 2-4 stones OR total burden 5-10mm
-    Severe: > 4 stones OR total burden > 10mm
-    """
-    if stone_count <= 2 and total_burden_mm < 5:
-        return {
-            'level': 'Normal',
-            'color': 'green',
-            'description': 'Normal stone burden'
-        }
-    elif (stone_count <= 4 and total_burden_mm <= 10) or (stone_count <= 2 and total_burden_mm < 10):
-        return {
-            'level': 'Moderate',
-            'color': 'yellow',
-            'description': 'Moderate stone burden - regular monitoring recommended'
-        }
-    else:
-        return {
-            'level': 'Severe',
-            'color': 'red',
-            'description': 'Severe stone burden - immediate medical attention recommended'
-        }
-
-# Stone position function
-def get_stone_position(x_center, y_center, img_width, img_height):
-    x_third = img_width / 3
-    y_third = img_height / 3
-    if x_center < x_third: h_pos = "left"
-    elif x_center < 2*x_third: h_pos = "center"
-    else: h_pos = "right"
-    if y_center < y_third: v_pos = "top"
-    elif y_center < 2*y_third: v_pos = "middle"
-    else: v_pos = "bottom"
-    return f"{v_pos}-{h_pos}"
-
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if request.method == 'POST':
@@ -393,9 +389,9 @@ def index():
         if file.filename == '':
             return "No selected file"
         
-        # Save uploaded image
-        img_path = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-        file.save(img_path)
+        # Save uploaded image under its content hash (same-named scans no longer overwrite each other)
+        upload = upload_store.put(file.stream, 'upload', os.path.splitext(file.filename)[1])
+        img_path = upload['path']
         
         # Load image
         img_arr = PILImage.open(img_path).convert("RGB")
@@ -463,9 +459,14 @@ def index():
                 # Draw main text (yellow)
                 draw.text(text_position, diameter_text, fill="yellow", font=font)
 
-        # Save annotated image
-        annotated_path = os.path.join(app.config['UPLOAD_FOLDER'], f"annotated_{file.filename}")
-        img_arr.save(annotated_path)
+        # Save annotated image in the upload's format
+        annotated_ext = os.path.splitext(upload['name'])[1]
+        annotated_format = PILImage.registered_extensions().get(annotated_ext)
+        if not annotated_format:
+            annotated_ext, annotated_format = '.png', 'PNG'
+        annotated_buffer = io.BytesIO()
+        img_arr.save(annotated_buffer, format=annotated_format)
+        annotated = upload_store.put(annotated_buffer.getvalue(), 'annotated', annotated_ext)
 
         # Calculate severity if stones are detected
         severity = None
@@ -481,7 +482,7 @@ def index():
             }
 
         return render_template('index.html', 
-                            annotated_image=annotated_path, 
+                            annotated_image=annotated['name'], 
                             stones_data=stones_data, 
                             stone_count=len(stones_data),
                             no_stones_message=no_stones_message,
@@ -495,18 +496,36 @@ def index():
                          no_stones_message=None,
                          report_filename=None)
 
-@app.route('/reports/<filename>')
-def download_report(filename):
-    return send_file(
-        os.path.join(app.config['REPORTS_FOLDER'], filename),
+def send_report_file(filename, download_name=None):
+    """
+    Serve a persisted report with conditional/Range support, or hand the
+    transfer off to the front proxy via X-Accel-Redirect when configured.
+    """
+    download_name = download_name or filename
+    accel_prefix = app.config['REPORTS_ACCEL_PREFIX']
+    if accel_prefix:
+        response = Response(mimetype='application/pdf')
+        response.headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{filename}"
+        response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+        return response
+    
+    return send_from_directory(
+        app.config['REPORTS_FOLDER'],
+        filename,
         mimetype='application/pdf',
         as_attachment=True,
-        download_name=filename
+        download_name=download_name,
+        conditional=True
     )
 
+@app.route('/reports/<filename>')
+def download_report(filename):
+    return send_report_file(report_store.resolve(filename) or filename, download_name=filename)
+
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_file(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+    # Content-addressed names first, then files saved before the store existed
+    return send_from_directory(app.config['UPLOAD_FOLDER'], upload_store.resolve(filename) or filename)
 
 @app.route('/predict', methods=['POST'])
 def predict():
@@ -522,6 +541,8 @@ def predict():
 
         # Get patient ID from form data (optional)
         patient_id = request.form.get('patient_id', '')
+        # Firebase user ID of the account the scan belongs to; its doctor contact receives Severe alerts
+        user_id = request.form.get('user_id', '')
         
         # Validate file type
         allowed_types = ['image/jpeg', 'image/jpg', 'image/png']
@@ -537,9 +558,8 @@ def predict():
         if file_size > max_size:
             return jsonify({"error": "File too large. Maximum size is 10MB."}), 400
 
-        # Save uploaded image
-        img_path = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-        file.save(img_path)
+        # Save uploaded image under its content hash; identical scans are stored once
+        img_path = upload_store.put(file.stream, 'upload', os.path.splitext(file.filename)[1])['path']
         
         # Load image
         img_arr = PILImage.open(img_path).convert("RGB")
@@ -549,14 +569,17 @@ def predict():
         pixel_to_mm = calculate_pixel_to_mm_scale(w, h)
         print(f"Using pixel-to-mm scale factor: {pixel_to_mm} for image {w}x{h}")
 
-        # Predict stones
-        results = stone_detection_model.predict(source=img_arr, save=False)
-        boxes = results[0].boxes
+        # Predict stones (boxes come back in full-image coordinates in ROI mode too)
+        stones_data = detect_stones(img_arr, **app.config['ROI_SETTINGS'])
 
-        stones_data = []
-        
-        if boxes is None or boxes.xyxy.shape[0] == 0:
-            # No stones detected
+        # Count the scan for the patient (appended to the scan event log, not a file rewrite)
+        if patient_id:
+            patient_manager.update_patient_scan_info(patient_id)
+
+        if not stones_data:
+            # No stones detected; a clear scan still belongs in the history
+            scan_history.record_scan(patient_id, [])
+            
             return jsonify({
                 "detections": [],
                 "summary": {
@@ -581,38 +604,7 @@ def predict():
                 }
             })
         else:
-            stone_count = boxes.xyxy.shape[0]
-            
-            for i, box in enumerate(boxes, 1):
-                x1, y1, x2, y2 = box.xyxy[0]
-                width = (x2 - x1).item()
-                height = (y2 - y1).item()
-                diameter = max(width, height)
-                diameter_mm = diameter * pixel_to_mm  # Use calculated scale factor
-                x_center = (x1 + x2) / 2
-                y_center = (y1 + y2) / 2
-                position = get_stone_position(x_center, y_center, w, h)
-                
-                # Get confidence score
-                conf = box.conf[0].item()
-                
-                # Get class probabilities if available
-                if hasattr(box, 'cls'):
-                    cls_id = int(box.cls[0].item())
-                    cls_name = results[0].names[cls_id]
-                else:
-                    cls_name = "kidney_stone"
-
-                stone_info = {
-                    "id": i,
-                    "bbox": [float(x1), float(y1), float(x2), float(y2)],
-                    "confidence": conf,
-                    "diameter_px": float(diameter),
-                    "diameter_mm": round(diameter_mm, 2),
-                    "type": cls_name,
-                    "position": position
-                }
-                stones_data.append(stone_info)
+            scan_history.record_scan(patient_id, stones_data)
 
             # Store stones data in session for chatbot use
             session['stones_data'] = [{
@@ -623,14 +615,20 @@ def predict():
                 "type": stone["type"]
             } for stone in stones_data]
 
-            # Calculate summary
-            total_stones = len(stones_data)
-            largest_stone = max([d["diameter_mm"] for d in stones_data], default=0)
-            avg_confidence = sum([d["confidence"] for d in stones_data]) / max(total_stones, 1)
-            total_burden = sum([d["diameter_mm"] for d in stones_data])
+            # Calculate summary and severity
+            summary = summarize_stones(stones_data)
+            total_stones = summary['total_stones']
+            largest_stone = summary['largest_stone_mm']
+            avg_confidence = summary['average_confidence']
+            total_burden = summary['total_burden_mm']
+            severity_info = summary['severity']
             
-            # Get severity
-            severity_info = calculate_severity(total_stones, total_burden)
+            # Index urgent results and queue doctor alerts; sending happens off the request path
+            if patient_id:
+                contact = user_manager.get_doctor_contact(user_id) if user_id and severity_info['level'] == 'Severe' else None
+                if alert_store.record_analysis(patient_id, severity_info['level'], total_stones,
+                                               total_burden, largest_stone, contact):
+                    notification_worker.wake()
             
             # Generate recommendations
             recommendations = []
@@ -641,12 +639,12 @@ def predict():
                 recommendations.append("Urgent medical attention recommended")
             recommendations.append("Monitor symptoms and pain levels")
             
-            # Generate annotated image
-            annotated_img_path = os.path.join(app.config['UPLOAD_FOLDER'], f"annotated_{file.filename}")
-            draw_annotations_on_image(img_path, stones_data, annotated_img_path)
+            # Generate annotated image (only returned inline, so it never touches the disk)
+            annotated_buffer = io.BytesIO()
+            draw_annotations_on_image(img_path, stones_data, annotated_buffer)
             
             # Convert annotated image to base64 for JSON response
-            annotated_image_base64 = image_to_base64(annotated_img_path)
+            annotated_image_base64 = image_to_base64(annotated_buffer)
             
             return jsonify({
                 "detections": stones_data,
@@ -674,6 +672,74 @@ def predict():
     except Exception as e:
         return jsonify({"error": f"Internal server error: {str(e)}"}), 500
 
+@app.route('/predict/series', methods=['POST'])
+def predict_series():
+    """
+    Analyse an ordered stack of CT slices ('slices' files) as one series.
+
+    Boxes on neighbouring slices are linked by IoU into 3D stone tracks, and
+    each track is reported once with its largest diameter, so severity no
+    longer counts the same stone on every slice. Slices are put in
+    acquisition order when the filenames follow the scanner export naming,
+    otherwise the upload order is kept. Werkzeug spools large
+    uploads to temporary files and slices are decoded one batch at a time,
+    so memory stays bounded for long series.
+    """
+    try:
+        files = [file for file in request.files.getlist('slices') if file.filename]
+        if not files:
+            return jsonify({"error": "Missing files 'slices'"}), 400
+        if len(files) > app.config['SERIES_MAX_SLICES']:
+            return jsonify({"error": f"Too many slices. Maximum is {app.config['SERIES_MAX_SLICES']}."}), 400
+        allowed_types = ['image/jpeg', 'image/jpg', 'image/png']
+        if any(file.content_type not in allowed_types for file in files):
+            return jsonify({"error": "Invalid file type. Please upload JPEG or PNG images only."}), 400
+
+        patient_id = request.form.get('patient_id', '')
+        user_id = request.form.get('user_id', '')
+        iou_threshold = request.form.get('iou_threshold', 0.3, type=float)
+        max_gap = request.form.get('max_gap', 1, type=int)
+        batch_size = app.config['SERIES_BATCH_SIZE']
+
+        ordered = [files[index] for index in order_slices([file.filename for file in files])]
+        result = analyze_series(
+            (file.stream for file in ordered),
+            lambda images: analyze_images(images, batch_size=batch_size, **app.config['ROI_SETTINGS']),
+            batch_size=batch_size, iou_threshold=iou_threshold, max_gap=max_gap
+        )
+        summary = result['summary']
+
+        # One series is one scan for the patient, with one entry per deduplicated stone
+        if patient_id:
+            patient_manager.update_patient_scan_info(patient_id)
+        scan_history.record_scan(patient_id, [{
+            "diameter_mm": stone["max_diameter_mm"],
+            "confidence": stone["confidence"],
+            "position": stone["position"]
+        } for stone in result['stones']])
+        if patient_id and summary['total_stones']:
+            contact = user_manager.get_doctor_contact(user_id) if user_id and summary['severity']['level'] == 'Severe' else None
+            if alert_store.record_analysis(patient_id, summary['severity']['level'], summary['total_stones'],
+                                           summary['total_burden_mm'], summary['largest_stone_mm'], contact):
+                notification_worker.wake()
+
+        return jsonify({
+            "stones": result['stones'],
+            "summary": summary,
+            "analysis_timestamp": datetime.now().isoformat(),
+            "metadata": {
+                "slice_order": [file.filename for file in ordered],
+                "iou_threshold": iou_threshold,
+                "max_gap": max_gap,
+                "processed_at": datetime.now().isoformat(),
+                "api_version": "2.0",
+                "image_dimensions": result['image_dimensions']
+            }
+        })
+
+    except Exception as e:
+        return jsonify({"error": f"Internal server error: {str(e)}"}), 500
+
 @app.route('/generate-report', methods=['POST'])
 def generate_report():
     """Generate PDF report on-demand from detection results"""
@@ -704,11 +770,10 @@ def generate_report():
             base64_data = annotated_image_base64.split(',')[1]
             image_data = base64.b64decode(base64_data)
             
-            # Save temporary image
-            temp_filename = f"temp_annotated_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-            annotated_image_path = os.path.join(app.config['UPLOAD_FOLDER'], temp_filename)
+            # Save temporary image (unique name; concurrent reports no longer share one file)
+            fd, annotated_image_path = tempfile.mkstemp(prefix='temp_annotated_', suffix='.jpg', dir=app.config['UPLOAD_FOLDER'])
             
-            with open(annotated_image_path, 'wb') as f:
+            with os.fdopen(fd, 'wb') as f:
                 f.write(image_data)
         
         # Transform detections data to match the existing format
@@ -726,9 +791,9 @@ def generate_report():
             }
             stones_data.append(stone_info)
         
-        # Generate PDF report with user data
-        report_filename = generate_pdf_report(stones_data, annotated_image_path, user_data)
-        report_path = os.path.join(app.config['REPORTS_FOLDER'], report_filename)
+        # Generate PDF report with user data in memory; persisted copies go to the report store
+        report_buffer = io.BytesIO()
+        report_filename = generate_pdf_report(stones_data, annotated_image_path, user_data, output=report_buffer)
         
         # Clean up temporary image if created
         if annotated_image_path and os.path.exists(annotated_image_path):
@@ -738,11 +803,17 @@ def generate_report():
                 pass  # Ignore cleanup errors
         
         # Return the report file
+        if app.config['PERSIST_REPORTS']:
+            stored = report_store.put(report_buffer.getvalue(), 'report', '.pdf')
+            return send_report_file(stored['relative_path'], download_name=report_filename)
+        
+        report_buffer.seek(0)
         return send_file(
-            report_path,
+            report_buffer,
             mimetype='application/pdf',
             as_attachment=True,
-            download_name=f"kidney_scan_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+            download_name=report_filename,
+            conditional=True
         )
         
     except Exception as e:
@@ -759,25 +830,126 @@ def chat():
         
         user_query = data.get('question', '').strip()
         stones_data = data.get('stones_data', [])
+        session_id = data.get('session_id', '')
         
         if not user_query:
             return jsonify({'error': 'No question provided'}), 400
         
+        # Follow-up questions within a server-side chat session
+        if session_id:
+            chat_session = get_chat_session(session_id)
+            if not chat_session:
+                return jsonify({'error': 'Chat session not found or expired'}), 404
+            response, tier = answer_session_question(chat_session, user_query)
+            return jsonify({'response': response, 'tier': tier, 'session': chat_session.to_dict()})
+        
         if not stones_data:
             return jsonify({
                 'response': 'Please upload a kidney scan image first to get personalized advice based on your stone analysis.'
             })
         
-        # Get health advice using the chatbot service
-        response = get_health_advice(stones_data, user_query)
+        # Get health advice using the chatbot service, tagged with the tier that answered
+        response, tier = answer_health_question(stones_data, user_query)
         
-        return jsonify({'response': response})
+        return jsonify({'response': response, 'tier': tier})
         
     except Exception as e:
         return jsonify({
             'error': f'I apologize, but I\'m unable to process your question at the moment. Error: {str(e)}'
         }), 500
 
+@app.route('/chat/sessions', methods=['POST'])
+def create_chat_session():
+    """Start a multi-turn chat session for an analysis"""
+    try:
+        data = request.get_json()
+        
+        if not data or not data.get('stones_data'):
+            return jsonify({'error': 'No stones data provided'}), 400
+        
+        chat_session = start_chat_session(data['stones_data'])
+        return jsonify({'success': True, 'session': chat_session.to_dict()})
+        
+    except Exception as e:
+        return jsonify({'error': f'Failed to create chat session: {str(e)}'}), 500
+
+@app.route('/chat/sessions/<session_id>', methods=['GET'])
+def chat_session_info(session_id):
+    """Get history size and token usage for a chat session"""
+    chat_session = get_chat_session(session_id)
+    if not chat_session:
+        return jsonify({'error': 'Chat session not found or expired'}), 404
+    return jsonify({'success': True, 'session': chat_session.to_dict()})
+
+def format_sse(data, event=None):
+    """Format a payload as a Server-Sent Events message"""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Streaming variant of /chat that forwards tokens as Server-Sent Events"""
+    data = request.get_json(silent=True)
+    
+    if not data:
+        return jsonify({'error': 'No data provided'}), 400
+    
+    user_query = data.get('question', '').strip()
+    stones_data = data.get('stones_data', [])
+    
+    if not user_query:
+        return jsonify({'error': 'No question provided'}), 400
+    
+    def generate():
+        if not stones_data:
+            yield format_sse({'token': 'Please upload a kidney scan image first to get personalized advice based on your stone analysis.'})
+            yield format_sse({}, event='done')
+            return
+        
+        tokens = stream_health_advice(stones_data, user_query)
+        try:
+            for token in tokens:
+                yield format_sse({'token': token})
+            yield format_sse({}, event='done')
+        finally:
+            # Runs on client disconnect too, which closes the upstream completion stream
+            tokens.close()
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/stone-insights', methods=['POST'])
+def stone_insights():
+    """Fetch insights for all detected stones at once; stream=true returns NDJSON as they complete"""
+    try:
+        data = request.get_json()
+        
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+        
+        stones_data = data.get('stones_data', [])
+        if not stones_data:
+            return jsonify({'error': 'No stones data provided'}), 400
+        
+        if data.get('stream'):
+            def generate():
+                for stone_id, insight in iter_stone_insights(stones_data):
+                    yield json.dumps({'id': stone_id, 'insight': insight}) + '\n'
+            
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        
+        # Collect everything, then return in the order the stones were sent
+        insights = dict(iter_stone_insights(stones_data))
+        return jsonify({
+            'insights': [{'id': stone['id'], 'insight': insights.get(stone['id'])} for stone in stones_data]
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'Failed to get stone insights: {str(e)}'}), 500
+
 @app.route('/save-user-data', methods=['POST'])
 def save_user_data():
     """Save user data from registration to CSV"""
@@ -858,6 +1030,209 @@ def get_user_data(user_id):
     except Exception as e:
         return jsonify({'error': f'Failed to retrieve user data: {str(e)}'}), 500
 
+def admin_denied():
+    """
+    Error response for admin endpoints, or None: X-Admin-Token must match
+    ADMIN_API_TOKEN, and without a configured token the endpoints stay closed
+    """
+    token = os.getenv('ADMIN_API_TOKEN')
+    if not token:
+        return jsonify({'error': 'Admin token not configured'}), 503
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode('utf-8'), token.encode('utf-8')):
+        return jsonify({'error': 'Unauthorized'}), 401
+    return None
+
+@app.route('/patients/import', methods=['POST'])
+def import_patients():
+    """
+    Bulk-add patients from a CSV or NDJSON upload (multipart field "file" or raw body).
+
+    Valid rows are written in one append/transaction; the response lists the
+    errors for every rejected row. atomic=true rejects the whole file if any
+    row is invalid.
+    """
+    try:
+        denied = admin_denied()
+        if denied:
+            return denied
+
+        upload = request.files.get('file')
+        raw = upload.read() if upload else request.get_data()
+        if not raw:
+            return jsonify({'error': 'No file provided'}), 400
+
+        name = (upload.filename if upload else '') or ''
+        import_format = request.args.get('format') or (
+            'ndjson' if name.endswith(('.ndjson', '.jsonl')) or 'ndjson' in (request.content_type or '') else 'csv'
+        )
+        if import_format not in ('csv', 'ndjson'):
+            return jsonify({'error': 'format must be csv or ndjson'}), 400
+        try:
+            if import_format == 'ndjson':
+                frame = read_patient_ndjson(raw)
+            else:
+                frame = pd.read_csv(io.BytesIO(raw), dtype=str, keep_default_na=False)
+        except ValueError as e:
+            return jsonify({'error': f'Could not parse {import_format} upload: {str(e)}'}), 400
+
+        max_rows = int(os.getenv('IMPORT_MAX_ROWS', '100000'))
+        if len(frame) > max_rows:
+            return jsonify({'error': f'Too many rows ({len(frame)}); the limit is {max_rows}'}), 413
+
+        report = patient_manager.import_patients(frame, atomic=request.args.get('atomic', 'false').lower() == 'true')
+        if report is None:
+            return jsonify({'error': 'Failed to import patients'}), 500
+
+        return jsonify({
+            'success': True,
+            'received': len(frame),
+            'ignored_columns': [column for column in frame.columns if column not in PATIENT_FIELDS],
+            **report
+        })
+
+    except Exception as e:
+        return jsonify({'error': f'Failed to import patients: {str(e)}'}), 500
+
+@app.route('/patients/export', methods=['GET'])
+def export_patients():
+    """
+    Stream the patient registry as NDJSON (default) or CSV in constant memory.
+
+    Query parameters: format, fields (comma separated), registered_from,
+    registered_to, previous_kidney_stones, and limit/cursor for keyset pages
+    (the next cursor is returned in the X-Next-Cursor header).
+    """
+    try:
+        denied = admin_denied()
+        if denied:
+            return denied
+
+        export_format = request.args.get('format', 'ndjson').lower()
+        if export_format not in ('ndjson', 'csv'):
+            return jsonify({'error': 'format must be ndjson or csv'}), 400
+
+        fields = [field.strip() for field in request.args['fields'].split(',')] if request.args.get('fields') else None
+        filters = {
+            'registered_from': request.args.get('registered_from'),
+            'registered_to': request.args.get('registered_to'),
+            'previous_kidney_stones': request.args.get('previous_kidney_stones')
+        }
+        cursor = request.args.get('cursor')
+        limit = request.args.get('limit', type=int)
+        if limit is not None and limit < 1:
+            return jsonify({'error': 'limit must be a positive integer'}), 400
+
+        headers = {}
+        if limit is not None:
+            rows, next_cursor = patient_manager.list_patients(limit=limit, cursor=cursor, fields=fields, **filters)
+            if next_cursor:
+                headers['X-Next-Cursor'] = next_cursor
+        else:
+            patients = patient_manager.iter_patients(fields=fields, cursor=cursor, **filters)
+            # Start the generator so bad fields or cursors fail before the response begins
+            first = next(patients, None)
+            rows = (row for _, row in itertools.chain([first] if first else [], patients))
+
+        columns = fields or PATIENT_FIELDS
+        if export_format == 'csv':
+            def generate():
+                line = io.StringIO()
+                writer = csv.DictWriter(line, fieldnames=columns)
+                writer.writeheader()
+                for row in rows:
+                    writer.writerow(row)
+                    if line.tell() > 64 * 1024:
+                        yield line.getvalue()
+                        line.seek(0)
+                        line.truncate()
+                yield line.getvalue()
+
+            headers['Content-Disposition'] = 'attachment; filename=patients.csv'
+            return Response(stream_with_context(generate()), mimetype='text/csv', headers=headers)
+
+        def generate():
+            for row in rows:
+                yield json.dumps(row) + '\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson', headers=headers)
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'Failed to export patients: {str(e)}'}), 500
+
+@app.route('/patients/<patient_id>/scans', methods=['GET'])
+def patient_scan_history(patient_id):
+    """A patient's recorded scans, oldest first (since/until as ISO dates, stones=true for detections)"""
+    try:
+        denied = admin_denied()
+        if denied:
+            return denied
+
+        since = request.args.get('since')
+        until = request.args.get('until')
+        history = scan_history.get_history(
+            patient_id,
+            since=datetime.fromisoformat(since).timestamp() if since else None,
+            until=datetime.fromisoformat(until).timestamp() if until else None,
+            include_stones=request.args.get('stones', 'false').lower() == 'true'
+        )
+        return jsonify({'patient_id': patient_id, 'scans': history})
+
+    except ValueError as e:
+        return jsonify({'error': f'Invalid date: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'error': f'Failed to retrieve scan history: {str(e)}'}), 500
+
+@app.route('/patients/<patient_id>/trend', methods=['GET'])
+def patient_scan_trend(patient_id):
+    """Stone-burden trend for a patient and the change since the previous scan"""
+    try:
+        denied = admin_denied()
+        if denied:
+            return denied
+
+        trend = scan_history.get_trend(patient_id)
+        if trend is None:
+            return jsonify({'error': 'No scans recorded for this patient'}), 404
+        return jsonify(trend)
+
+    except Exception as e:
+        return jsonify({'error': f'Failed to compute scan trend: {str(e)}'}), 500
+
+@app.route('/alerts', methods=['GET'])
+def urgent_alerts():
+    """Severe and recent Moderate analyses, newest first"""
+    try:
+        denied = admin_denied()
+        if denied:
+            return denied
+
+        limit = request.args.get('limit', 100, type=int)
+        return jsonify({'cases': alert_store.get_urgent_cases(limit=limit)})
+
+    except Exception as e:
+        return jsonify({'error': f'Failed to retrieve alerts: {str(e)}'}), 500
+
+@app.route('/stats', methods=['GET'])
+def cohort_statistics():
+    """Stone size, confidence, severity and side distributions across all analyses (mode=full to verify)"""
+    try:
+        denied = admin_denied()
+        if denied:
+            return denied
+
+        if request.args.get('mode') == 'full':
+            return jsonify(cohort_stats.verify())
+
+        stats = cohort_stats.get_stats()
+        if stats is None:
+            return jsonify({'error': 'Cohort statistics unavailable'}), 500
+        return jsonify(stats)
+
+    except Exception as e:
+        return jsonify({'error': f'Failed to compute cohort statistics: {str(e)}'}), 500
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -868,5 +1243,21 @@ def health_check():
         "version": "1.0"
     })
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Runtime metrics for caches and background services"""
+    return jsonify({
+        "timestamp": datetime.now().isoformat(),
+        "llm_client": get_llm_stats(),
+        "llm_cache": get_cache_stats(),
+        "chat_tiers": get_tier_stats(),
+        "chat_sessions": get_session_stats(),
+        "chat_stream": get_stream_stats(),
+        "scan_history": scan_history.get_stats(),
+        "sessions": app.session_interface.get_stats() if hasattr(app.session_interface, 'get_stats') else None,
+        "alerts": notification_worker.get_stats(),
+        "storage": {"uploads": upload_store.get_stats(), "reports": report_store.get_stats()}
+    })
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
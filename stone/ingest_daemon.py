@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Watch-folder ingestion for scanner (PACS) exports.
+
+New images dropped into the watch folder are analysed in batches with the
+same detection and post-processing as /predict, one JSON line per image is
+appended to the results file, and the image is moved to the processed (or
+failed) folder:
+
+    python ingest_daemon.py --watch /mnt/pacs-export --results ingest_results.jsonl --metrics-port 9108
+
+Files are picked up only after their size and mtime have stopped changing
+for --settle seconds, so slices still being copied are left alone; an image
+that still fails to decode (a copy that stalled longer than that) is retried
+until it is --incomplete-timeout seconds old before it counts as failed. Results
+are written before the image is moved, so a crash in between reprocesses
+the image rather than losing it.
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image
+from safe_io import FileLock, GroupCommitWriter
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+# Names copy tools use while a transfer is still in progress
+PARTIAL_SUFFIXES = ('.part', '.partial', '.tmp', '.filepart', '.crdownload')
+
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    """Linux inotify on one directory through libc; wait() returns the names that changed"""
+
+    mode = 'inotify'
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f'inotify_add_watch failed for {directory}')
+
+    def wait(self, timeout):
+        """
+        Returns:
+            changed names, [] on timeout, or None when events were lost and the folder must be rescanned
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        names, offset = [], 0
+        while offset < len(data):
+            _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if name:
+                names.append(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Fallback for platforms or network shares without inotify: every wait() means rescan"""
+
+    mode = 'polling'
+
+    def __init__(self, directory, interval=2.0):
+        self.interval = interval
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        return None
+
+    def close(self):
+        pass
+
+
+def create_watcher(directory, polling=False, poll_interval=2.0):
+    """inotify where available, polling otherwise"""
+    if not polling:
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable ({e}), falling back to polling")
+    return PollingWatcher(directory, poll_interval)
+
+
+class IngestDaemon:
+    """
+    Moves images from watch_dir through analyze_fn in batches.
+
+    analyze_fn takes a list of RGB PIL images and returns one analysis dict
+    per image (stone_inference.analyze_images). When a scan history store is
+    given, every result is also recorded there, so the cohort statistics
+    include ingested scans.
+    """
+
+    def __init__(self, watch_dir, analyze_fn, results_path, processed_dir=None, failed_dir=None,
+                 batch_size=16, settle_seconds=2.0, poll_interval=2.0, rescan_interval=60.0,
+                 incomplete_timeout=120.0, polling=False, scan_history=None):
+        self.watch_dir = watch_dir
+        self.analyze_fn = analyze_fn
+        self.processed_dir = processed_dir or os.path.join(watch_dir, 'processed')
+        self.failed_dir = failed_dir or os.path.join(watch_dir, 'failed')
+        self.batch_size = batch_size
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.rescan_interval = rescan_interval
+        self.incomplete_timeout = incomplete_timeout
+        self.scan_history = scan_history
+        for directory in (watch_dir, self.processed_dir, self.failed_dir):
+            os.makedirs(directory, exist_ok=True)
+        self.results = GroupCommitWriter(results_path, FileLock(results_path + '.lock'))
+        self.watcher = create_watcher(watch_dir, polling, poll_interval)
+
+        # name -> (size, mtime_ns, stable_since, first_seen)
+        self.pending = {}
+        self._last_rescan = 0.0
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._recent = deque()  # (finished_at, images) for throughput
+        self.stats = {"files_processed": 0, "files_failed": 0, "batches": 0, "inference_seconds": 0.0,
+                      "lag_seconds_total": 0.0, "max_lag_seconds": 0.0, "last_lag_seconds": None, "rescans": 0,
+                      "incomplete_retries": 0}
+
+    @staticmethod
+    def is_candidate(name):
+        lowered = name.lower()
+        return (not name.startswith('.') and lowered.endswith(IMAGE_EXTENSIONS)
+                and not lowered.endswith(PARTIAL_SUFFIXES))
+
+    def _observe(self, name, now):
+        path = os.path.join(self.watch_dir, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self.pending.pop(name, None)
+            return
+        if not os.path.isfile(path):
+            return
+        signature = (stat.st_size, stat.st_mtime_ns)
+        previous = self.pending.get(name)
+        if previous is None:
+            self.pending[name] = (*signature, now, now)
+        elif previous[:2] != signature:
+            # Still being written: restart the settle timer
+            self.pending[name] = (*signature, now, previous[3])
+
+    def _rescan(self, now):
+        with os.scandir(self.watch_dir) as entries:
+            names = {entry.name for entry in entries if entry.is_file() and self.is_candidate(entry.name)}
+        for name in list(self.pending):
+            if name not in names:
+                del self.pending[name]
+        for name in names:
+            self._observe(name, now)
+        self._last_rescan = now
+        with self._lock:
+            self.stats["rescans"] += 1
+
+    def _ready(self, now):
+        ready = []
+        for name, (size, _, stable_since, _) in sorted(self.pending.items(), key=lambda item: item[1][3]):
+            if size > 0 and now - stable_since >= self.settle_seconds:
+                # Re-stat: the file may have changed since the last event
+                self._observe(name, now)
+                entry = self.pending.get(name)
+                if entry and entry[2] == stable_since:
+                    ready.append(name)
+        return ready
+
+    def run_once(self, timeout=None):
+        """Wait for changes (up to timeout), then process every settled file; returns how many were handled"""
+        if timeout is None:
+            timeout = self.poll_interval if self.pending else self.rescan_interval
+        changed = self.watcher.wait(timeout)
+        now = time.time()
+        if changed is None or now - self._last_rescan >= self.rescan_interval:
+            self._rescan(now)
+        else:
+            for name in changed:
+                if self.is_candidate(name):
+                    self._observe(name, now)
+
+        ready = self._ready(now)
+        for start in range(0, len(ready), self.batch_size):
+            self._process_batch(ready[start:start + self.batch_size])
+        return len(ready)
+
+    def _process_batch(self, names):
+        images, loaded = [], []
+        now = time.time()
+        for name in names:
+            path = os.path.join(self.watch_dir, name)
+            try:
+                with Image.open(path) as image:
+                    images.append(image.convert("RGB"))
+                loaded.append(name)
+            except Exception as e:
+                size, mtime_ns, _, first_seen = self.pending[name]
+                if now - first_seen < self.incomplete_timeout:
+                    # Probably a copy that paused longer than the settle time: wait for it to settle again
+                    self.pending[name] = (size, mtime_ns, now, first_seen)
+                    with self._lock:
+                        self.stats["incomplete_retries"] += 1
+                    continue
+                print(f"Error reading {name}: {e}")
+                self._finish(name, self.failed_dir, failed=True)
+
+        if not images:
+            return
+        started = time.time()
+        try:
+            analyses = self.analyze_fn(images)
+        except Exception as e:
+            print(f"Error analysing batch of {len(images)}: {e}")
+            for name in loaded:
+                self._finish(name, self.failed_dir, failed=True)
+            return
+        elapsed = time.time() - started
+
+        finished_at = time.time()
+        lines, lags = [], []
+        for name, analysis in zip(loaded, analyses):
+            lag = finished_at - self.pending[name][1] / 1e9
+            lags.append(lag)
+            lines.append(json.dumps({
+                "file": name,
+                "processed_at": datetime.now().isoformat(),
+                "lag_seconds": round(lag, 3),
+                **analysis
+            }) + '\n')
+            if self.scan_history is not None:
+                self.scan_history.record_scan('', analysis["detections"])
+        self.results.append(''.join(lines))
+
+        for name in loaded:
+            self._finish(name, self.processed_dir)
+        with self._lock:
+            self.stats["batches"] += 1
+            self.stats["files_processed"] += len(loaded)
+            self.stats["inference_seconds"] += elapsed
+            self.stats["lag_seconds_total"] += sum(lags)
+            self.stats["max_lag_seconds"] = max(self.stats["max_lag_seconds"], *lags)
+            self.stats["last_lag_seconds"] = round(lags[-1], 3)
+            self._recent.append((finished_at, len(loaded)))
+
+    def _finish(self, name, destination, failed=False):
+        self.pending.pop(name, None)
+        target = os.path.join(destination, name)
+        if os.path.exists(target):
+            stem, ext = os.path.splitext(name)
+            target = os.path.join(destination, f"{stem}.{int(time.time() * 1000)}{ext}")
+        try:
+            os.replace(os.path.join(self.watch_dir, name), target)
+        except OSError as e:
+            print(f"Error moving {name}: {e}")
+        if failed:
+            with self._lock:
+                self.stats["files_failed"] += 1
+
+    def run(self):
+        print(f"Watching {self.watch_dir} ({self.watcher.mode})")
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Error in ingest loop: {e}")
+                time.sleep(self.poll_interval)
+
+    def stop(self):
+        self._stop.set()
+
+    def get_stats(self, window_seconds=60):
+        """Throughput over the last window, lag from file write to result, and the backlog"""
+        now = time.time()
+        with self._lock:
+            while self._recent and now - self._recent[0][0] > window_seconds:
+                self._recent.popleft()
+            recent_images = sum(count for _, count in self._recent)
+            stats = dict(self.stats)
+        pending = list(self.pending.values())
+        processed = stats["files_processed"] or 1
+        stats.update({
+            "mode": self.watcher.mode,
+            "throughput_images_per_second": round(recent_images / window_seconds, 3),
+            "avg_batch_size": round(stats["files_processed"] / stats["batches"], 2) if stats["batches"] else 0,
+            "avg_lag_seconds": round(stats.pop("lag_seconds_total") / processed, 3),
+            "max_lag_seconds": round(stats["max_lag_seconds"], 3),
+            "inference_seconds": round(stats["inference_seconds"], 3),
+            "backlog_files": len(pending),
+            "backlog_settling": sum(1 for entry in pending if now - entry[2] < self.settle_seconds),
+            "oldest_backlog_seconds": round(now - min(entry[3] for entry in pending), 3) if pending else 0,
+            "results": self.results.get_stats()
+        })
+        return stats
+
+
+def serve_metrics(daemon, port):
+    """Serve daemon.get_stats() as JSON on GET /metrics from a background thread"""
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = json.dumps(daemon.get_stats()).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Watch a folder of scanner exports and analyse new images')
+    parser.add_argument('--watch', default=os.getenv('INGEST_WATCH_DIR', 'incoming'))
+    parser.add_argument('--processed', default=os.getenv('INGEST_PROCESSED_DIR'))
+    parser.add_argument('--failed', default=os.getenv('INGEST_FAILED_DIR'))
+    parser.add_argument('--results', default=os.getenv('INGEST_RESULTS', 'ingest_results.jsonl'))
+    parser.add_argument('--batch-size', type=int, default=int(os.getenv('INGEST_BATCH_SIZE', '16')))
+    parser.add_argument('--settle', type=float, default=float(os.getenv('INGEST_SETTLE_SECONDS', '2')))
+    parser.add_argument('--poll-interval', type=float, default=float(os.getenv('INGEST_POLL_INTERVAL', '2')))
+    parser.add_argument('--incomplete-timeout', type=float, default=float(os.getenv('INGEST_INCOMPLETE_TIMEOUT', '120')))
+    parser.add_argument('--polling', action='store_true', help='poll instead of using inotify (e.g. on network shares)')
+    parser.add_argument('--record-history', action='store_true', help='also record results in the scan history store')
+    parser.add_argument('--metrics-port', type=int, default=int(os.getenv('INGEST_METRICS_PORT', '0')))
+    args = parser.parse_args()
+
+    # Imported here so the daemon module itself does not need the model stack
+    from stone_inference import analyze_images
+    from kidney_roi import roi_settings_from_env
+    from scan_history import scan_history_from_env
+
+    daemon = IngestDaemon(
+        args.watch,
+        lambda images: analyze_images(images, batch_size=args.batch_size, **roi_settings_from_env()),
+        args.results,
+        processed_dir=args.processed,
+        failed_dir=args.failed,
+        batch_size=args.batch_size,
+        settle_seconds=args.settle,
+        poll_interval=args.poll_interval,
+        incomplete_timeout=args.incomplete_timeout,
+        polling=args.polling,
+        scan_history=scan_history_from_env() if args.record_history else None
+    )
+    if args.metrics_port:
+        serve_metrics(daemon, args.metrics_port)
+        print(f"Ingest metrics on http://127.0.0.1:{args.metrics_port}/metrics")
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
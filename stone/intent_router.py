@@ -0,0 +1,159 @@
+import os
+from response_cache import normalize_question
+
+# Keyword weights per intent; multi-word phrases are matched against the normalized question
+INTENT_KEYWORDS = {
+    "hydration": {
+        "water": 2, "drink": 1.5, "drinking": 1.5, "hydration": 2, "hydrate": 2, "hydrated": 2,
+        "fluid": 1.5, "fluids": 1.5, "liters": 1, "litres": 1, "how much water": 1, "dehydration": 1.5
+    },
+    "diet": {
+        "diet": 2, "eat": 1.5, "eating": 1.5, "food": 2, "foods": 2, "avoid": 1, "oxalate": 2,
+        "salt": 1.5, "sodium": 1.5, "protein": 1, "meat": 1, "calcium": 1, "coffee": 1,
+        "tea": 1, "spinach": 1.5, "chocolate": 1, "nuts": 1, "soda": 1, "alcohol": 1
+    },
+    "pain": {
+        "pain": 2, "painful": 2, "hurt": 1.5, "hurts": 1.5, "ache": 1.5, "cramp": 1.5,
+        "cramping": 1.5, "colic": 2, "painkiller": 2, "painkillers": 2, "relieve": 1, "relief": 1
+    },
+    "see_doctor": {
+        "doctor": 2, "urologist": 2, "hospital": 1.5, "emergency": 1.5, "surgery": 2,
+        "treatment": 1, "serious": 1, "dangerous": 1, "see a": 0.5, "appointment": 1.5,
+        "specialist": 1.5, "lithotripsy": 2
+    }
+}
+
+MIN_CONFIDENCE = float(os.getenv('RULE_TIER_MIN_CONFIDENCE', '0.6'))
+
+
+def classify_intent(question):
+    """
+    Score a question against the known intents.
+
+    Returns:
+        (intent, confidence) where confidence is in [0, 1]; intent is None if nothing matched
+    """
+    normalized = normalize_question(question)
+    padded = f" {normalized} "
+    scores = {
+        intent: sum(weight for keyword, weight in keywords.items() if f" {keyword} " in padded)
+        for intent, keywords in INTENT_KEYWORDS.items()
+    }
+    intent, top_score = max(scores.items(), key=lambda item: item[1])
+    if top_score == 0:
+        return None, 0.0
+
+    # Strong keyword evidence for a single intent gives high confidence;
+    # competing intents or long, specific questions lower it
+    strength = min(1.0, top_score / 3)
+    purity = top_score / sum(scores.values())
+    word_count = len(normalized.split())
+    length_penalty = 1.0 if word_count <= 15 else 15 / word_count
+    return intent, round(strength * purity * length_penalty, 3)
+
+
+def _urgency_lines(largest):
+    lines = []
+    if largest > 5:
+        lines.append("• Consider consultation with urologist")
+    if largest > 10:
+        lines.append("• Urgent medical attention recommended")
+    return lines
+
+
+def _hydration_answer(context):
+    largest = context['size_analysis']['largest_stone']
+    lines = [
+        "Hydration Recommendations:",
+        "• Drink 2-3 liters of water daily, spread evenly through the day",
+        "• Aim for pale yellow urine as a sign of good hydration",
+        "• Increase intake in hot weather or after exercise",
+        "• Lemon water adds citrate, which can help prevent new stones",
+        "",
+        "Your Scan:",
+        f"• {context['stone_count']} stone(s) detected, largest {largest:.1f}mm"
+    ]
+    if largest <= 5:
+        lines.append("• Stones of this size often pass on their own with good hydration")
+    lines.extend(_urgency_lines(largest))
+    return "\n".join(lines)
+
+
+def _diet_answer(context):
+    largest = context['size_analysis']['largest_stone']
+    lines = [
+        "Dietary Recommendations:",
+        "• Limit sodium to less than 2300mg per day",
+        "• Avoid high-oxalate foods such as spinach, nuts and chocolate in large amounts",
+        "• Reduce animal protein (red meat, poultry, seafood)",
+        "• Keep normal dietary calcium - do not cut out dairy unless your doctor advises",
+        "• Avoid sugary sodas and limit alcohol",
+        "",
+        "Your Scan:",
+        f"• {context['stone_count']} stone(s) detected, largest {largest:.1f}mm, average {context['size_analysis']['average_size']:.1f}mm"
+    ]
+    lines.extend(_urgency_lines(largest))
+    return "\n".join(lines)
+
+
+def _pain_answer(context):
+    largest = context['size_analysis']['largest_stone']
+    lines = [
+        "Managing Pain:",
+        "• Over-the-counter pain relievers can help - follow the dosing on the label",
+        "• A heating pad on your back or side may ease cramping",
+        "• Keep drinking water to help the stone move",
+        "",
+        "When to Seek Medical Attention:",
+        "• Severe pain that does not improve with medication",
+        "• Blood in urine",
+        "• Fever or chills",
+        "• Nausea or vomiting that prevents drinking fluids",
+        "",
+        "Your Scan:",
+        f"• Largest stone {largest:.1f}mm ({context['distribution']['left_kidney']} left, {context['distribution']['right_kidney']} right)"
+    ]
+    lines.extend(_urgency_lines(largest))
+    return "\n".join(lines)
+
+
+def _see_doctor_answer(context):
+    largest = context['size_analysis']['largest_stone']
+    lines = ["When to See a Urologist:"]
+    if largest > 10:
+        lines.append(f"• Your largest stone is {largest:.1f}mm - urgent medical attention recommended")
+    elif largest > 5:
+        lines.append(f"• Your largest stone is {largest:.1f}mm - consider consultation with urologist")
+        lines.append("• Stones larger than 5mm are less likely to pass on their own")
+    else:
+        lines.append(f"• Your largest stone is {largest:.1f}mm - small stones often pass on their own")
+        lines.append("• Schedule a routine follow-up to monitor your stones")
+    lines.extend([
+        "",
+        "Seek Care Immediately If:",
+        "• Severe pain or cramping",
+        "• Blood in urine",
+        "• Fever or chills"
+    ])
+    return "\n".join(lines)
+
+
+INTENT_ANSWERS = {
+    "hydration": _hydration_answer,
+    "diet": _diet_answer,
+    "pain": _pain_answer,
+    "see_doctor": _see_doctor_answer
+}
+
+
+def answer_from_rules(question, context, min_confidence=MIN_CONFIDENCE):
+    """
+    Answer well-known intents from templates filled with create_context() values.
+
+    Returns:
+        (answer, intent, confidence); answer is None when confidence is below min_confidence
+    """
+    intent, confidence = classify_intent(question)
+    if intent is None or confidence < min_confidence:
+        return None, intent, confidence
+    return INTENT_ANSWERS[intent](context), intent, confidence
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Kidney region-of-interest stage for two-stage detection.
+
+Stones only occur in the renal areas, which sit at stable positions in
+these exports. The ROI stage is a fixed anatomical prior: one region per
+kidney, in normalized image coordinates, fitted to the stone boxes in the
+training labels. The detector runs on the crops, each at its own input
+size, and boxes are mapped back to full-image coordinates.
+
+Refit the prior or check how many labelled stones it keeps (the recall
+ceiling of the ROI stage) with:
+
+    python kidney_roi.py --fit data/train/labels --check data/test/labels
+"""
+
+import argparse
+import glob
+import json
+import os
+import numpy as np
+
+# Fitted on data/train/labels (99.6% of boxes per side, 2% margin)
+DEFAULT_ROI_REGIONS = ((0.057, 0.253, 0.437, 1.0), (0.51, 0.254, 0.962, 0.979))
+
+
+def read_label_file(path):
+    """The boxes of one YOLO-format label file as an (n, 4) array of normalized x1, y1, x2, y2"""
+    rows = []
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            parts = line.split()
+            if len(parts) == 5:
+                rows.append([float(value) for value in parts[1:]])
+    if not rows:
+        return np.empty((0, 4))
+    centre_x, centre_y, width, height = np.array(rows).T
+    return np.column_stack([centre_x - width / 2, centre_y - height / 2, centre_x + width / 2, centre_y + height / 2])
+
+
+def load_label_boxes(label_dir):
+    """Every YOLO-format label box under label_dir, as read_label_file"""
+    parts = [read_label_file(path) for path in sorted(glob.glob(os.path.join(label_dir, '*.txt')))]
+    return np.concatenate(parts) if parts else np.empty((0, 4))
+
+
+def fit_roi_regions(label_dir, coverage=0.996, margin=0.02):
+    """
+    One region per kidney: label boxes are split by which half of the image
+    their centre lies in, and each side's region spans the given quantile
+    of box edges plus a margin.
+    """
+    boxes = load_label_boxes(label_dir)
+    regions = []
+    tail = (1 - coverage) / 2
+    for side in ((boxes[:, 0] + boxes[:, 2]) / 2 < 0.5, (boxes[:, 0] + boxes[:, 2]) / 2 >= 0.5):
+        side_boxes = boxes[side]
+        if not len(side_boxes):
+            continue
+        low = np.quantile(side_boxes[:, :2], tail, axis=0) - margin
+        high = np.quantile(side_boxes[:, 2:], 1 - tail, axis=0) + margin
+        regions.append(tuple(np.round(np.clip(np.concatenate([low, high]), 0.0, 1.0), 3).tolist()))
+    return tuple(regions)
+
+
+def roi_coverage(label_dir, regions=DEFAULT_ROI_REGIONS):
+    """Share of labelled stones lying wholly inside a region, and the share of image area the regions keep"""
+    boxes = load_label_boxes(label_dir)
+    regions = np.asarray(regions, dtype=np.float64)
+    inside = ((boxes[:, None, :2] >= regions[None, :, :2]) & (boxes[:, None, 2:] <= regions[None, :, 2:])).all(axis=2).any(axis=1)
+
+    # Union area on a fine grid, since regions may overlap
+    grid = (np.arange(500) + 0.5) / 500
+    xs, ys = np.meshgrid(grid, grid)
+    covered = np.zeros_like(xs, dtype=bool)
+    for x1, y1, x2, y2 in regions:
+        covered |= (xs >= x1) & (xs <= x2) & (ys >= y1) & (ys <= y2)
+    return {
+        'boxes': int(len(boxes)),
+        'inside': round(float(inside.mean()), 4) if len(boxes) else None,
+        'area_fraction': round(float(covered.mean()), 4)
+    }
+
+
+def crop_regions(image, regions=DEFAULT_ROI_REGIONS):
+    """Crops of a PIL image for each normalized region, with the pixel offset of each crop"""
+    width, height = image.size
+    crops = []
+    for x1, y1, x2, y2 in regions:
+        box = (int(np.floor(x1 * width)), int(np.floor(y1 * height)), int(np.ceil(x2 * width)), int(np.ceil(y2 * height)))
+        crops.append((image.crop(box), box[:2]))
+    return crops
+
+
+def roi_regions_from_env():
+    """ROI_REGIONS as JSON [[x1, y1, x2, y2], ...] in normalized coordinates, or the fitted default"""
+    value = os.getenv('ROI_REGIONS')
+    return tuple(tuple(region) for region in json.loads(value)) if value else DEFAULT_ROI_REGIONS
+
+
+def roi_settings_from_env():
+    """
+    Keyword arguments for stone_inference.analyze_images/detect_stones:
+    ROI_MODE=prior turns the crop stage on (ROI_REGIONS, ROI_IMGSZ), anything
+    else keeps whole-image inference. Without ROI_IMGSZ the crop size is
+    derived per batch so crops keep the whole-image scale.
+    """
+    if os.getenv('ROI_MODE', 'off').lower() != 'prior':
+        return {}
+    return {'roi_regions': roi_regions_from_env(), 'roi_imgsz': int(os.getenv('ROI_IMGSZ') or 0) or None}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fit or check the kidney ROI prior against YOLO labels')
+    parser.add_argument('--fit', help='label directory to fit regions on')
+    parser.add_argument('--check', help='label directory to measure coverage on')
+    parser.add_argument('--coverage', type=float, default=0.996)
+    parser.add_argument('--margin', type=float, default=0.02)
+    args = parser.parse_args()
+
+    regions = roi_regions_from_env()
+    if args.fit:
+        regions = fit_roi_regions(args.fit, args.coverage, args.margin)
+        print(f"Regions: {json.dumps([list(region) for region in regions])}")
+    if args.check:
+        print(f"Coverage on {args.check}: {roi_coverage(args.check, regions)}")
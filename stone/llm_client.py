@@ -0,0 +1,194 @@
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import httpx
+from openai import OpenAI
+
+
+class LLMUnavailableError(Exception):
+    """Raised when the upstream LLM is failing, too slow, or the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Classic closed / open / half-open breaker.
+
+    After failure_threshold consecutive failures the circuit opens and calls
+    fail fast for reset_timeout seconds; then a single trial call is let
+    through and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        """Return True if a call may be attempted now"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                self._trial_in_flight = False
+            if self.state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.state == 'half_open' or self.consecutive_failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+
+class ResilientLLMClient:
+    """
+    OpenAI-compatible chat client with a pooled HTTP connection, per-call
+    deadlines, a hedged request to a fallback model once the primary is
+    slower than hedge_after seconds (or fails), and a circuit breaker.
+    """
+
+    def __init__(self, base_url, api_key, default_headers=None, fallback_model=None,
+                 timeout=20.0, hedge_after=4.0, max_connections=20,
+                 failure_threshold=5, reset_timeout=30.0):
+        self.fallback_model = fallback_model
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.stats = Counter(calls=0, hedged=0, hedge_wins=0, failures=0, short_circuited=0)
+        self._stats_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix='llm-call')
+
+        # Keep-alive pool shared by every worker thread; retries are handled here, not by the SDK
+        self.http_client = httpx.Client(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections // 2),
+            timeout=httpx.Timeout(timeout, connect=5.0)
+        )
+        self.client = OpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            default_headers=default_headers,
+            http_client=self.http_client,
+            max_retries=0
+        )
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _deadline(self, timeout):
+        return time.monotonic() + min(timeout or self.timeout, self.timeout)
+
+    def create_completion(self, **kwargs):
+        """
+        Drop-in for client.chat.completions.create().
+
+        Raises:
+            LLMUnavailableError: if the circuit is open or every attempt failed before the deadline
+        """
+        if not self.breaker.allow_request():
+            self._count('short_circuited')
+            raise LLMUnavailableError("LLM circuit breaker is open")
+
+        self._count('calls')
+        deadline = self._deadline(kwargs.pop('timeout', None))
+        if kwargs.get('stream'):
+            return self._create_stream(kwargs, deadline)
+
+        started = time.monotonic()
+        primary = self._executor.submit(self._call, kwargs, kwargs['model'], deadline)
+        attempts = {primary}
+        hedged = False
+        last_error = None
+
+        while True:
+            # Primary is slow or already failed: race a request against the fallback model
+            if not hedged and self.fallback_model and (
+                    last_error is not None or time.monotonic() - started >= self.hedge_after):
+                hedged = True
+                self._count('hedged')
+                attempts.add(self._executor.submit(self._call, kwargs, self.fallback_model, deadline))
+
+            remaining = deadline - time.monotonic()
+            if not attempts or remaining <= 0:
+                break
+            wait_for = remaining
+            if not hedged and self.fallback_model:
+                wait_for = min(remaining, max(0.0, started + self.hedge_after - time.monotonic()))
+
+            done, _ = wait(attempts, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                attempts.discard(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                for other in attempts:
+                    other.cancel()
+                if future is not primary:
+                    self._count('hedge_wins')
+                self.breaker.record_success()
+                return result
+
+        self._count('failures')
+        self.breaker.record_failure()
+        raise LLMUnavailableError(f"LLM request failed: {last_error or 'deadline exceeded'}")
+
+    def _call(self, kwargs, model, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("deadline exceeded")
+        return self.client.chat.completions.create(**dict(kwargs, model=model, timeout=remaining))
+
+    def _create_stream(self, kwargs, deadline):
+        # Streams are not hedged; the deadline bounds connecting and the wait for the first byte
+        try:
+            stream = self._call(kwargs, kwargs['model'], deadline)
+        except Exception as e:
+            self._count('failures')
+            self.breaker.record_failure()
+            raise LLMUnavailableError(f"LLM request failed: {e}") from e
+        self.breaker.record_success()
+        return stream
+
+    def get_stats(self):
+        """Return call counters and the current circuit state"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['circuit_state'] = self.breaker.state
+        stats['consecutive_failures'] = self.breaker.consecutive_failures
+        return stats
+
+
+def client_from_env(base_url, api_key, default_headers=None, default_model=None):
+    """Create the resilient client configured through LLM_* environment variables"""
+    return ResilientLLMClient(
+        base_url=base_url,
+        api_key=api_key,
+        default_headers=default_headers,
+        # No hedging unless a distinct fallback model is configured; re-asking the same model doubles cost
+        fallback_model=os.getenv('LLM_FALLBACK_MODEL') or None,
+        timeout=float(os.getenv('LLM_TIMEOUT', '20')),
+        hedge_after=float(os.getenv('LLM_HEDGE_AFTER', '4')),
+        max_connections=int(os.getenv('LLM_MAX_CONNECTIONS', '20')),
+        failure_threshold=int(os.getenv('LLM_BREAKER_THRESHOLD', '5')),
+        reset_timeout=float(os.getenv('LLM_BREAKER_RESET', '30'))
+    )
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Local mock of the OpenAI-compatible chat completions API used by chatbot_service.
+
+Run it and point the service at it to work offline:
+
+    python mock_llm_server.py --port 8001
+    LLM_BASE_URL=http://localhost:8001/v1 python flask_app.py
+"""
+
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CANNED_RESPONSE = """Hydration Recommendations:
+• Drink 2-3 liters of water daily
+• Spread intake evenly through the day
+
+When to Seek Medical Attention:
+• Severe pain or cramping
+• Blood in urine
+• Fever or chills
+"""
+
+
+class MockCompletionsHandler(BaseHTTPRequestHandler):
+    """Serves POST .../chat/completions with a canned answer, streamed or in one piece"""
+
+    # Overridden per server through make_handler()
+    latency = 0.0
+    token_delay = 0.0
+    response_text = CANNED_RESPONSE
+    fail = False
+    model_latency = {}
+    model_responses = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self.send_error(404)
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+
+        if self.fail:
+            self._send_json(503, {"error": {"message": "mock upstream unavailable"}})
+            return
+
+        model = body.get('model', 'mock-model')
+        time.sleep(self.model_latency.get(model, self.latency))
+        response_text = self.model_responses.get(model, self.response_text)
+        if body.get('stream'):
+            self._stream(model, response_text)
+        else:
+            self._send_json(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": response_text},
+                    "finish_reason": "stop"
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+            })
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, model, response_text):
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        def send_chunk(delta, finish_reason=None):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        try:
+            send_chunk({"role": "assistant", "content": ""})
+            for token in response_text.split(' '):
+                time.sleep(self.token_delay)
+                send_chunk({"content": token + ' '})
+            send_chunk({}, finish_reason="stop")
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def make_handler(latency=0.0, token_delay=0.0, response_text=CANNED_RESPONSE, fail=False,
+                 model_latency=None, model_responses=None):
+    """Create a handler class with its own latency and response settings (optionally per model)"""
+    return type('ConfiguredMockCompletionsHandler', (MockCompletionsHandler,), {
+        'latency': latency,
+        'token_delay': token_delay,
+        'response_text': response_text,
+        'fail': fail,
+        'model_latency': model_latency or {},
+        'model_responses': model_responses or {}
+    })
+
+
+def start_mock_server(port=0, **handler_options):
+    """
+    Start the mock server on a background thread.
+
+    Returns:
+        (server, base_url) - call server.shutdown() when done
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(**handler_options))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mock OpenAI-compatible chat completions server')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.5, help='Seconds before the first byte')
+    parser.add_argument('--token-delay', type=float, default=0.02, help='Seconds between streamed tokens')
+    parser.add_argument('--fail', action='store_true', help='Answer every request with HTTP 503')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(
+        ('127.0.0.1', args.port),
+        make_handler(latency=args.latency, token_delay=args.token_delay, fail=args.fail)
+    )
+    print(f"Mock LLM server listening on http://127.0.0.1:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Local SMTP sink for testing doctor alert emails without a real mail server.
+
+Accepts every message, keeps it in memory and prints a one-line summary:
+
+    python mock_smtp_server.py --port 1025
+    SMTP_HOST=127.0.0.1 SMTP_PORT=1025 python flask_app.py
+"""
+
+import argparse
+import threading
+from email import message_from_bytes
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+
+
+class MockSMTPHandler(StreamRequestHandler):
+    """Just enough of RFC 5321 for smtplib: EHLO/HELO, MAIL, RCPT, DATA, RSET, NOOP, QUIT"""
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode('ascii'))
+
+    def handle(self):
+        self.reply("220 mock-smtp ready")
+        sender, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+
+            if verb == 'EHLO':
+                self.reply("250-mock-smtp")
+                self.reply("250 8BITMIME")
+            elif verb == 'HELO':
+                self.reply("250 mock-smtp")
+            elif verb == 'MAIL':
+                sender, recipients = command.split(':', 1)[1].strip(), []
+                self.reply("250 OK")
+            elif verb == 'RCPT':
+                recipients.append(command.split(':', 1)[1].strip().strip('<>'))
+                self.reply("250 OK")
+            elif verb == 'DATA':
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = b''
+                while True:
+                    chunk = self.rfile.readline()
+                    if not chunk or chunk in (b'.\r\n', b'.\n'):
+                        break
+                    data += chunk[1:] if chunk.startswith(b'..') else chunk
+                self.server.record(sender, recipients, message_from_bytes(data))
+                self.reply("250 OK queued")
+            elif verb == 'RSET':
+                sender, recipients = None, []
+                self.reply("250 OK")
+            elif verb == 'NOOP':
+                self.reply("250 OK")
+            elif verb == 'QUIT':
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class MockSMTPServer(ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, verbose=False):
+        super().__init__(address, MockSMTPHandler)
+        self.messages = []
+        self.connections = 0
+        self.verbose = verbose
+        self._lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        with self._lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+    def record(self, sender, recipients, message):
+        with self._lock:
+            self.messages.append({'from': sender, 'to': recipients, 'subject': message['Subject'], 'message': message})
+        if self.verbose:
+            print(f"📧 {', '.join(recipients)}: {message['Subject']}")
+
+
+def start_mock_smtp_server(port=0, verbose=False):
+    """
+    Start the SMTP sink on a background thread.
+
+    Returns:
+        (server, port) - received mail is in server.messages; call server.shutdown() when done
+    """
+    server = MockSMTPServer(('127.0.0.1', port), verbose=verbose)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, server.server_address[1]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local SMTP sink for alert emails')
+    parser.add_argument('--port', type=int, default=1025)
+    args = parser.parse_args()
+
+    server = MockSMTPServer(('127.0.0.1', args.port), verbose=True)
+    print(f"Mock SMTP server listening on 127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
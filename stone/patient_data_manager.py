@@ -1,85 +1,159 @@
+import base64
 import csv
+import io
+import json
 import os
 import uuid
 from datetime import datetime
+import numpy as np
 import pandas as pd
+from safe_io import FileLock, GroupCommitWriter, create_if_missing
+from scan_events import ScanCounterLog
+from search_index import TrigramSearchIndex, iter_csv_records
+
+PATIENT_FIELDS = [
+    'patient_id', 'first_name', 'last_name', 'date_of_birth', 'age', 
+    'gender', 'email', 'phone', 'address', 'emergency_contact_name',
+    'emergency_contact_phone', 'medical_history', 'current_medications',
+    'allergies', 'previous_kidney_stones', 'registration_date', 
+    'last_scan_date', 'total_scans'
+]
+
+def encode_cursor(position):
+    """Opaque, URL-safe pagination cursor"""
+    return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor, *keys):
+    """Decode a cursor made by encode_cursor, requiring the given keys"""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        position = None
+    if not isinstance(position, dict) or any(key not in position for key in keys):
+        raise ValueError("Invalid cursor")
+    return position
+
+def check_fields(fields):
+    """Validate a column projection; None means every field"""
+    if fields is None:
+        return PATIENT_FIELDS
+    unknown = [field for field in fields if field not in PATIENT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return list(fields)
+
+def read_patient_ndjson(raw):
+    """
+    Parse an NDJSON upload into a frame of strings for import_patients.
+    JSON numbers keep their literal text, so a phone sent as a number is not
+    turned into a float when other rows leave it out.
+    """
+    records = []
+    for number, line in enumerate(raw.decode('utf-8').splitlines(), 1):
+        if not line.strip():
+            continue
+        record = json.loads(line, parse_int=str, parse_float=str)
+        if not isinstance(record, dict):
+            raise ValueError(f"Line {number} is not a JSON object")
+        records.append(record)
+    return pd.DataFrame.from_records(records)
+
+def matches_filters(row, registered_from=None, registered_to=None, previous_kidney_stones=None):
+    """Registration dates are inclusive YYYY-MM-DD bounds; previous_kidney_stones matches case-insensitively"""
+    registered = row.get('registration_date') or ''
+    if registered_from and registered[:10] < registered_from:
+        return False
+    if registered_to and registered[:10] > registered_to:
+        return False
+    if previous_kidney_stones is not None and (row.get('previous_kidney_stones') or '').lower() != previous_kidney_stones.lower():
+        return False
+    return True
 
 class PatientDataManager:
     def __init__(self, csv_file_path='patient_data.csv'):
         self.csv_file_path = csv_file_path
         self.ensure_csv_exists()
+        
+        # Writers to the patient file (appends, scan counter flushes) serialize on this lock
+        self.file_lock = FileLock(csv_file_path + '.lock')
+        
+        # Scans go to an append-only event log; counters are folded into the CSV in batches
+        self.scan_log = ScanCounterLog(
+            csv_file_path, self.file_lock,
+            flush_threshold=int(os.getenv('SCAN_FLUSH_THRESHOLD', '500'))
+        )
+        self.scan_log.start_flusher(float(os.getenv('SCAN_FLUSH_INTERVAL', '60')))
+        
+        # Trigram index for search_patients; built on first search, kept up to date by add_patient
+        self.search_index = TrigramSearchIndex(csv_file_path)
+        self.scan_log.on_rewrite = self.search_index.note_rewrite
+        
+        # Appends share one write + fsync per batch of concurrent callers; holding the
+        # index lock across the write keeps a search from indexing the new rows twice
+        self.writer = GroupCommitWriter(
+            csv_file_path, self.file_lock, state_lock=self.search_index.lock,
+            before_commit=self._before_append,
+            after_commit=lambda start_offset, items, was_current: self.search_index.record_appended_range(start_offset, was_current)
+        )
+    
+    def _before_append(self):
+        # Runs under file_lock: settle a crashed scan counter flush while its journal hash still matches
+        self.scan_log.recover()
+        return self.search_index.is_current()
     
     def ensure_csv_exists(self):
         """Create CSV file with headers if it doesn't exist"""
-        if not os.path.exists(self.csv_file_path):
-            headers = [
-                'patient_id',
-                'first_name',
-                'last_name',
-                'date_of_birth',
-                'age',
-                'gender',
-                'email',
-                'phone',
-                'address',
-                'emergency_contact_name',
-                'emergency_contact_phone',
-                'medical_history',
-                'current_medications',
-                'allergies',
-                'previous_kidney_stones',
-                'registration_date',
-                'last_scan_date',
-                'total_scans'
-            ]
-            
-            with open(self.csv_file_path, 'w', newline='', encoding='utf-8') as file:
-                writer = csv.writer(file)
-                writer.writerow(headers)
+        create_if_missing(self.csv_file_path, lambda file: csv.writer(file).writerow(PATIENT_FIELDS))
     
     def generate_patient_id(self):
         """Generate unique patient ID"""
         return f"PT-{str(uuid.uuid4())[:8].upper()}"
     
+    def generate_patient_ids(self, count):
+        """Generate count unique patient IDs from a single random read"""
+        ids = set()
+        while len(ids) < count:
+            raw = os.urandom(4 * (count - len(ids))).hex().upper()
+            ids.update(f"PT-{raw[i:i + 8]}" for i in range(0, len(raw), 8))
+        return list(ids)
+    
+    def prepare_patient_record(self, patient_data):
+        """Fill in patient ID, registration date, age and any missing fields"""
+        # Generate patient ID if not provided
+        if 'patient_id' not in patient_data or not patient_data['patient_id']:
+            patient_data['patient_id'] = self.generate_patient_id()
+        
+        # Add registration date
+        patient_data['registration_date'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        patient_data['total_scans'] = 0
+        
+        # Calculate age from date of birth if provided
+        if 'date_of_birth' in patient_data and patient_data['date_of_birth']:
+            try:
+                dob = datetime.strptime(patient_data['date_of_birth'], '%Y-%m-%d')
+                age = datetime.now().year - dob.year
+                if datetime.now() < dob.replace(year=datetime.now().year):
+                    age -= 1
+                patient_data['age'] = age
+            except:
+                pass
+        
+        # Ensure all required fields exist
+        for field in PATIENT_FIELDS:
+            if field not in patient_data:
+                patient_data[field] = ''
+        
+        return patient_data
+    
     def add_patient(self, patient_data):
         """Add new patient to CSV"""
         try:
-            # Generate patient ID if not provided
-            if 'patient_id' not in patient_data or not patient_data['patient_id']:
-                patient_data['patient_id'] = self.generate_patient_id()
-            
-            # Add registration date
-            patient_data['registration_date'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            patient_data['total_scans'] = 0
-            
-            # Calculate age from date of birth if provided
-            if 'date_of_birth' in patient_data and patient_data['date_of_birth']:
-                try:
-                    dob = datetime.strptime(patient_data['date_of_birth'], '%Y-%m-%d')
-                    age = datetime.now().year - dob.year
-                    if datetime.now() < dob.replace(year=datetime.now().year):
-                        age -= 1
-                    patient_data['age'] = age
-                except:
-                    pass
-            
-            # Ensure all required fields exist
-            required_fields = [
-                'patient_id', 'first_name', 'last_name', 'date_of_birth', 'age', 
-                'gender', 'email', 'phone', 'address', 'emergency_contact_name',
-                'emergency_contact_phone', 'medical_history', 'current_medications',
-                'allergies', 'previous_kidney_stones', 'registration_date', 
-                'last_scan_date', 'total_scans'
-            ]
-            
-            for field in required_fields:
-                if field not in patient_data:
-                    patient_data[field] = ''
+            patient_data = self.prepare_patient_record(patient_data)
             
             # Write to CSV
-            with open(self.csv_file_path, 'a', newline='', encoding='utf-8') as file:
-                writer = csv.DictWriter(file, fieldnames=required_fields)
-                writer.writerow(patient_data)
+            line = io.StringIO()
+            csv.DictWriter(line, fieldnames=PATIENT_FIELDS).writerow(patient_data)
+            self.writer.append(line.getvalue())
             
             return patient_data['patient_id']
             
@@ -87,6 +161,91 @@ class PatientDataManager:
             print(f"Error adding patient: {str(e)}")
             return None
     
+    def prepare_patient_frame(self, frame):
+        """
+        Vectorized prepare_patient_record + validate_patient_data for bulk imports.
+        
+        Returns:
+            (frame with exactly PATIENT_FIELDS as string columns,
+             {row position: [error messages]} for rows that failed validation)
+        """
+        frame = frame.reset_index(drop=True).fillna('').astype(str)
+        for field in PATIENT_FIELDS:
+            if field not in frame:
+                frame[field] = ''
+        frame = frame[PATIENT_FIELDS].copy()
+        
+        checks = [
+            (frame[field].str.strip() == '', f"{field.replace('_', ' ').title()} is required")
+            for field in ['first_name', 'last_name', 'email']
+        ]
+        checks.append(((frame['email'] != '') & ~frame['email'].str.contains('@', regex=False),
+                       "Please enter a valid email address"))
+        phone_digits = frame['phone'].str.replace(r'[-\s()]', '', regex=True)
+        checks.append(((frame['phone'] != '') & (phone_digits.str.len() < 10),
+                       "Please enter a valid phone number"))
+        # Supplied IDs must be new; the first of several equal IDs in the file wins
+        supplied = frame['patient_id'].str.strip()
+        given = supplied != ''
+        checks.append((given & supplied.duplicated(keep='first'), "Patient ID duplicated in file"))
+        checks.append((given & supplied.isin(self.existing_patient_ids(set(supplied[given]))),
+                       "Patient ID already exists"))
+        errors = {}
+        for mask, message in checks:
+            for position in np.flatnonzero(mask.to_numpy()):
+                errors.setdefault(int(position), []).append(message)
+        
+        now = datetime.now()
+        missing_ids = frame['patient_id'].str.strip() == ''
+        frame.loc[missing_ids, 'patient_id'] = self.generate_patient_ids(int(missing_ids.sum()))
+        frame['registration_date'] = now.strftime('%Y-%m-%d %H:%M:%S')
+        frame['total_scans'] = '0'
+        
+        dob = pd.to_datetime(frame['date_of_birth'], format='%Y-%m-%d', errors='coerce')
+        before_birthday = (dob.dt.month > now.month) | ((dob.dt.month == now.month) & (dob.dt.day > now.day))
+        age = (now.year - dob.dt.year - before_birthday.astype(int)).astype('Int64').astype(str)
+        frame['age'] = frame['age'].where(dob.isna(), age)
+        
+        return frame, errors
+    
+    def import_patients(self, frame, atomic=False):
+        """
+        Validate and add many patients at once.
+        
+        Valid rows are written in a single append; with atomic=True nothing is
+        written if any row fails. Row numbers in the report start at 1.
+        
+        Returns:
+            {'imported', 'patient_ids', 'errors': [{'row', 'errors'}]}, or None on failure
+        """
+        try:
+            frame, errors = self.prepare_patient_frame(frame)
+            valid = frame.drop(index=list(errors))
+            if atomic and errors:
+                valid = valid.iloc[0:0]
+            imported = self.append_patient_frame(valid) if not valid.empty else 0
+            
+            return {
+                'imported': imported,
+                'patient_ids': valid['patient_id'].tolist(),
+                'errors': [{'row': position + 1, 'errors': messages} for position, messages in sorted(errors.items())]
+            }
+            
+        except Exception as e:
+            print(f"Error importing patients: {str(e)}")
+            return None
+    
+    def append_patient_frame(self, frame):
+        """Append prepared rows to the CSV in one write; returns the number of rows written"""
+        self.writer.append(frame.to_csv(header=False, index=False, lineterminator='\r\n'))
+        return len(frame)
+    
+    def existing_patient_ids(self, patient_ids):
+        """The subset of patient_ids already registered"""
+        if not patient_ids:
+            return set()
+        return {row['patient_id'] for _, row in self.iter_patients(fields=['patient_id']) if row['patient_id'] in patient_ids}
+    
     def get_patient_by_id(self, patient_id):
         """Retrieve patient data by ID"""
         try:
@@ -94,7 +253,8 @@ class PatientDataManager:
                 reader = csv.DictReader(file)
                 for row in reader:
                     if row['patient_id'] == patient_id:
-                        return row
+                        self.scan_log.refresh()
+                        return self.scan_log.overlay(row)
             return None
         except Exception as e:
             print(f"Error retrieving patient: {str(e)}")
@@ -107,7 +267,8 @@ class PatientDataManager:
                 reader = csv.DictReader(file)
                 for row in reader:
                     if row['email'].lower() == email.lower():
-                        return row
+                        self.scan_log.refresh()
+                        return self.scan_log.overlay(row)
             return None
         except Exception as e:
             print(f"Error retrieving patient by email: {str(e)}")
@@ -116,62 +277,88 @@ class PatientDataManager:
     def update_patient_scan_info(self, patient_id):
         """Update patient's last scan date and increment scan count"""
         try:
-            # Read all data
-            patients = []
-            with open(self.csv_file_path, 'r', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                patients = list(reader)
-            
-            # Update the specific patient
-            for patient in patients:
-                if patient['patient_id'] == patient_id:
-                    patient['last_scan_date'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    patient['total_scans'] = str(int(patient.get('total_scans', 0)) + 1)
-                    break
-            
-            # Write back to CSV
-            if patients:
-                with open(self.csv_file_path, 'w', newline='', encoding='utf-8') as file:
-                    fieldnames = patients[0].keys()
-                    writer = csv.DictWriter(file, fieldnames=fieldnames)
-                    writer.writeheader()
-                    writer.writerows(patients)
-                
-                return True
-            
+            self.scan_log.record_scan(patient_id, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            return True
         except Exception as e:
             print(f"Error updating patient scan info: {str(e)}")
             return False
     
-    def search_patients(self, search_term):
-        """Search patients by name, email, or patient ID"""
+    def search_patients(self, search_term, limit=None, offset=0):
+        """
+        Search patients by name, email, or patient ID.
+        
+        Results are ranked (exact field match, then prefix, then substring)
+        and can be paged with limit/offset.
+        """
         try:
-            results = []
-            with open(self.csv_file_path, 'r', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    if (search_term.lower() in row['first_name'].lower() or
-                        search_term.lower() in row['last_name'].lower() or
-                        search_term.lower() in row['email'].lower() or
-                        search_term.lower() in row['patient_id'].lower()):
-                        results.append(row)
-            return results
+            _, results = self.search_index.search(search_term, limit=limit, offset=offset)
+            self.scan_log.refresh()
+            return [self.scan_log.overlay(row) for row in results]
         except Exception as e:
             print(f"Error searching patients: {str(e)}")
             return []
     
     def get_all_patients(self):
-        """Get all patients (for admin purposes)"""
+        """Get all patients (for admin purposes); prefer iter_patients for large registries"""
         try:
-            patients = []
-            with open(self.csv_file_path, 'r', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                patients = list(reader)
-            return patients
+            return [row for _, row in self.iter_patients()]
         except Exception as e:
             print(f"Error retrieving all patients: {str(e)}")
             return []
     
+    def iter_patients(self, fields=None, cursor=None, **filters):
+        """
+        Stream patients in registration order without loading the file.
+        
+        Yields (cursor, row) pairs; passing a yielded cursor back resumes right
+        after that row. fields projects columns, filters are those of
+        matches_filters. Raises ValueError for unknown fields or a bad cursor.
+        """
+        fields = check_fields(fields)
+        position = decode_cursor(cursor, 'offset', 'patient_id') if cursor else None
+        self.scan_log.refresh()
+        with open(self.csv_file_path, 'rb') as file:
+            records = iter_csv_records(file)
+            header = next(records, (0, []))[1]
+            if position is not None:
+                records = self._resume(file, header, position)
+            for offset, values in records:
+                row = self.scan_log.overlay(dict(zip(header, values)))
+                if matches_filters(row, **filters):
+                    yield (encode_cursor({'offset': offset, 'patient_id': row.get('patient_id')}),
+                           {field: row.get(field, '') for field in fields})
+    
+    def _resume(self, file, header, position):
+        """Continue after the cursor row; if a rewrite moved it, find it by patient ID"""
+        records = iter_csv_records(file)
+        file.seek(position['offset'])
+        offset, values = next(records, (None, []))
+        if dict(zip(header, values)).get('patient_id') != position['patient_id']:
+            file.seek(0)
+            next(records, None)
+            for offset, values in records:
+                if dict(zip(header, values)).get('patient_id') == position['patient_id']:
+                    break
+            else:
+                raise ValueError("Cursor no longer matches a patient")
+        return records
+    
+    def list_patients(self, limit=100, cursor=None, fields=None, **filters):
+        """
+        One page of patients with keyset pagination.
+        
+        Returns:
+            (rows, next_cursor) where next_cursor is None on the last page
+        """
+        rows = []
+        next_cursor = None
+        for row_cursor, row in self.iter_patients(fields=fields, cursor=cursor, **filters):
+            if len(rows) == limit:
+                return rows, next_cursor
+            rows.append(row)
+            next_cursor = row_cursor
+        return rows, None
+    
     def validate_patient_data(self, data):
         """Validate patient data before saving"""
         errors = []
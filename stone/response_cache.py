@@ -0,0 +1,60 @@
+import hashlib
+import json
+import os
+import re
+from ttl_store import TTLStore
+
+
+def normalize_question(question):
+    """Lowercase, strip punctuation and collapse whitespace so trivially different questions share a key"""
+    question = re.sub(r"[^\w\s]", " ", (question or "").lower())
+    return " ".join(question.split())
+
+
+def bucket_context(context, size_step_mm=1.0, max_count=10):
+    """
+    Reduce a create_context() summary to a canonical, coarse form.
+
+    Stone sizes are rounded to size_step_mm and counts above max_count are
+    capped, so scans that would get the same advice map to the same bucket.
+    """
+    def bucket_size(value):
+        return round(round(float(value) / size_step_mm) * size_step_mm, 2)
+
+    return {
+        "count": min(context["stone_count"], max_count),
+        "largest": bucket_size(context["size_analysis"]["largest_stone"]),
+        "average": bucket_size(context["size_analysis"]["average_size"]),
+        "left": min(context["distribution"]["left_kidney"], max_count),
+        "right": min(context["distribution"]["right_kidney"], max_count),
+    }
+
+
+def make_cache_key(namespace, question, context):
+    """Build a stable key from the normalized question and bucketed stone context"""
+    payload = json.dumps(
+        [namespace, normalize_question(question), bucket_context(context)],
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache(TTLStore):
+    """
+    Two-tier cache for LLM responses: an in-process LRU with TTL in front of an
+    optional SQLite table that survives restarts and is shared between workers.
+    """
+
+    name = "response cache"
+
+    def __init__(self, max_entries=1000, ttl_seconds=24 * 3600, db_path=None):
+        super().__init__("llm_cache", max_entries, ttl_seconds, db_path)
+
+
+def cache_from_env():
+    """Create the response cache configured through LLM_CACHE_* environment variables"""
+    return ResponseCache(
+        max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000")),
+        ttl_seconds=int(os.getenv("LLM_CACHE_TTL", str(24 * 3600))),
+        db_path=os.getenv("LLM_CACHE_DB") or None
+    )
@@ -0,0 +1,197 @@
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """
+    Advisory cross-process lock backed by a separate lock file.
+
+    Uses flock() where available (shared or exclusive) and falls back to an
+    exclusive msvcrt byte lock on Windows. A thread lock is held as well so
+    threads of the same process serialize on it too.
+    """
+
+    def __init__(self, lock_path):
+        self.lock_path = lock_path
+        self._thread_lock = threading.RLock()
+
+    @contextmanager
+    def acquire(self, shared=False):
+        with self._thread_lock:
+            fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                else:
+                    while True:
+                        try:
+                            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                            break
+                        except OSError:
+                            time.sleep(0.05)
+                yield
+            finally:
+                try:
+                    if fcntl is not None:
+                        fcntl.flock(fd, fcntl.LOCK_UN)
+                    else:
+                        os.lseek(fd, 0, os.SEEK_SET)
+                        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+                finally:
+                    os.close(fd)
+
+
+def atomic_write(path, write_fn, encoding='utf-8', binary=False):
+    """
+    Replace path atomically: write_fn(file) fills a temp file in the same
+    directory, which is fsynced and renamed over path. Readers see either the
+    old or the new contents, never a partial file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix='.tmp', dir=directory)
+    try:
+        with (os.fdopen(fd, 'wb') if binary else os.fdopen(fd, 'w', newline='', encoding=encoding)) as file:
+            write_fn(file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    if fcntl is not None:
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def file_signature(path):
+    """(inode, mtime, size) of path, or None if it does not exist; changes on any write or replace"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def create_if_missing(path, write_fn, encoding='utf-8'):
+    """
+    Create path with contents from write_fn(file) unless it already exists.
+
+    The file is written under a temp name and hard-linked into place, so when
+    several processes start at once exactly one wins and nobody truncates a
+    file another process has already written to.
+    """
+    if os.path.exists(path):
+        return False
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', newline='', encoding=encoding) as file:
+            write_fn(file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.link(temp_path, path)
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(temp_path)
+
+
+class _PendingAppend:
+    __slots__ = ('text', 'item', 'done', 'error')
+
+    def __init__(self, text, item):
+        self.text = text
+        self.item = item
+        self.done = False
+        self.error = None
+
+
+class GroupCommitWriter:
+    """
+    Durable appends to one file, shared by all writers of that file.
+
+    Concurrent append() calls queue their text. The first caller to find no
+    write in progress becomes the leader: it takes state_lock (if any) and
+    the cross-process FileLock, writes every queued entry with one write and
+    one fsync, and wakes the others. Under load many requests share a single
+    fsync instead of paying for one each.
+
+    before_commit() runs under the locks before the write and its result is
+    passed to after_commit(start_offset, items, state) once the data is
+    durable, so callers can keep in-memory indexes in step.
+    """
+
+    def __init__(self, path, file_lock, state_lock=None, before_commit=None, after_commit=None):
+        self.path = path
+        self.file_lock = file_lock
+        self.state_lock = state_lock or threading.RLock()
+        self.before_commit = before_commit
+        self.after_commit = after_commit
+        self.commits = 0
+        self.appends = 0
+        self._cond = threading.Condition()
+        self._queue = []
+        self._writing = False
+
+    def append(self, text, item=None):
+        """Append text and return once it is fsynced; item is handed to after_commit"""
+        entry = _PendingAppend(text, item)
+        with self._cond:
+            self._queue.append(entry)
+            while self._writing and not entry.done:
+                self._cond.wait()
+            if not entry.done:
+                batch, self._queue = self._queue, []
+                self._writing = True
+
+        if not entry.done:
+            error = None
+            try:
+                self._commit(batch)
+            except BaseException as e:
+                error = e
+            with self._cond:
+                for pending in batch:
+                    pending.error = error
+                    pending.done = True
+                self._writing = False
+                self.commits += 1
+                self.appends += len(batch)
+                self._cond.notify_all()
+
+        if entry.error is not None:
+            raise entry.error
+
+    def _commit(self, batch):
+        with self.state_lock, self.file_lock.acquire():
+            state = self.before_commit() if self.before_commit else None
+            with open(self.path, 'a', newline='', encoding='utf-8') as file:
+                start_offset = os.fstat(file.fileno()).st_size
+                file.write(''.join(pending.text for pending in batch))
+                file.flush()
+                os.fsync(file.fileno())
+            if self.after_commit:
+                self.after_commit(start_offset, [pending.item for pending in batch], state)
+
+    def get_stats(self):
+        with self._cond:
+            return {
+                'commits': self.commits,
+                'appends': self.appends,
+                'appends_per_commit': round(self.appends / self.commits, 2) if self.commits else 0.0
+            }
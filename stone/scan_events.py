@@ -0,0 +1,196 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import threading
+from safe_io import GroupCommitWriter, atomic_write, file_signature
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ScanCounterLog:
+    """
+    Per-patient scan counters backed by an append-only, fsynced event log.
+
+    record_scan() appends one line to <patients csv>.scans.log and bumps an
+    in-memory counter, so the patient file is not rewritten per scan. Reads
+    overlay the pending counters on the stored rows. flush() folds them
+    into the patient CSV in one atomic rewrite and starts a new log.
+
+    A flush first writes a journal holding the hash of the new patient file.
+    If the process dies between the rename and the log reset, recover()
+    checks the hash and drops the already-applied events instead of
+    counting them twice. It runs on start-up, before every locked log
+    operation and, through PatientDataManager, before every append to the
+    patient file (an append would change the hash).
+    """
+
+    def __init__(self, csv_file_path, file_lock, flush_threshold=500):
+        self.csv_file_path = csv_file_path
+        self.log_path = csv_file_path + '.scans.log'
+        self.journal_path = csv_file_path + '.scans.flush'
+        self.file_lock = file_lock
+        self.flush_threshold = flush_threshold
+        self.pending = {}
+        self.pending_events = 0
+        # Called with the patient file's previous signature after a flush rewrites it
+        self.on_rewrite = None
+        self._log_identity = None
+        self._log_offset = 0
+        self._lock = threading.RLock()
+        self._flusher = None
+        self._stop = threading.Event()
+        self.log_writer = GroupCommitWriter(
+            self.log_path, file_lock, state_lock=self._lock,
+            before_commit=self._refresh_locked,
+            after_commit=lambda *_: self._refresh_locked()
+        )
+        with self._lock, file_lock.acquire():
+            self._refresh_locked()
+
+    def _log_stat(self):
+        try:
+            stat = os.stat(self.log_path)
+        except FileNotFoundError:
+            return None, 0
+        return stat.st_ino, stat.st_size
+
+    def refresh(self):
+        """Pick up scans recorded and flushes made by other processes"""
+        with self._lock:
+            identity, size = self._log_stat()
+            if identity == self._log_identity and size == self._log_offset and not os.path.exists(self.journal_path):
+                return
+            with self.file_lock.acquire():
+                self._refresh_locked()
+
+    def _refresh_locked(self):
+        if self.recover():
+            self._forget_log()
+        identity, size = self._log_stat()
+        if identity != self._log_identity or size < self._log_offset:
+            self.pending = {}
+            self.pending_events = 0
+            self._log_identity = identity
+            self._log_offset = 0
+        if identity is None:
+            return
+
+        with open(self.log_path, 'rb') as file:
+            file.seek(self._log_offset)
+            data = file.read()
+        end = data.rfind(b'\n') + 1
+        for values in csv.reader(io.StringIO(data[:end].decode('utf-8'), newline='')):
+            if len(values) != 2:
+                continue
+            patient_id, scan_date = values
+            entry = self.pending.setdefault(patient_id, [0, ''])
+            entry[0] += 1
+            entry[1] = max(entry[1], scan_date)
+            self.pending_events += 1
+        self._log_offset += end
+
+    def recover(self):
+        """
+        Settle a flush interrupted by a crash. Call with file_lock held and
+        before anything else changes the patient file.
+
+        Returns:
+            True if the log was reset because its events were already applied
+        """
+        if not os.path.exists(self.journal_path):
+            return False
+        with open(self.journal_path, 'r', encoding='utf-8') as file:
+            journal = json.load(file)
+        applied = os.path.exists(self.csv_file_path) and _file_sha256(self.csv_file_path) == journal['sha256']
+        if applied:
+            # The new patient file is in place; its events must not be applied again
+            atomic_write(self.log_path, lambda file: None)
+        os.remove(self.journal_path)
+        return applied
+
+    def _reset_log(self):
+        atomic_write(self.log_path, lambda file: None)
+        self._forget_log()
+
+    def _forget_log(self):
+        self.pending = {}
+        self.pending_events = 0
+        self._log_identity, self._log_offset = self._log_stat()
+
+    def record_scan(self, patient_id, scan_date):
+        """Durably record one scan for a patient"""
+        line = io.StringIO()
+        csv.writer(line).writerow([patient_id, scan_date])
+        self.log_writer.append(line.getvalue())
+        with self._lock:
+            needs_flush = self.flush_threshold and self.pending_events >= self.flush_threshold
+        if needs_flush:
+            self.flush()
+
+    def overlay(self, row):
+        """Return row with pending scans added to total_scans and last_scan_date"""
+        if row is None:
+            return None
+        entry = self.pending.get(row.get('patient_id'))
+        if not entry:
+            return row
+        row = dict(row)
+        row['total_scans'] = str(int(row.get('total_scans') or 0) + entry[0])
+        row['last_scan_date'] = max(row.get('last_scan_date') or '', entry[1])
+        return row
+
+    def flush(self):
+        """Fold pending counters into the patient CSV with a single atomic rewrite"""
+        with self._lock:
+            with self.file_lock.acquire():
+                self._refresh_locked()
+                if not self.pending_events:
+                    return False
+
+                with open(self.csv_file_path, 'r', newline='', encoding='utf-8') as file:
+                    reader = csv.DictReader(file)
+                    fieldnames = reader.fieldnames
+                    patients = [self.overlay(row) for row in reader]
+
+                new_contents = io.StringIO()
+                writer = csv.DictWriter(new_contents, fieldnames=fieldnames)
+                writer.writeheader()
+                writer.writerows(patients)
+                data = new_contents.getvalue()
+
+                journal = {'sha256': hashlib.sha256(data.encode('utf-8')).hexdigest()}
+                previous_signature = file_signature(self.csv_file_path)
+                atomic_write(self.journal_path, lambda file: json.dump(journal, file))
+                atomic_write(self.csv_file_path, lambda file: file.write(data))
+                self._reset_log()
+                os.remove(self.journal_path)
+            # Outside file_lock: appends take the search index's lock before it
+            if self.on_rewrite:
+                self.on_rewrite(previous_signature)
+            return True
+
+    def start_flusher(self, interval_seconds):
+        """Flush pending counters every interval_seconds on a daemon thread"""
+        if self._flusher is not None or not interval_seconds:
+            return
+
+        def run():
+            while not self._stop.wait(interval_seconds):
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"Error flushing scan counters: {e}")
+
+        self._flusher = threading.Thread(target=run, name='scan-counter-flusher', daemon=True)
+        self._flusher.start()
+
+    def stop_flusher(self):
+        self._stop.set()
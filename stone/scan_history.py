@@ -0,0 +1,311 @@
+import os
+import threading
+import time
+from array import array
+from datetime import datetime
+import numpy as np
+from safe_io import FileLock
+
+# One append-only file per column. Scan rows point into the stone columns
+# through scan_stone_end (cumulative stone count), which is written last and
+# so marks a scan as committed.
+SCAN_COLUMNS = {'scan_patient': 'I', 'scan_time': 'd', 'scan_stone_end': 'I'}
+STONE_COLUMNS = {'stone_diameter_mm': 'f', 'stone_confidence': 'f', 'stone_position': 'H'}
+DICTIONARIES = ('patients', 'positions')
+
+
+class ScanHistoryStore:
+    """
+    Columnar, array-backed history of every analysed scan.
+
+    Per scan: patient, time and the range of its stones; per stone: diameter,
+    confidence and position. Patient IDs and positions are dictionary
+    encoded. Files are only ever appended to (under a cross-process lock),
+    and a torn tail left by a crash is trimmed before the next write.
+    Trend queries touch only the rows of one patient.
+    """
+
+    def __init__(self, directory='scan_history'):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.file_lock = FileLock(os.path.join(directory, '.lock'))
+        self._lock = threading.RLock()
+        self.columns = {name: array(code) for name, code in {**SCAN_COLUMNS, **STONE_COLUMNS}.items()}
+        self.values = {name: [] for name in DICTIONARIES}
+        self.codes = {name: {} for name in DICTIONARIES}
+        self._dictionary_bytes = {name: 0 for name in DICTIONARIES}
+        # patient code -> scan rows in time order
+        self.scans_by_patient = {}
+
+    def _column_path(self, name):
+        return os.path.join(self.directory, f"{name}.bin")
+
+    def _dictionary_path(self, name):
+        return os.path.join(self.directory, f"{name}.txt")
+
+    @staticmethod
+    def _size(path):
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+
+    def _committed_scans(self):
+        return min(self._size(self._column_path(name)) // self.columns[name].itemsize for name in SCAN_COLUMNS)
+
+    def refresh(self):
+        """Pick up scans recorded by other processes"""
+        with self._lock:
+            marker = self.columns['scan_stone_end']
+            if self._size(self._column_path('scan_stone_end')) == len(marker) * marker.itemsize:
+                return
+            with self.file_lock.acquire(shared=True):
+                self._load_tail()
+
+    def _load_tail(self):
+        for name in DICTIONARIES:
+            path = self._dictionary_path(name)
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as file:
+                lines = file.read().split('\n')[:-1]  # the last piece is '' or a torn line
+            for value in lines[len(self.values[name]):]:
+                self._add_value(name, value)
+
+        first_new = len(self.columns['scan_stone_end'])
+        scans = self._committed_scans()
+        if scans <= first_new:
+            return
+        for name in SCAN_COLUMNS:
+            self._read_column(name, scans)
+        stones = self.columns['scan_stone_end'][-1]
+        for name in STONE_COLUMNS:
+            self._read_column(name, stones)
+
+        patients, times = self.columns['scan_patient'], self.columns['scan_time']
+        for row in range(first_new, scans):
+            rows = self.scans_by_patient.setdefault(patients[row], [])
+            rows.append(row)
+            if len(rows) > 1 and times[rows[-2]] > times[row]:
+                rows.sort(key=times.__getitem__)
+
+    def _read_column(self, name, count):
+        column = self.columns[name]
+        missing = count - len(column)
+        if missing <= 0:
+            return
+        with open(self._column_path(name), 'rb') as file:
+            file.seek(len(column) * column.itemsize)
+            column.frombytes(file.read(missing * column.itemsize))
+
+    def _trim_torn_tails(self):
+        """Drop bytes past the last committed scan (a writer died mid-append)"""
+        for name, column in self.columns.items():
+            path = self._column_path(name)
+            if self._size(path) > len(column) * column.itemsize:
+                os.truncate(path, len(column) * column.itemsize)
+        for name in DICTIONARIES:
+            path = self._dictionary_path(name)
+            if self._size(path) > self._dictionary_bytes[name]:
+                os.truncate(path, self._dictionary_bytes[name])
+
+    def _add_value(self, dictionary, value):
+        code = self.codes[dictionary][value] = len(self.values[dictionary])
+        self.values[dictionary].append(value)
+        self._dictionary_bytes[dictionary] += len(value.encode('utf-8')) + 1
+        return code
+
+    def _encode(self, dictionary, value):
+        value = str(value).replace('\n', ' ')
+        code = self.codes[dictionary].get(value)
+        if code is None:
+            with open(self._dictionary_path(dictionary), 'a', encoding='utf-8', newline='') as file:
+                file.write(value + '\n')
+            code = self._add_value(dictionary, value)
+        return code
+
+    def _append(self, name, values):
+        data = array(self.columns[name].typecode, values)
+        with open(self._column_path(name), 'ab') as file:
+            file.write(data.tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+
+    def record_scan(self, patient_id, stones, scanned_at=None):
+        """
+        Persist one analysis.
+
+        Args:
+            stones: detections as returned by /predict (diameter_mm, confidence, position)
+            scanned_at: epoch seconds, defaults to now
+        """
+        try:
+            with self._lock, self.file_lock.acquire():
+                self._load_tail()
+                self._trim_torn_tails()
+                patient = self._encode('patients', patient_id)
+                positions = [self._encode('positions', stone.get('position', '')) for stone in stones]
+                ends = self.columns['scan_stone_end']
+                stone_end = (ends[-1] if ends else 0) + len(stones)
+
+                self._append('stone_diameter_mm', [float(stone.get('diameter_mm', 0)) for stone in stones])
+                self._append('stone_confidence', [float(stone.get('confidence', 0)) for stone in stones])
+                self._append('stone_position', positions)
+                self._append('scan_patient', [patient])
+                self._append('scan_time', [scanned_at if scanned_at is not None else time.time()])
+                self._append('scan_stone_end', [stone_end])
+                self._load_tail()
+            return True
+        except Exception as e:
+            print(f"Error recording scan history: {e}")
+            return False
+
+    def _take(self, name, dtype, rows):
+        """Copy the given rows out of a column (the temporary view must not outlive the lock)"""
+        column = self.columns[name]
+        if not len(column):
+            return np.empty(0, dtype=dtype)
+        return np.frombuffer(column, dtype=dtype)[rows]
+
+    def _patient_scans(self, patient_id, since=None, until=None):
+        """Per-scan aggregates for one patient, as NumPy arrays in time order"""
+        self.refresh()
+        with self._lock:
+            code = self.codes['patients'].get(patient_id)
+            rows = np.array(self.scans_by_patient.get(code, []), dtype=np.int64)
+            times = self._take('scan_time', np.float64, rows)
+            keep = np.ones(len(rows), dtype=bool)
+            if since is not None:
+                keep &= times >= since
+            if until is not None:
+                keep &= times <= until
+            rows, times = rows[keep], times[keep]
+
+            ends = self._take('scan_stone_end', np.uint32, rows).astype(np.int64)
+            starts = np.where(rows > 0, self._take('scan_stone_end', np.uint32, np.maximum(rows - 1, 0)), 0).astype(np.int64)
+            counts = ends - starts
+
+            # Gather every stone of these scans in one go, labelled with its scan
+            offsets = np.cumsum(counts) - counts
+            stone_rows = np.arange(counts.sum()) + np.repeat(starts - offsets, counts)
+            scan_of_stone = np.repeat(np.arange(len(rows)), counts)
+            diameters = self._take('stone_diameter_mm', np.float32, stone_rows).astype(np.float64)
+            confidences = self._take('stone_confidence', np.float32, stone_rows).astype(np.float64)
+            positions = self._take('stone_position', np.uint16, stone_rows)
+            position_names = list(self.values['positions'])
+
+        burden = np.bincount(scan_of_stone, weights=diameters, minlength=len(rows))
+        largest = np.zeros(len(rows))
+        np.maximum.at(largest, scan_of_stone, diameters)
+        confidence_sum = np.bincount(scan_of_stone, weights=confidences, minlength=len(rows))
+        mean_confidence = np.divide(confidence_sum, counts, out=np.zeros(len(rows)), where=counts > 0)
+        return {
+            'times': times, 'counts': counts, 'burden': burden, 'largest': largest,
+            'mean_confidence': mean_confidence, 'scan_of_stone': scan_of_stone,
+            'diameters': diameters, 'confidences': confidences,
+            'positions': [position_names[code] for code in positions]
+        }
+
+    def get_history(self, patient_id, since=None, until=None, include_stones=False):
+        """A patient's scans, oldest first; since/until are epoch seconds"""
+        try:
+            scans = self._patient_scans(patient_id, since, until)
+            history = []
+            for i, scanned_at in enumerate(scans['times']):
+                entry = {
+                    'scanned_at': datetime.fromtimestamp(scanned_at).isoformat(),
+                    'stone_count': int(scans['counts'][i]),
+                    'total_burden_mm': round(float(scans['burden'][i]), 2),
+                    'largest_stone_mm': round(float(scans['largest'][i]), 2),
+                    'average_confidence': round(float(scans['mean_confidence'][i]), 3)
+                }
+                history.append(entry)
+            if include_stones:
+                for entry in history:
+                    entry['stones'] = []
+                for scan, diameter, confidence, position in zip(scans['scan_of_stone'], scans['diameters'],
+                                                               scans['confidences'], scans['positions']):
+                    history[scan]['stones'].append({
+                        'diameter_mm': round(float(diameter), 2),
+                        'confidence': round(float(confidence), 3),
+                        'position': position
+                    })
+            return history
+        except Exception as e:
+            print(f"Error reading scan history: {e}")
+            return []
+
+    def get_trend(self, patient_id, since=None, until=None):
+        """
+        Stone-burden series for a patient plus the change between the last two scans.
+
+        Returns None if the patient has no recorded scans.
+        """
+        try:
+            scans = self._patient_scans(patient_id, since, until)
+            if not len(scans['times']):
+                return None
+            trend = {
+                'patient_id': patient_id,
+                'scan_count': len(scans['times']),
+                'scanned_at': [datetime.fromtimestamp(t).isoformat() for t in scans['times']],
+                'stone_count': scans['counts'].tolist(),
+                'total_burden_mm': np.round(scans['burden'], 2).tolist(),
+                'largest_stone_mm': np.round(scans['largest'], 2).tolist(),
+                'change_since_last_scan': None
+            }
+            if len(scans['times']) > 1:
+                burden_change = float(scans['burden'][-1] - scans['burden'][-2])
+                trend['change_since_last_scan'] = {
+                    'days_between': round(float(scans['times'][-1] - scans['times'][-2]) / 86400, 1),
+                    'stone_count': int(scans['counts'][-1] - scans['counts'][-2]),
+                    'total_burden_mm': round(burden_change, 2),
+                    'largest_stone_mm': round(float(scans['largest'][-1] - scans['largest'][-2]), 2),
+                    'direction': 'increased' if burden_change > 0 else 'decreased' if burden_change < 0 else 'unchanged'
+                }
+            return trend
+        except Exception as e:
+            print(f"Error computing scan trend: {e}")
+            return None
+
+    def read_since(self, first_scan, until_scan=None):
+        """
+        Copies of the committed scans from row first_scan on (up to until_scan), for aggregation.
+
+        Returns:
+            dict with per-scan 'stone_counts' and per-stone 'diameters',
+            'confidences' and 'positions' (names), plus 'next_scan' to resume from
+        """
+        self.refresh()
+        with self._lock:
+            scans = len(self.columns['scan_stone_end'])
+            if until_scan is not None:
+                scans = min(scans, until_scan)
+            rows = np.arange(first_scan, scans)
+            ends = self._take('scan_stone_end', np.uint32, rows).astype(np.int64)
+            first_stone = int(self.columns['scan_stone_end'][first_scan - 1]) if first_scan > 0 and scans else 0
+            stone_rows = np.arange(first_stone, int(ends[-1]) if len(ends) else first_stone)
+            positions = self._take('stone_position', np.uint16, stone_rows)
+            position_names = np.array(self.values['positions'] or [''], dtype=object)
+            return {
+                'next_scan': scans,
+                'stone_counts': np.diff(ends, prepend=first_stone),
+                'diameters': self._take('stone_diameter_mm', np.float32, stone_rows).astype(np.float64),
+                'confidences': self._take('stone_confidence', np.float32, stone_rows).astype(np.float64),
+                'positions': position_names[positions]
+            }
+
+    def get_stats(self):
+        self.refresh()
+        with self._lock:
+            return {
+                'scans': len(self.columns['scan_stone_end']),
+                'stones': len(self.columns['stone_diameter_mm']),
+                'patients': len(self.scans_by_patient),
+                'bytes_on_disk': sum(self._size(self._column_path(name)) for name in self.columns)
+                                 + sum(self._size(self._dictionary_path(name)) for name in DICTIONARIES)
+            }
+
+
+def scan_history_from_env():
+    return ScanHistoryStore(os.getenv('SCAN_HISTORY_DIR', 'scan_history'))
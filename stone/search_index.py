@@ -0,0 +1,189 @@
+import csv
+import heapq
+from bisect import bisect_left
+import threading
+from array import array
+from safe_io import file_signature
+
+SEARCH_FIELDS = ('first_name', 'last_name', 'email', 'patient_id')
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _contains(posting, doc_id):
+    i = bisect_left(posting, doc_id)
+    return i < len(posting) and posting[i] == doc_id
+
+
+def iter_csv_records(file):
+    """
+    Yield (offset, values) for each CSV record in a binary file positioned at a
+    record boundary. Quoted fields may span lines; a record is complete once
+    its quote count is even.
+    """
+    while True:
+        offset = file.tell()
+        raw = file.readline()
+        if not raw:
+            return
+        while raw.count(b'"') % 2:
+            more = file.readline()
+            if not more:
+                break
+            raw += more
+        text = raw.decode('utf-8')
+        if not text.strip():
+            continue
+        yield offset, next(csv.reader([text]))
+
+
+class TrigramSearchIndex:
+    """
+    Inverted trigram index over the searchable patient fields.
+
+    Holds, per row, the byte offset of the record and its lowercased search
+    fields; full rows are read from the CSV only for the page being returned.
+    Appends are indexed incrementally; any other change to the file triggers
+    a lazy rebuild on the next search.
+    """
+
+    def __init__(self, csv_file_path, fields=SEARCH_FIELDS):
+        self.csv_file_path = csv_file_path
+        self.fields = fields
+        self.lock = threading.RLock()
+        self._signature = None
+        self._reset()
+
+    def _reset(self):
+        self.header = []
+        self.offsets = array('Q')
+        self.keys = []
+        self.postings = {}
+
+    def is_current(self):
+        return self._signature is not None and self._signature == file_signature(self.csv_file_path)
+
+    def refresh(self):
+        """Rebuild the index if the file changed since it was built"""
+        with self.lock:
+            if not self.is_current():
+                self._build()
+
+    def _build(self):
+        self._reset()
+        signature = file_signature(self.csv_file_path)
+        if signature is not None:
+            with open(self.csv_file_path, 'rb') as file:
+                records = iter_csv_records(file)
+                header = next(records, None)
+                if header is not None:
+                    self.header = header[1]
+                    for offset, values in records:
+                        self._add(offset, values)
+        self._signature = signature
+
+    def _add(self, offset, values):
+        doc_id = len(self.offsets)
+        row = dict(zip(self.header, values))
+        parts = [(row.get(field) or '').lower() for field in self.fields]
+        self.offsets.append(offset)
+        self.keys.append('\x00'.join(parts))
+        for trigram in set().union(*(_trigrams(part) for part in parts)):
+            posting = self.postings.get(trigram)
+            if posting is None:
+                posting = self.postings[trigram] = array('I')
+            posting.append(doc_id)
+
+    def record_appended_range(self, start_offset, was_current):
+        """Index every record appended from start_offset on; rebuild later if the index was stale"""
+        with self.lock:
+            if not was_current or not self.header:
+                self._signature = None
+                return
+            with open(self.csv_file_path, 'rb') as file:
+                file.seek(start_offset)
+                for offset, values in iter_csv_records(file):
+                    self._add(offset, values)
+            self._signature = file_signature(self.csv_file_path)
+
+    def note_rewrite(self, previous_signature):
+        """
+        The file was rewritten with the same rows in the same order (e.g. scan
+        counters folded in): only byte offsets moved, so re-read those.
+        """
+        with self.lock:
+            if self._signature != previous_signature:
+                self._signature = None
+                return
+            offsets = array('Q')
+            with open(self.csv_file_path, 'rb') as file:
+                records = iter_csv_records(file)
+                next(records, None)
+                for offset, _ in records:
+                    offsets.append(offset)
+            if len(offsets) != len(self.offsets):
+                self._signature = None
+                return
+            self.offsets = offsets
+            self._signature = file_signature(self.csv_file_path)
+
+    def _candidates(self, term):
+        if len(term) < 3:
+            return [doc_id for doc_id, key in enumerate(self.keys) if term in key]
+        postings = []
+        for trigram in _trigrams(term):
+            posting = self.postings.get(trigram)
+            if posting is None:
+                return []
+            postings.append(posting)
+        postings.sort(key=len)
+        # Walk the rarest posting list and binary-search the others (they are
+        # sorted by doc id); the substring check in search() makes the result exact
+        return [doc_id for doc_id in postings[0] if all(_contains(other, doc_id) for other in postings[1:])]
+
+    @staticmethod
+    def _score(key, term):
+        best = 0
+        for part in key.split('\x00'):
+            if part == term:
+                return 3
+            if part.startswith(term):
+                best = 2
+            elif term in part and best < 1:
+                best = 1
+        return best
+
+    def search(self, search_term, limit=None, offset=0):
+        """
+        Ranked substring search: exact field matches first, then prefix, then
+        substring matches; ties keep registration order.
+
+        Returns:
+            (total_matches, rows for the requested page)
+        """
+        term = (search_term or '').lower()
+        with self.lock:
+            self.refresh()
+            scored = []
+            for doc_id in self._candidates(term):
+                score = self._score(self.keys[doc_id], term)
+                if score:
+                    scored.append((-score, doc_id))
+
+            if limit is None:
+                page = sorted(scored)[offset:]
+            else:
+                page = heapq.nsmallest(offset + limit, scored)[offset:]
+            rows = self._read_rows([doc_id for _, doc_id in page])
+        return len(scored), rows
+
+    def _read_rows(self, doc_ids):
+        rows = []
+        with open(self.csv_file_path, 'rb') as file:
+            for doc_id in doc_ids:
+                file.seek(self.offsets[doc_id])
+                _, values = next(iter_csv_records(file))
+                rows.append(dict(zip(self.header, values)))
+        return rows
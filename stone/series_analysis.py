@@ -0,0 +1,181 @@
+import os
+import re
+import numpy as np
+from PIL import Image
+from stone_inference import box_iou, calculate_severity
+
+# Exported slices are named 1-3-46-670589-33-1-<acquired>-<uid>[_png_jpg...]: <acquired>
+# grows with acquisition time (consecutive slices differ in the low digits) and
+# <uid> is a per-slice hash, so stack order comes from <acquired>
+SLICE_NAME = re.compile(r'^(?:\d+-){6}(?P<acquired>\d+)-(?P<uid>\d+)')
+
+
+def parse_slice_name(filename):
+    """(acquired, uid) from an exported slice filename, or (None, None) if it does not follow the naming"""
+    match = SLICE_NAME.match(os.path.basename(filename))
+    if not match:
+        return None, None
+    return int(match.group('acquired')), match.group('uid')
+
+
+def order_slices(filenames):
+    """
+    Indices of filenames in stack order: by acquisition when every name
+    follows the export naming, otherwise in the order given
+    """
+    parsed = [parse_slice_name(name) for name in filenames]
+    if all(acquired is not None for acquired, _ in parsed):
+        return sorted(range(len(filenames)), key=lambda index: parsed[index][0])
+    return list(range(len(filenames)))
+
+
+class StoneTracker:
+    """
+    Links per-slice detections into 3D stones.
+
+    A detection joins the track whose last box overlaps it most (IoU at
+    least iou_threshold) among tracks seen within the last max_gap + 1
+    slices; otherwise it starts a new track. Tracks that can no longer be
+    extended are reduced to a summary, so memory depends on the stones
+    visible at once rather than on the number of slices.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_gap=1, min_slices=1):
+        self.iou_threshold = iou_threshold
+        self.max_gap = max_gap
+        self.min_slices = min_slices
+        self.active = []
+        self.finished = []
+        self.next_id = 1
+        self.raw_detections = 0
+
+    def add_slice(self, slice_index, detections):
+        """Feed one slice's detections (dicts with bbox, diameter_mm, confidence, position)"""
+        self.raw_detections += len(detections)
+        still_active = []
+        for track in self.active:
+            if slice_index - track['last_slice'] > self.max_gap + 1:
+                self._finish(track)
+            else:
+                still_active.append(track)
+        self.active = still_active
+        if not detections:
+            return
+
+        boxes = np.array([detection['bbox'] for detection in detections], dtype=np.float64)
+        assigned, matched_tracks = [None] * len(detections), set()
+        if self.active:
+            iou = box_iou(boxes, np.array([track['last_bbox'] for track in self.active]))
+            # Greedy one-to-one matching, best overlaps first
+            for flat in np.argsort(iou, axis=None)[::-1]:
+                row, column = np.unravel_index(flat, iou.shape)
+                if iou[row, column] < self.iou_threshold:
+                    break
+                if assigned[row] is None and column not in matched_tracks:
+                    assigned[row] = column
+                    matched_tracks.add(column)
+
+        for row, detection in enumerate(detections):
+            if assigned[row] is None:
+                track = {'id': self.next_id, 'first_slice': slice_index, 'slices': 0, 'confidence_sum': 0.0,
+                         'max_diameter_mm': -1.0}
+                self.next_id += 1
+                self.active.append(track)
+            else:
+                track = self.active[assigned[row]]
+            self._extend(track, slice_index, detection)
+
+    @staticmethod
+    def _extend(track, slice_index, detection):
+        track['last_slice'] = slice_index
+        track['last_bbox'] = detection['bbox']
+        track['slices'] += 1
+        track['confidence_sum'] += detection['confidence']
+        if detection['diameter_mm'] > track['max_diameter_mm']:
+            track.update(max_diameter_mm=detection['diameter_mm'], max_slice=slice_index,
+                         bbox=detection['bbox'], position=detection.get('position'),
+                         type=detection.get('type', 'kidney_stone'))
+
+    def _finish(self, track):
+        if track['slices'] >= self.min_slices:
+            self.finished.append({
+                'id': track['id'],
+                'first_slice': track['first_slice'],
+                'last_slice': track['last_slice'],
+                'slices': track['slices'],
+                'max_diameter_mm': round(track['max_diameter_mm'], 2),
+                'max_diameter_slice': track['max_slice'],
+                'bbox': track['bbox'],
+                'position': track['position'],
+                'type': track['type'],
+                'confidence': round(track['confidence_sum'] / track['slices'], 4)
+            })
+
+    def close(self):
+        """Finish every remaining track; returns all stones ordered by first slice"""
+        for track in self.active:
+            self._finish(track)
+        self.active = []
+        self.finished.sort(key=lambda stone: (stone['first_slice'], stone['id']))
+        return self.finished
+
+
+def load_slice(source):
+    """Decode one slice (path or binary stream) to RGB"""
+    with Image.open(source) as image:
+        return image.convert("RGB")
+
+
+def analyze_series(sources, analyze_fn, batch_size=16, iou_threshold=0.3, max_gap=1, min_slices=1):
+    """
+    Analyse an ordered stack of slices as one series.
+
+    Slices are decoded batch_size at a time and dropped once analysed, so
+    memory stays bounded however many slices the series has.
+
+    Args:
+        sources: ordered iterable of paths or binary streams
+        analyze_fn: takes a list of RGB images and returns one analysis per
+            image, like stone_inference.analyze_images
+
+    Returns:
+        dict with one deduplicated entry per stone track and a summary whose
+        severity uses the track count and the sum of per-track maximum diameters
+    """
+    tracker = StoneTracker(iou_threshold=iou_threshold, max_gap=max_gap, min_slices=min_slices)
+    slice_count, batch = 0, []
+    dimensions = None
+
+    def flush(first_index):
+        nonlocal dimensions
+        analyses = analyze_fn(batch)
+        for offset, analysis in enumerate(analyses):
+            tracker.add_slice(first_index + offset, analysis['detections'])
+            dimensions = dimensions or analysis.get('image_dimensions')
+        batch.clear()
+
+    for source in sources:
+        batch.append(load_slice(source))
+        slice_count += 1
+        if len(batch) >= batch_size:
+            flush(slice_count - len(batch))
+    if batch:
+        flush(slice_count - len(batch))
+
+    stones = tracker.close()
+    total_burden = sum(stone['max_diameter_mm'] for stone in stones)
+    severity = calculate_severity(len(stones), total_burden)
+    return {
+        'stones': stones,
+        'summary': {
+            'slices': slice_count,
+            'total_stones': len(stones),
+            'raw_detections': tracker.raw_detections,
+            'largest_stone_mm': max((stone['max_diameter_mm'] for stone in stones), default=0),
+            'total_burden_mm': round(total_burden, 2),
+            'average_confidence': round(sum(stone['confidence'] for stone in stones) / max(len(stones), 1), 3),
+            'risk_level': severity['level'].lower(),
+            'severity': severity
+        },
+        'image_dimensions': dimensions
+    }
@@ -0,0 +1,127 @@
+import os
+import secrets
+import threading
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+from ttl_store import TTLStore
+
+# Browsers drop cookies larger than this, which is where cookie sessions break
+COOKIE_SIZE_LIMIT = 4093
+
+
+class SessionStore(TTLStore):
+    """
+    Serialized session payloads keyed by session ID. Without db_path every
+    worker keeps its own sessions in memory; with it they live only in the
+    shared SQLite table, since a per-worker copy would outlive an update or
+    logout made through another worker.
+    """
+
+    name = "session store"
+
+    def __init__(self, max_entries=10000, ttl_seconds=24 * 3600, db_path=None):
+        super().__init__("sessions", max_entries, ttl_seconds, db_path, memory_tier=False)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session dict that remembers its ID and whether it was changed"""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(session):
+            session.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class ServerSessionInterface(SessionInterface):
+    """
+    Keeps session data in a SessionStore; the cookie carries only a random ID.
+    With SESSION_REFRESH_EACH_REQUEST on (Flask's default) every request
+    restarts the stored session's TTL, not only requests that change it.
+
+    Records the bytes each request spends on sessions (cookie header in,
+    Set-Cookie out, payload stored) and how often a payload would have
+    exceeded the browser cookie limit under Flask's cookie sessions.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self.metrics = {
+            "requests": 0, "cookie_bytes_in": 0, "cookie_bytes_out": 0,
+            "payload_bytes": 0, "largest_payload_bytes": 0, "cookie_overflow_events": 0
+        }
+
+    def open_session(self, app, request):
+        cookie = request.headers.get("Cookie", "")
+        with self._lock:
+            self.metrics["requests"] += 1
+            self.metrics["cookie_bytes_in"] += len(cookie)
+
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.store.get(sid)
+            if data is not None:
+                try:
+                    return ServerSession(self.serializer.loads(data), sid=sid)
+                except Exception as e:
+                    print(f"Error loading session: {e}")
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.modified:
+            data = self.serializer.dumps(dict(session))
+            self.store.set(session.sid, data)
+            with self._lock:
+                self.metrics["payload_bytes"] += len(data)
+                self.metrics["largest_payload_bytes"] = max(self.metrics["largest_payload_bytes"], len(data))
+                if len(data) > COOKIE_SIZE_LIMIT:
+                    self.metrics["cookie_overflow_events"] += 1
+        elif not session.new and app.config["SESSION_REFRESH_EACH_REQUEST"]:
+            self.store.touch(session.sid)
+
+        if not self.should_set_cookie(app, session):
+            return
+        response.set_cookie(
+            name, session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain, path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+        with self._lock:
+            self.metrics["cookie_bytes_out"] += len(response.headers.getlist("Set-Cookie")[-1])
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+        requests = stats["requests"] or 1
+        stats["avg_cookie_bytes_per_request"] = round((stats["cookie_bytes_in"] + stats["cookie_bytes_out"]) / requests, 1)
+        stats["store"] = self.store.get_stats()
+        return stats
+
+
+def session_interface_from_env():
+    """Create the server-side session interface configured through SESSION_* environment variables"""
+    return ServerSessionInterface(SessionStore(
+        max_entries=int(os.getenv("SESSION_MAX_ENTRIES", "10000")),
+        ttl_seconds=int(os.getenv("SESSION_TTL", str(24 * 3600))),
+        db_path=os.getenv("SESSION_DB") or None
+    ))
@@ -1,6 +1,13 @@
 import csv
+import io
 import os
 from datetime import datetime
+from change_log import ChangeLogTable
+from csv_index import CsvIndex
+from safe_io import FileLock, GroupCommitWriter, create_if_missing
+
+USER_FIELDS = ['user_id', 'first_name', 'last_name', 'email', 'phone', 'date_of_birth', 'registration_date']
+DOCTOR_FIELDS = ['user_id', 'doctor_phone', 'doctor_email', 'updated_date']
 
 class SimpleUserDataManager:
     def __init__(self, csv_file_path='user_data.csv', doctor_csv_path='doctor_contacts.csv'):
@@ -8,88 +15,66 @@ class SimpleUserDataManager:
         self.doctor_csv_path = doctor_csv_path
         self.ensure_csv_exists()
         self.ensure_doctor_csv_exists()
+        
+        # Hash indexes for O(1) lookups, reloaded when the files change on disk
+        self.user_index = CsvIndex(self.csv_file_path, ['user_id', 'email'])
+        
+        # User rows are appended under a cross-process lock, with concurrent saves sharing one fsync
+        self.user_writer = GroupCommitWriter(
+            self.csv_file_path, FileLock(self.csv_file_path + '.lock'),
+            state_lock=self.user_index.lock,
+            before_commit=self.user_index.is_current,
+            after_commit=self._index_saved_users
+        )
+        
+        # Doctor contacts are upserted through an append-only log that is compacted
+        # into doctor_contacts.csv in the background after DOCTOR_LOG_COMPACT_THRESHOLD
+        # changes (or DOCTOR_LOG_COMPACT_RATIO of the contacts, if more) or every
+        # DOCTOR_LOG_COMPACT_INTERVAL seconds
+        self.doctor_contacts = ChangeLogTable(
+            self.doctor_csv_path, DOCTOR_FIELDS, 'user_id',
+            compact_threshold=int(os.getenv('DOCTOR_LOG_COMPACT_THRESHOLD', '1000')),
+            compact_ratio=float(os.getenv('DOCTOR_LOG_COMPACT_RATIO', '0.1'))
+        )
+        self.doctor_contacts.start_compactor(float(os.getenv('DOCTOR_LOG_COMPACT_INTERVAL', '300')))
     
     def ensure_csv_exists(self):
         """Create CSV file with headers if it doesn't exist"""
-        if not os.path.exists(self.csv_file_path):
-            with open(self.csv_file_path, 'w', newline='', encoding='utf-8') as file:
-                writer = csv.writer(file)
-                writer.writerow([
-                    'user_id', 'first_name', 'last_name', 'email', 'phone', 
-                    'date_of_birth', 'registration_date'
-                ])
+        create_if_missing(self.csv_file_path, lambda file: csv.writer(file).writerow(USER_FIELDS))
     
     def ensure_doctor_csv_exists(self):
         """Create doctor contacts CSV file with headers if it doesn't exist"""
-        if not os.path.exists(self.doctor_csv_path):
-            with open(self.doctor_csv_path, 'w', newline='', encoding='utf-8') as file:
-                writer = csv.writer(file)
-                writer.writerow([
-                    'user_id', 'doctor_phone', 'doctor_email', 'updated_date'
-                ])
+        create_if_missing(self.doctor_csv_path, lambda file: csv.writer(file).writerow(DOCTOR_FIELDS))
     
     def save_user_data(self, user_data):
         """Save user data to CSV file"""
         try:
-            with open(self.csv_file_path, 'a', newline='', encoding='utf-8') as file:
-                writer = csv.writer(file)
-                writer.writerow([
-                    user_data.get('user_id', ''),
-                    user_data.get('first_name', ''),
-                    user_data.get('last_name', ''),
-                    user_data.get('email', ''),
-                    user_data.get('phone', ''),
-                    user_data.get('date_of_birth', ''),
-                    user_data.get('registration_date', datetime.now().strftime('%Y-%m-%d'))
-                ])
+            row = {field: user_data.get(field, '') for field in USER_FIELDS}
+            row['registration_date'] = user_data.get('registration_date', datetime.now().strftime('%Y-%m-%d'))
+            row = {field: '' if value is None else str(value) for field, value in row.items()}
+            
+            line = io.StringIO()
+            csv.writer(line).writerow([row[field] for field in USER_FIELDS])
+            self.user_writer.append(line.getvalue(), row)
             return True
         except Exception as e:
             print(f"Error saving user data: {e}")
             return False
     
+    def _index_saved_users(self, start_offset, rows, was_current):
+        for row in rows:
+            self.user_index.record_append(row, was_current)
+    
     def save_doctor_contact(self, doctor_data):
         """Save or update doctor contact information"""
         try:
-            # First, check if user already has doctor contact saved
-            existing_contacts = []
-            user_id = doctor_data.get('user_id', '')
-            found_existing = False
-            
-            # Read existing contacts
-            if os.path.exists(self.doctor_csv_path):
-                with open(self.doctor_csv_path, 'r', encoding='utf-8') as file:
-                    reader = csv.DictReader(file)
-                    for row in reader:
-                        if row['user_id'] == user_id:
-                            # Update existing entry
-                            row['doctor_phone'] = doctor_data.get('doctor_phone', '')
-                            row['doctor_email'] = doctor_data.get('doctor_email', '')
-                            row['updated_date'] = doctor_data.get('updated_date', datetime.now().strftime('%Y-%m-%d'))
-                            found_existing = True
-                        existing_contacts.append(row)
-            
-            # Write back all contacts
-            with open(self.doctor_csv_path, 'w', newline='', encoding='utf-8') as file:
-                writer = csv.writer(file)
-                writer.writerow(['user_id', 'doctor_phone', 'doctor_email', 'updated_date'])
-                
-                for contact in existing_contacts:
-                    writer.writerow([
-                        contact['user_id'],
-                        contact['doctor_phone'],
-                        contact['doctor_email'],
-                        contact['updated_date']
-                    ])
-                
-                # If no existing contact found, add new one
-                if not found_existing:
-                    writer.writerow([
-                        doctor_data.get('user_id', ''),
-                        doctor_data.get('doctor_phone', ''),
-                        doctor_data.get('doctor_email', ''),
-                        doctor_data.get('updated_date', datetime.now().strftime('%Y-%m-%d'))
-                    ])
-            
+            # Appends to the change log; the latest entry per user wins on read
+            self.doctor_contacts.upsert({
+                'user_id': doctor_data.get('user_id', ''),
+                'doctor_phone': doctor_data.get('doctor_phone', ''),
+                'doctor_email': doctor_data.get('doctor_email', ''),
+                'updated_date': doctor_data.get('updated_date', datetime.now().strftime('%Y-%m-%d'))
+            })
             return True
         except Exception as e:
             print(f"Error saving doctor contact: {e}")
@@ -98,12 +83,7 @@ class SimpleUserDataManager:
     def get_user_by_email(self, email):
         """Get user data by email"""
         try:
-            with open(self.csv_file_path, 'r', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    if row['email'] == email:
-                        return row
-            return None
+            return self.user_index.lookup('email', email)
         except Exception as e:
             print(f"Error reading user data: {e}")
             return None
@@ -111,12 +91,7 @@ class SimpleUserDataManager:
     def get_user_by_id(self, user_id):
         """Get user data by user ID"""
         try:
-            with open(self.csv_file_path, 'r', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    if row['user_id'] == user_id:
-                        return row
-            return None
+            return self.user_index.lookup('user_id', user_id)
         except Exception as e:
             print(f"Error reading user data: {e}")
             return None
@@ -124,15 +99,7 @@ class SimpleUserDataManager:
     def get_doctor_contact(self, user_id):
         """Get doctor contact by user ID"""
         try:
-            if not os.path.exists(self.doctor_csv_path):
-                return None
-                
-            with open(self.doctor_csv_path, 'r', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    if row['user_id'] == user_id:
-                        return row
-            return None
+            return self.doctor_contacts.get(user_id)
         except Exception as e:
             print(f"Error reading doctor contact: {e}")
-            return None
\ No newline at end of file
+            return None
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""
+SQLite storage engine for users, doctor contacts and patients.
+
+SQLiteUserDataManager and SQLitePatientDataManager are drop-in replacements
+for SimpleUserDataManager and PatientDataManager with the same method
+signatures and return values. Run this module to migrate the existing CSVs:
+
+    python sqlite_storage.py --db stone_data.db
+"""
+
+import argparse
+import csv
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from change_log import ChangeLogTable
+from safe_io import FileLock
+from scan_events import ScanCounterLog
+from patient_data_manager import PatientDataManager, PATIENT_FIELDS, encode_cursor, decode_cursor, check_fields
+from simple_user_manager import USER_FIELDS, DOCTOR_FIELDS
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    {', '.join(f"{field} TEXT NOT NULL DEFAULT ''" for field in USER_FIELDS)}
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_user_id ON users (user_id);
+CREATE INDEX IF NOT EXISTS idx_users_email ON users (email);
+
+CREATE TABLE IF NOT EXISTS doctor_contacts (
+    user_id TEXT PRIMARY KEY,
+    doctor_phone TEXT NOT NULL DEFAULT '',
+    doctor_email TEXT NOT NULL DEFAULT '',
+    updated_date TEXT NOT NULL DEFAULT ''
+);
+
+CREATE TABLE IF NOT EXISTS patients (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    {', '.join(f"{field} TEXT NOT NULL DEFAULT ''" for field in PATIENT_FIELDS if field != 'total_scans')},
+    total_scans INTEGER NOT NULL DEFAULT 0
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_patients_patient_id ON patients (patient_id);
+CREATE INDEX IF NOT EXISTS idx_patients_email ON patients (email COLLATE NOCASE);
+"""
+
+# Key indexes made unique after the first release; (table, index, key column)
+UNIQUE_KEYS = [('users', 'idx_users_user_id', 'user_id'), ('patients', 'idx_patients_patient_id', 'patient_id')]
+
+
+def _ensure_unique_keys(conn):
+    """
+    Upgrade databases created with non-unique key indexes. Lookups always
+    returned the first row per key, so later duplicates were unreachable and
+    are dropped before the index is rebuilt as UNIQUE.
+    """
+    for table, index, column in UNIQUE_KEYS:
+        unique = {row[1]: row[2] for row in conn.execute(f"PRAGMA index_list({table})")}
+        if unique.get(index, 1):
+            continue
+        conn.execute(f"DELETE FROM {table} WHERE id NOT IN (SELECT MIN(id) FROM {table} GROUP BY {column})")
+        conn.execute(f"DROP INDEX {index}")
+        conn.execute(f"CREATE UNIQUE INDEX {index} ON {table} ({column})")
+
+
+class SQLiteDatabase:
+    """
+    One connection per thread to a WAL-mode database.
+
+    sqlite3 keeps a per-connection cache of prepared statements, so reusing
+    the same parameterized SQL strings avoids re-parsing on every call.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self.connection() as conn:
+            _ensure_unique_keys(conn)
+            conn.executescript(SCHEMA)
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, cached_statements=256)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+
+def _row_to_dict(row, fields):
+    """Return a row as a dict of strings, like csv.DictReader would"""
+    if row is None:
+        return None
+    return {field: '' if row[field] is None else str(row[field]) for field in fields}
+
+
+def _text(value):
+    return '' if value is None else str(value)
+
+
+class SQLiteUserDataManager:
+    def __init__(self, db_path='stone_data.db'):
+        self.db_path = db_path
+        self.db = SQLiteDatabase(db_path)
+
+    def save_user_data(self, user_data):
+        """Save user data to the users table; saving an existing user_id updates it, keeping the registration date"""
+        try:
+            row = {field: _text(user_data.get(field, '')) for field in USER_FIELDS}
+            if not row['user_id'].strip():
+                print("Error saving user data: user_id is required")
+                return False
+            row['registration_date'] = _text(user_data.get('registration_date', datetime.now().strftime('%Y-%m-%d')))
+            updates = ', '.join(f"{field} = excluded.{field}" for field in USER_FIELDS
+                                if field not in ('user_id', 'registration_date'))
+            with self.db.connection() as conn:
+                cursor = conn.execute(
+                    f"INSERT INTO users ({', '.join(USER_FIELDS)}) VALUES ({', '.join('?' for _ in USER_FIELDS)}) "
+                    f"ON CONFLICT(user_id) DO UPDATE SET {updates}",
+                    [row[field] for field in USER_FIELDS]
+                )
+            return cursor.rowcount == 1
+        except Exception as e:
+            print(f"Error saving user data: {e}")
+            return False
+
+    def save_doctor_contact(self, doctor_data):
+        """Save or update doctor contact information"""
+        try:
+            with self.db.connection() as conn:
+                conn.execute(
+                    "INSERT INTO doctor_contacts (user_id, doctor_phone, doctor_email, updated_date) "
+                    "VALUES (?, ?, ?, ?) ON CONFLICT(user_id) DO UPDATE SET "
+                    "doctor_phone = excluded.doctor_phone, doctor_email = excluded.doctor_email, "
+                    "updated_date = excluded.updated_date",
+                    (
+                        _text(doctor_data.get('user_id', '')),
+                        _text(doctor_data.get('doctor_phone', '')),
+                        _text(doctor_data.get('doctor_email', '')),
+                        _text(doctor_data.get('updated_date', datetime.now().strftime('%Y-%m-%d')))
+                    )
+                )
+            return True
+        except Exception as e:
+            print(f"Error saving doctor contact: {e}")
+            return False
+
+    def get_user_by_email(self, email):
+        """Get user data by email"""
+        try:
+            row = self.db.connection().execute(
+                "SELECT * FROM users WHERE email = ? ORDER BY id LIMIT 1", (email,)
+            ).fetchone()
+            return _row_to_dict(row, USER_FIELDS)
+        except Exception as e:
+            print(f"Error reading user data: {e}")
+            return None
+
+    def get_user_by_id(self, user_id):
+        """Get user data by user ID"""
+        try:
+            row = self.db.connection().execute(
+                "SELECT * FROM users WHERE user_id = ? ORDER BY id LIMIT 1", (user_id,)
+            ).fetchone()
+            return _row_to_dict(row, USER_FIELDS)
+        except Exception as e:
+            print(f"Error reading user data: {e}")
+            return None
+
+    def get_doctor_contact(self, user_id):
+        """Get doctor contact by user ID"""
+        try:
+            row = self.db.connection().execute(
+                "SELECT * FROM doctor_contacts WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            return _row_to_dict(row, DOCTOR_FIELDS)
+        except Exception as e:
+            print(f"Error reading doctor contact: {e}")
+            return None
+
+
+class SQLitePatientDataManager(PatientDataManager):
+    def __init__(self, db_path='stone_data.db'):
+        self.db_path = db_path
+        self.db = SQLiteDatabase(db_path)
+
+    def add_patient(self, patient_data):
+        """Add new patient to the patients table"""
+        try:
+            patient_data = self.prepare_patient_record(patient_data)
+            with self.db.connection() as conn:
+                conn.execute(
+                    f"INSERT OR IGNORE INTO patients ({', '.join(PATIENT_FIELDS)}) VALUES ({', '.join('?' for _ in PATIENT_FIELDS)})",
+                    [_text(patient_data[field]) if field != 'total_scans' else int(patient_data[field] or 0)
+                     for field in PATIENT_FIELDS]
+                )
+            return patient_data['patient_id']
+        except Exception as e:
+            print(f"Error adding patient: {str(e)}")
+            return None
+
+    def append_patient_frame(self, frame):
+        """Insert prepared rows in a single transaction; returns the number of rows inserted"""
+        frame = frame.assign(total_scans=frame['total_scans'].astype(int))
+        with self.db.connection() as conn:
+            return conn.executemany(
+                f"INSERT OR IGNORE INTO patients ({', '.join(PATIENT_FIELDS)}) VALUES ({', '.join('?' for _ in PATIENT_FIELDS)})",
+                frame[PATIENT_FIELDS].itertuples(index=False, name=None)
+            ).rowcount
+
+    def existing_patient_ids(self, patient_ids):
+        """The subset of patient_ids already registered"""
+        patient_ids = list(patient_ids)
+        found = set()
+        conn = self.db.connection()
+        for start in range(0, len(patient_ids), 500):
+            chunk = patient_ids[start:start + 500]
+            found.update(row[0] for row in conn.execute(
+                f"SELECT patient_id FROM patients WHERE patient_id IN ({', '.join('?' for _ in chunk)})", chunk
+            ))
+        return found
+
+    def get_patient_by_id(self, patient_id):
+        """Retrieve patient data by ID"""
+        try:
+            row = self.db.connection().execute(
+                "SELECT * FROM patients WHERE patient_id = ? ORDER BY id LIMIT 1", (patient_id,)
+            ).fetchone()
+            return _row_to_dict(row, PATIENT_FIELDS)
+        except Exception as e:
+            print(f"Error retrieving patient: {str(e)}")
+            return None
+
+    def get_patient_by_email(self, email):
+        """Retrieve patient data by email"""
+        try:
+            row = self.db.connection().execute(
+                "SELECT * FROM patients WHERE email = ? COLLATE NOCASE ORDER BY id LIMIT 1", (email,)
+            ).fetchone()
+            return _row_to_dict(row, PATIENT_FIELDS)
+        except Exception as e:
+            print(f"Error retrieving patient by email: {str(e)}")
+            return None
+
+    def update_patient_scan_info(self, patient_id):
+        """Update patient's last scan date and increment scan count"""
+        try:
+            with self.db.connection() as conn:
+                cursor = conn.execute(
+                    "UPDATE patients SET last_scan_date = ?, total_scans = total_scans + 1 "
+                    "WHERE id = (SELECT id FROM patients WHERE patient_id = ? ORDER BY id LIMIT 1)",
+                    (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), patient_id)
+                )
+            return cursor.rowcount > 0
+        except Exception as e:
+            print(f"Error updating patient scan info: {str(e)}")
+            return False
+
+    def search_patients(self, search_term, limit=None, offset=0):
+        """Search patients by name, email, or patient ID, ranked like the CSV search index"""
+        try:
+            term = search_term.lower()
+            escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            pattern = f"%{escaped}%"
+            prefix = f"{escaped}%"
+            rows = self.db.connection().execute(
+                "SELECT * FROM patients WHERE lower(first_name) LIKE :pattern ESCAPE '\\' "
+                "OR lower(last_name) LIKE :pattern ESCAPE '\\' OR lower(email) LIKE :pattern ESCAPE '\\' "
+                "OR lower(patient_id) LIKE :pattern ESCAPE '\\' "
+                "ORDER BY CASE "
+                "WHEN :term IN (lower(first_name), lower(last_name), lower(email), lower(patient_id)) THEN 0 "
+                "WHEN lower(first_name) LIKE :prefix ESCAPE '\\' OR lower(last_name) LIKE :prefix ESCAPE '\\' "
+                "OR lower(email) LIKE :prefix ESCAPE '\\' OR lower(patient_id) LIKE :prefix ESCAPE '\\' THEN 1 "
+                "ELSE 2 END, id LIMIT :limit OFFSET :offset",
+                {'pattern': pattern, 'prefix': prefix, 'term': term,
+                 'limit': -1 if limit is None else limit, 'offset': offset}
+            ).fetchall()
+            return [_row_to_dict(row, PATIENT_FIELDS) for row in rows]
+        except Exception as e:
+            print(f"Error searching patients: {str(e)}")
+            return []
+
+    def get_all_patients(self):
+        """Get all patients (for admin purposes)"""
+        try:
+            rows = self.db.connection().execute("SELECT * FROM patients ORDER BY id").fetchall()
+            return [_row_to_dict(row, PATIENT_FIELDS) for row in rows]
+        except Exception as e:
+            print(f"Error retrieving all patients: {str(e)}")
+            return []
+
+    def iter_patients(self, fields=None, cursor=None, registered_from=None, registered_to=None,
+                      previous_kidney_stones=None, batch_size=500):
+        """Stream patients by keyset pagination on the row id, batch_size rows per query"""
+        fields = check_fields(fields)
+        last_id = decode_cursor(cursor, 'id')['id'] if cursor else 0
+        conditions, params = ["id > ?"], []
+        if registered_from:
+            conditions.append("substr(registration_date, 1, 10) >= ?")
+            params.append(registered_from)
+        if registered_to:
+            conditions.append("substr(registration_date, 1, 10) <= ?")
+            params.append(registered_to)
+        if previous_kidney_stones is not None:
+            conditions.append("previous_kidney_stones = ? COLLATE NOCASE")
+            params.append(previous_kidney_stones)
+        query = (f"SELECT id, {', '.join(fields)} FROM patients WHERE {' AND '.join(conditions)} "
+                 f"ORDER BY id LIMIT ?")
+        while True:
+            rows = self.db.connection().execute(query, [last_id, *params, batch_size]).fetchall()
+            for row in rows:
+                last_id = row['id']
+                yield encode_cursor({'id': last_id}), _row_to_dict(row, fields)
+            if len(rows) < batch_size:
+                return
+
+
+def _stream_csv(csv_path, fields, batch_size):
+    """Yield batches of value lists from a CSV without loading it whole"""
+    with open(csv_path, 'r', newline='', encoding='utf-8') as file:
+        batch = []
+        for row in csv.DictReader(file):
+            batch.append([row.get(field) or '' for field in fields])
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def migrate_csv_to_sqlite(db_path, user_csv='user_data.csv', doctor_csv='doctor_contacts.csv',
+                          patient_csv='patient_data.csv', batch_size=5000):
+    """
+    Stream the existing CSV files into a SQLite database in batches.
+
+    Returns:
+        Dict of table name -> rows migrated
+    """
+    db = SQLiteDatabase(db_path)
+    conn = db.connection()
+    migrated = {}
+    
+    # Fold pending doctor contact changes and unflushed scan counts into the CSVs first
+    if doctor_csv and os.path.exists(doctor_csv):
+        ChangeLogTable(doctor_csv, DOCTOR_FIELDS, 'user_id').compact()
+    if patient_csv and os.path.exists(patient_csv):
+        ScanCounterLog(patient_csv, FileLock(patient_csv + '.lock')).flush()
+
+    tables = [
+        # Keys are unique, so re-running or resuming a migration skips rows already copied
+        ('users', user_csv, USER_FIELDS, 'INSERT OR IGNORE INTO'),
+        ('doctor_contacts', doctor_csv, DOCTOR_FIELDS, 'INSERT OR REPLACE INTO'),
+        ('patients', patient_csv, PATIENT_FIELDS, 'INSERT OR IGNORE INTO')
+    ]
+    for table, csv_path, fields, verb in tables:
+        migrated[table] = 0
+        if not csv_path or not os.path.exists(csv_path):
+            continue
+        sql = f"{verb} {table} ({', '.join(fields)}) VALUES ({', '.join('?' for _ in fields)})"
+        with conn:
+            for batch in _stream_csv(csv_path, fields, batch_size):
+                if table == 'patients':
+                    total_scans = fields.index('total_scans')
+                    for values in batch:
+                        values[total_scans] = int(values[total_scans] or 0)
+                migrated[table] += conn.executemany(sql, batch).rowcount
+
+    return migrated
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Migrate CSV user, doctor and patient data into SQLite')
+    parser.add_argument('--db', default='stone_data.db')
+    parser.add_argument('--users', default='user_data.csv')
+    parser.add_argument('--doctors', default='doctor_contacts.csv')
+    parser.add_argument('--patients', default='patient_data.csv')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    counts = migrate_csv_to_sqlite(args.db, args.users, args.doctors, args.patients, args.batch_size)
+    for table, count in counts.items():
+        print(f"✅ {table}: {count} rows migrated")
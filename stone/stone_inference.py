@@ -0,0 +1,275 @@
+import math
+import os
+import threading
+import numpy as np
+from kidney_roi import crop_regions
+
+# Trained detector weights (MODEL_WEIGHTS overrides the local model file)
+MODEL_WEIGHTS = os.getenv('MODEL_WEIGHTS', 'C:\\Users\\dell\\Desktop\\stones\\stone\\runs\\detect\\train2\\weights\\best.pt')
+
+# Size the detector letterboxes whole images to (ultralytics' default imgsz)
+WHOLE_IMAGE_IMGSZ = 640
+# Inference sizes must be multiples of the detector's largest stride
+MODEL_STRIDE = 32
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_model():
+    """The YOLO stone detector, loaded once per process (the helpers below work without it)"""
+    global _model
+    with _model_lock:
+        if _model is None:
+            from ultralytics import YOLO
+            _model = YOLO(MODEL_WEIGHTS)
+        return _model
+
+
+def calculate_pixel_to_mm_scale(image_width, image_height):
+    """
+    Calculate a more accurate pixel-to-mm scale factor for medical imaging.
+    
+    For kidney stone imaging, typical scale factors are:
+    - CT scans: 0.1-0.3 mm/pixel (depending on slice thickness and FOV)
+    - Ultrasound: 0.05-0.2 mm/pixel (depending on depth and transducer)
+    - X-ray: 0.1-0.4 mm/pixel (depending on technique and magnification)
+    
+    This function provides a more reasonable estimate based on image dimensions.
+    """
+    # Assume typical kidney imaging field of view
+    # Standard abdominal CT FOV is about 35-50cm
+    # Standard kidney dimensions: 10-12cm length, 5-7cm width
+    
+    # If image is very large (>1000px), likely high-resolution scan
+    if max(image_width, image_height) > 1000:
+        return 0.15  # Fine resolution CT or high-res ultrasound
+    # If image is medium (500-1000px), standard resolution
+    elif max(image_width, image_height) > 500:
+        return 0.25  # Standard CT or ultrasound
+    # If image is small (<500px), lower resolution or cropped
+    else:
+        return 0.35  # Lower resolution or zoomed view
+
+
+def calculate_severity(stone_count, total_burden_mm):
+    """
+    Calculate severity based on historical thresholds:
+    Normal: ≤ 2 stones AND total burden < 5mm
+    Moderate: 2-4 stones OR total burden 5-10mm
+    Severe: > 4 stones OR total burden > 10mm
+    """
+    if stone_count <= 2 and total_burden_mm < 5:
+        return {
+            'level': 'Normal',
+            'color': 'green',
+            'description': 'Normal stone burden'
+        }
+    elif (stone_count <= 4 and total_burden_mm <= 10) or (stone_count <= 2 and total_burden_mm < 10):
+        return {
+            'level': 'Moderate',
+            'color': 'yellow',
+            'description': 'Moderate stone burden - regular monitoring recommended'
+        }
+    else:
+        return {
+            'level': 'Severe',
+            'color': 'red',
+            'description': 'Severe stone burden - immediate medical attention recommended'
+        }
+
+
+# Stone position function
+def get_stone_position(x_center, y_center, img_width, img_height):
+    x_third = img_width / 3
+    y_third = img_height / 3
+    if x_center < x_third: h_pos = "left"
+    elif x_center < 2*x_third: h_pos = "center"
+    else: h_pos = "right"
+    if y_center < y_third: v_pos = "top"
+    elif y_center < 2*y_third: v_pos = "middle"
+    else: v_pos = "bottom"
+    return f"{v_pos}-{h_pos}"
+
+
+def box_iou(boxes_a, boxes_b):
+    """Pairwise IoU of two (n, 4) and (m, 4) arrays of x1, y1, x2, y2 boxes, as an (n, m) array"""
+    boxes_a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(boxes_a[:, 2:] - boxes_a[:, :2], axis=1)
+    area_b = np.prod(boxes_b[:, 2:] - boxes_b[:, :2], axis=1)
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+def suppress_duplicates(boxes, confidences, iou_threshold=0.5):
+    """Indices to keep after dropping lower-confidence boxes that overlap a kept one (e.g. from overlapping crops)"""
+    order = np.argsort(confidences)[::-1]
+    iou = box_iou(boxes[order], boxes[order])
+    keep, suppressed = [], np.zeros(len(order), dtype=bool)
+    for rank, index in enumerate(order):
+        if not suppressed[rank]:
+            keep.append(index)
+            suppressed |= iou[rank] >= iou_threshold
+    return sorted(keep)
+
+
+def stones_from_boxes(boxes, confidences, class_names, img_width, img_height, pixel_to_mm):
+    """Detection dicts as returned by /predict from (n, 4) boxes in full-image pixel coordinates"""
+    stones_data = []
+    for i, ((x1, y1, x2, y2), conf, cls_name) in enumerate(zip(boxes, confidences, class_names), 1):
+        width = x2 - x1
+        height = y2 - y1
+        diameter = max(width, height)
+        diameter_mm = diameter * pixel_to_mm  # Use calculated scale factor
+        position = get_stone_position((x1 + x2) / 2, (y1 + y2) / 2, img_width, img_height)
+
+        stones_data.append({
+            "id": i,
+            "bbox": [float(x1), float(y1), float(x2), float(y2)],
+            "confidence": float(conf),
+            "diameter_px": float(diameter),
+            "diameter_mm": round(float(diameter_mm), 2),
+            "type": cls_name,
+            "position": position
+        })
+    return stones_data
+
+
+def result_boxes(result, offset=(0, 0)):
+    """(boxes, confidences, class names) of one YOLO result, shifted by a crop offset"""
+    boxes = result.boxes
+    if boxes is None or boxes.xyxy.shape[0] == 0:
+        return np.empty((0, 4)), np.empty(0), []
+    xyxy = boxes.xyxy.cpu().numpy().astype(np.float64) + np.array([offset[0], offset[1], offset[0], offset[1]])
+    # Get class names if available
+    if getattr(boxes, 'cls', None) is not None:
+        names = [result.names[int(cls_id)] for cls_id in boxes.cls.cpu().numpy()]
+    else:
+        names = ["kidney_stone"] * len(xyxy)
+    return xyxy, boxes.conf.cpu().numpy().astype(np.float64), names
+
+
+def extract_stones(result, img_width, img_height, pixel_to_mm):
+    """Turn one YOLO result into the detection dicts returned by /predict"""
+    boxes, confidences, names = result_boxes(result)
+    return stones_from_boxes(boxes, confidences, names, img_width, img_height, pixel_to_mm)
+
+
+def crop_imgsz(crop_size, image_size, imgsz=WHOLE_IMAGE_IMGSZ):
+    """
+    Smallest inference size, rounded up to the model stride, at which a crop
+    is scaled at least as much as its whole image is at imgsz, so stones are
+    never shrunk below the size the detector sees them at without cropping
+    """
+    return int(math.ceil(max(crop_size) * imgsz / max(image_size) / MODEL_STRIDE) * MODEL_STRIDE)
+
+
+def detect_boxes_roi(images, roi_regions, roi_imgsz=None, batch_size=16, model=None, full_imgsz=WHOLE_IMAGE_IMGSZ,
+                     **predict_args):
+    """
+    Two-stage detection: crop every image to the kidney regions (or any
+    normalized regions, e.g. tile_regions), run the detector on the crops,
+    and map boxes back to full-image coordinates (duplicates from
+    overlapping regions are dropped).
+
+    roi_imgsz fixes the crop inference size; by default each batch runs at
+    the largest crop_imgsz of its crops, keeping the scale whole images get
+    at full_imgsz.
+
+    Returns:
+        (boxes, confidences, class names) per image
+    """
+    model = model or get_model()
+    crops, owners, sizes = [], [], []
+    for index, image in enumerate(images):
+        for crop, offset in crop_regions(image, roi_regions):
+            crops.append(crop)
+            owners.append((index, offset))
+            sizes.append(roi_imgsz or crop_imgsz(crop.size, image.size, full_imgsz))
+
+    found = [[] for _ in images]
+    for start in range(0, len(crops), batch_size):
+        results = model.predict(source=crops[start:start + batch_size], imgsz=max(sizes[start:start + batch_size]),
+                                save=False, verbose=False, **predict_args)
+        for (index, offset), result in zip(owners[start:start + batch_size], results):
+            found[index].append(result_boxes(result, offset))
+
+    detections = []
+    for parts in found:
+        boxes = np.concatenate([part[0] for part in parts]) if parts else np.empty((0, 4))
+        confidences = np.concatenate([part[1] for part in parts]) if parts else np.empty(0)
+        names = [name for part in parts for name in part[2]]
+        keep = suppress_duplicates(boxes, confidences) if len(boxes) > 1 else list(range(len(boxes)))
+        detections.append((boxes[keep], confidences[keep], [names[i] for i in keep]))
+    return detections
+
+
+def tile_regions(rows=2, columns=2, overlap=0.2):
+    """Normalized regions tiling the image in a rows x columns grid, neighbours overlapping by overlap of a tile"""
+    height = 1 / (rows - (rows - 1) * overlap)
+    width = 1 / (columns - (columns - 1) * overlap)
+    return tuple(
+        (round(column * width * (1 - overlap), 4), round(row * height * (1 - overlap), 4),
+         round(min(column * width * (1 - overlap) + width, 1.0), 4), round(min(row * height * (1 - overlap) + height, 1.0), 4))
+        for row in range(rows) for column in range(columns)
+    )
+
+
+def detect_stones(image, roi_regions=None, roi_imgsz=None):
+    """Detection dicts for one RGB PIL image, optionally through the kidney ROI crops"""
+    w, h = image.width, image.height
+    pixel_to_mm = calculate_pixel_to_mm_scale(w, h)
+    if roi_regions:
+        boxes, confidences, names = detect_boxes_roi([image], roi_regions, roi_imgsz)[0]
+    else:
+        boxes, confidences, names = result_boxes(get_model().predict(source=image, save=False)[0])
+    return stones_from_boxes(boxes, confidences, names, w, h, pixel_to_mm)
+
+
+def summarize_stones(stones_data):
+    """Count, largest stone, mean confidence, total burden and severity for a set of detections"""
+    total_stones = len(stones_data)
+    total_burden = sum(stone["diameter_mm"] for stone in stones_data)
+    return {
+        "total_stones": total_stones,
+        "largest_stone_mm": max((stone["diameter_mm"] for stone in stones_data), default=0),
+        "average_confidence": sum(stone["confidence"] for stone in stones_data) / max(total_stones, 1),
+        "total_burden_mm": total_burden,
+        "severity": calculate_severity(total_stones, total_burden)
+    }
+
+
+def analyze_images(images, batch_size=16, roi_regions=None, roi_imgsz=None):
+    """
+    Detect stones on a list of RGB PIL images, batch_size images per model
+    call, with the same post-processing as /predict. With roi_regions the
+    detector only sees the kidney crops (see detect_boxes_roi).
+
+    Returns:
+        One dict per image: detections, summary, image_dimensions and scale_factor_mm_per_pixel
+    """
+    if roi_regions:
+        detected = detect_boxes_roi(images, roi_regions, roi_imgsz, batch_size)
+    else:
+        model = get_model()
+        detected = []
+        for start in range(0, len(images), batch_size):
+            results = model.predict(source=images[start:start + batch_size], save=False, verbose=False)
+            detected.extend(result_boxes(result) for result in results)
+
+    analyses = []
+    for image, (boxes, confidences, names) in zip(images, detected):
+        w, h = image.width, image.height
+        pixel_to_mm = calculate_pixel_to_mm_scale(w, h)
+        stones_data = stones_from_boxes(boxes, confidences, names, w, h, pixel_to_mm)
+        analyses.append({
+            "detections": stones_data,
+            "summary": summarize_stones(stones_data),
+            "image_dimensions": f"{w}x{h}",
+            "scale_factor_mm_per_pixel": pixel_to_mm
+        })
+    return analyses
@@ -0,0 +1,29 @@
+import os
+from patient_data_manager import PatientDataManager
+from simple_user_manager import SimpleUserDataManager
+
+# 'csv' (default) keeps the existing CSV files; 'sqlite' uses SQLITE_DB_PATH (see sqlite_storage.py)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'csv').lower()
+SQLITE_DB_PATH = os.getenv('SQLITE_DB_PATH', 'stone_data.db')
+
+
+def create_user_manager(backend=None):
+    """Create the user/doctor data manager for the configured storage backend"""
+    backend = (backend or STORAGE_BACKEND).lower()
+    if backend == 'sqlite':
+        from sqlite_storage import SQLiteUserDataManager
+        return SQLiteUserDataManager(SQLITE_DB_PATH)
+    if backend != 'csv':
+        raise ValueError(f"Unknown storage backend: {backend}")
+    return SimpleUserDataManager()
+
+
+def create_patient_manager(backend=None):
+    """Create the patient data manager for the configured storage backend"""
+    backend = (backend or STORAGE_BACKEND).lower()
+    if backend == 'sqlite':
+        from sqlite_storage import SQLitePatientDataManager
+        return SQLitePatientDataManager(SQLITE_DB_PATH)
+    if backend != 'csv':
+        raise ValueError(f"Unknown storage backend: {backend}")
+    return PatientDataManager()
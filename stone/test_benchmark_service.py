@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Test script for the service load tester: a stand-in app with the same
+routes is driven concurrently, every operation in the mix is counted with
+its errors and latency, and a slower run is flagged against the baseline
+"""
+
+import logging
+import os
+import threading
+import time
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+from benchmark_service import Workload, compare_to_baseline, run_load
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def start_stand_in(delay):
+    """Routes shaped like flask_app's, with a fixed delay on /predict; /chat fails without stones"""
+    app = Flask(__name__)
+    users = set()
+
+    @app.route('/predict', methods=['POST'])
+    def predict():
+        time.sleep(delay)
+        ok = 'image' in request.files and request.form.get('patient_id', '').startswith('BENCH')
+        return (jsonify({"detections": []}), 200) if ok else (jsonify({"error": "bad upload"}), 400)
+
+    @app.route('/generate-report', methods=['POST'])
+    def report():
+        data = request.get_json()
+        return (b'%PDF-1.4', 200) if data.get('detections') and data['annotated_image'].startswith('data:image') else ('', 400)
+
+    @app.route('/chat', methods=['POST'])
+    def chat():
+        data = request.get_json()
+        return (jsonify({'response': 'ok'}), 200) if data.get('stones_data') else (jsonify({'error': 'no stones'}), 500)
+
+    @app.route('/save-user-data', methods=['POST'])
+    def save_user():
+        users.add(request.get_json()['user_id'])
+        return jsonify({'success': True})
+
+    @app.route('/get-user-data/<user_id>')
+    def get_user(user_id):
+        return (jsonify({'user_id': user_id}), 200) if user_id in users else (jsonify({'error': 'not found'}), 404)
+
+    @app.route('/save-doctor-contact', methods=['POST'])
+    def doctor():
+        return jsonify({'success': True})
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def check_load_run():
+    """All operations are exercised concurrently; errors, RSS and regressions are reported"""
+    print("=== Testing Service Load Run ===")
+    workload = Workload(os.path.join(HERE, 'data', 'test', 'images'), os.path.join(HERE, 'data', 'test', 'labels'))
+    chat_errors_expected = sum(1 for scan in workload.scans if not scan['detections'])
+
+    runs = []
+    for delay in (0.002, 0.03):
+        server = start_stand_in(delay)
+        try:
+            runs.append(run_load(f"http://127.0.0.1:{server.server_port}", workload, concurrency=4, duration=30,
+                                 max_requests=300, warmup=0, pid=os.getpid()))
+        finally:
+            server.shutdown()
+    baseline, slower = runs
+    operations = baseline['operations']
+    print(f"   {baseline['overall']}, statuses {baseline['status_counts']}, rss {baseline['rss']}")
+
+    passed = True
+    if baseline['overall']['requests'] == 300 and all(summary['requests'] for summary in operations.values()):
+        print("✅ Every operation in the mix was sent, 300 requests in total")
+    else:
+        print("❌ Request counts wrong")
+        passed = False
+    # Only chat on label-free images and lookups before any save may fail
+    unexpected = {name: summary['errors'] for name, summary in operations.items()
+                  if summary['errors'] and name not in ('chat', 'get_user')}
+    if not unexpected and operations['predict']['p50_ms'] >= 2 and baseline['rss']['peak_mb'] > 0 and (
+            chat_errors_expected or not operations['chat']['errors']):
+        print("✅ Requests well-formed, latency and RSS recorded")
+    else:
+        print(f"❌ Unexpected errors {unexpected} or missing latency/RSS")
+        passed = False
+    regressions = compare_to_baseline(slower, baseline)
+    if any(regression.startswith('predict: p95') for regression in regressions) and not compare_to_baseline(baseline, baseline):
+        print(f"✅ Slower /predict flagged against the baseline: {regressions[0]}")
+    else:
+        print(f"❌ Regression check wrong: {regressions}")
+        passed = False
+    return passed
+
+def test_load_run():
+    assert check_load_run()
+
+def main():
+    print("🚀 Starting Service Benchmark Tests\n")
+    result = check_load_run()
+    print(f"\n{'🎉 All service benchmark tests passed' if result else '⚠️  Some service benchmark tests failed'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Test script for the content-addressed upload/report store: deduplication,
+reference counting, TTL and quota sweeps, and cleanup of legacy files
+"""
+
+import os
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from blob_store import BlobStore
+
+def check_dedupe_and_refcount():
+    """Identical uploads share one file, which goes only when its last reference does"""
+    print("=== Testing Deduplication and Reference Counts ===")
+    with tempfile.TemporaryDirectory() as root:
+        store = BlobStore(root)
+        scan = os.urandom(50000)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            stored = list(pool.map(lambda _: store.put(scan, 'upload', '.jpg'), range(8)))
+        other = store.put(os.urandom(1000), 'upload', '.jpg')
+
+        stats = store.get_stats()
+        paths = {item['path'] for item in stored}
+        print(f"   blobs {stats['blobs']}, stored {stats['stored_bytes']}B, referenced {stats['referenced_bytes']}B, ratio {stats['dedupe_ratio']}")
+        passed = True
+        if len(paths) == 1 and stats['blobs'] == 2 and stats['deduplicated'] == 7:
+            print("✅ Eight identical uploads stored once")
+        else:
+            print("❌ Identical uploads were stored more than once")
+            passed = False
+
+        for item in stored[:-1]:
+            store.release(item['ref'])
+        store.sweep()
+        still_there = os.path.exists(stored[-1]['path'])
+        store.release(stored[-1]['ref'])
+        store.sweep()
+        if still_there and not os.path.exists(stored[-1]['path']) and store.resolve(other['name']):
+            print("✅ Blob deleted only after its last reference was released")
+        else:
+            print("❌ Reference counting did not protect or free the blob")
+            passed = False
+        return passed
+
+def check_ttl_quota_and_legacy():
+    """Expired references, quota overruns and old loose files are swept"""
+    print("=== Testing TTL, Quota and Legacy Sweeps ===")
+    with tempfile.TemporaryDirectory() as root:
+        store = BlobStore(root, ttl_seconds={'annotated': 0.05}, quota_bytes=25000, legacy_ttl_seconds=60, grace_seconds=0)
+        annotated = store.put(os.urandom(1000), 'annotated', '.png')
+        uploads = [store.put(os.urandom(10000), 'upload', '.jpg') for _ in range(4)]
+
+        legacy_path = os.path.join(root, 'annotated_scan.jpg')
+        with open(legacy_path, 'wb') as file:
+            file.write(b'old')
+        os.utime(legacy_path, (time.time() - 3600, time.time() - 3600))
+
+        time.sleep(0.1)
+        result = store.sweep()
+        stats = store.get_stats()
+        survivors = [os.path.exists(item['path']) for item in uploads]
+        print(f"   sweep {result}, stored {stats['stored_bytes']}B of {stats['quota_bytes']}B")
+        if (not os.path.exists(annotated['path']) and survivors == [False, False, True, True]
+                and not os.path.exists(legacy_path) and stats['stored_bytes'] <= 25000):
+            print("✅ Expired, oldest over-quota and legacy files removed")
+            return True
+        print(f"❌ Unexpected sweep result, uploads kept: {survivors}")
+        return False
+
+def check_failed_put_leaves_no_file():
+    """A put whose transaction rolls back does not leave an unreferenced file in objects/"""
+    print("=== Testing Rolled-Back Put ===")
+    with tempfile.TemporaryDirectory() as root:
+        store = BlobStore(root)
+        ref = uuid.uuid4()
+        with mock.patch('blob_store.uuid.uuid4', return_value=ref):
+            first = store.put(os.urandom(1000), 'upload', '.jpg')
+            try:
+                store.put(os.urandom(1000), 'upload', '.jpg')  # same ref: the refs insert fails
+                failed = False
+            except Exception:
+                failed = True
+        files = [name for _, _, names in os.walk(store.objects_dir) for name in names]
+        stats = store.get_stats()
+
+    print(f"   second put failed {failed}, files {len(files)}, blobs {stats['blobs']}")
+    if failed and files == [first['name']] and stats['blobs'] == 1:
+        print("✅ Rolled-back put removed the file it moved in")
+        return True
+    print("❌ Rolled-back put left an orphaned file")
+    return False
+
+def test_dedupe_and_refcount():
+    assert check_dedupe_and_refcount()
+
+def test_ttl_quota_and_legacy():
+    assert check_ttl_quota_and_legacy()
+
+def test_failed_put_leaves_no_file():
+    assert check_failed_put_leaves_no_file()
+
+def main():
+    print("🚀 Starting Blob Store Tests\n")
+    results = [check_dedupe_and_refcount(), check_ttl_quota_and_legacy(), check_failed_put_leaves_no_file()]
+    print(f"\n{'🎉 All blob store tests passed' if all(results) else '⚠️  Some blob store tests failed'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Test script for the streaming chat endpoint and chat sessions, driven
+in-process through app.test_client() against the mock completions API
+(mock_llm_server), and for closing the per-stone insight stream early
+"""
+
+import json
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import chatbot_service
+from app_harness import app_client
+from llm_client import ResilientLLMClient
+from mock_llm_server import CANNED_RESPONSE, start_mock_server
+
+STONES_DATA = [
+    {"id": 1, "diameter_mm": "6.20 mm", "position": "middle-left", "confidence": "87.0%", "type": "kidney_stone"},
+    {"id": 2, "diameter_mm": "3.10 mm", "position": "bottom-right", "confidence": "74.0%", "type": "kidney_stone"}
+]
+# Not answered by the rules tier, so the stream comes from the model
+QUESTION = "Could you walk me through what these scan findings mean for me?"
+
+def read_sse(chunks):
+    """Yield (event, data) pairs from an iterable of SSE byte chunks"""
+    event = None
+    for line in b''.join(chunks).decode('utf-8').splitlines():
+        if line.startswith('event: '):
+            event = line[len('event: '):]
+        elif line.startswith('data: '):
+            yield event, json.loads(line[len('data: '):])
+            event = None
+
+def with_mock_llm(run, **handler_options):
+    """Call run(test client) with chatbot_service talking to a fresh mock server and an empty response cache"""
+    server, url = start_mock_server(**handler_options)
+    previous = chatbot_service.client
+    chatbot_service.client = ResilientLLMClient(url, "test-key", timeout=5)
+    chatbot_service.response_cache.clear()
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            _, client = app_client(workdir)
+            return run(client)
+    finally:
+        chatbot_service.client = previous
+        server.shutdown()
+
+def check_chat_stream():
+    """Tokens arrive as separate events and the stream completes with the model's answer"""
+    print("=== Testing Streaming Chat ===")
+
+    def run(client):
+        completed = chatbot_service.stream_stats['completed']
+        started = time.perf_counter()
+        response = client.post('/chat/stream', json={"question": QUESTION, "stones_data": STONES_DATA})
+        events = list(read_sse(response.response))
+        return response, events, time.perf_counter() - started, chatbot_service.stream_stats['completed'] - completed
+
+    response, events, total, completed = with_mock_llm(run, token_delay=0.005)
+    tokens = [data['token'] for event, data in events if event is None]
+    print(f"   status {response.status_code}, {len(tokens)} chunks in {total:.3f}s, events {[e for e, _ in events if e]}")
+    if (response.status_code == 200 and response.mimetype == 'text/event-stream' and len(tokens) > 1
+            and ''.join(tokens).strip() == CANNED_RESPONSE.strip() and events[-1][0] == 'done' and completed == 1):
+        print("✅ Streamed the model's answer token by token")
+        return True
+    print("❌ Stream incomplete or not incremental")
+    return False
+
+def check_client_disconnect():
+    """Dropping the connection after the first token is recorded as a disconnect and stops the stream"""
+    print("=== Testing Client Disconnect ===")
+
+    def run(client):
+        disconnected = chatbot_service.stream_stats['disconnected']
+        completed = chatbot_service.stream_stats['completed']
+        response = client.post('/chat/stream', json={"question": QUESTION, "stones_data": STONES_DATA}, buffered=False)
+        first = next(iter(response.response))
+        response.close()  # Hang up after the first token
+        return (first, chatbot_service.stream_stats['disconnected'] - disconnected,
+                chatbot_service.stream_stats['completed'] - completed)
+
+    first, disconnected, completed = with_mock_llm(run, token_delay=0.05)
+    print(f"   first chunk {first[:40]!r}, disconnects recorded {disconnected}, completions {completed}")
+    if first.startswith(b'data: ') and disconnected == 1 and completed == 0:
+        print("✅ Disconnect recorded and the upstream stream closed")
+        return True
+    print("❌ Disconnect not recorded")
+    return False
+
+def check_session_tiers():
+    """Follow-ups in a chat session go through the rules tier first and are counted per tier"""
+    print("=== Testing Chat Session Tiers ===")
+
+    def run(client):
+        before = chatbot_service.get_tier_stats()['tiers']
+        session = client.post('/chat/sessions', json={"stones_data": STONES_DATA}).get_json()['session']
+        answers = [client.post('/chat', json={"question": question, "session_id": session['session_id']}).get_json()
+                   for question in ("How much water should I drink?", QUESTION)]
+        after = chatbot_service.get_tier_stats()['tiers']
+        counted = {tier: after.get(tier, {}).get('count', 0) - before.get(tier, {}).get('count', 0)
+                   for tier in ('rules', 'llm')}
+        return answers, counted
+
+    answers, counted = with_mock_llm(run)
+    print(f"   tiers {[a.get('tier') for a in answers]}, turns {answers[-1]['session']['usage']['turns']}, counted {counted}")
+    if ([a.get('tier') for a in answers] == ['rules', 'llm'] and answers[1]['response'] == CANNED_RESPONSE
+            and answers[-1]['session']['usage']['turns'] == 2 and counted == {'rules': 1, 'llm': 1}):
+        print("✅ Session follow-ups answered by the rules tier when they can be")
+        return True
+    print("❌ Session follow-up skipped the rules tier or was not counted")
+    return False
+
+def check_insights_closed_early():
+    """Closing the insight generator after the first stone cancels the calls not yet started"""
+    print("=== Testing Early Close of Stone Insights ===")
+    calls = []
+
+    def slow_insight(stone, timeout=None):
+        calls.append(stone['id'])
+        time.sleep(0.1)
+        return f"Insight {stone['id']}"
+
+    stones = [{"id": i, "diameter_mm": f"{i * 2}.00 mm", "position": "middle-left", "confidence": "80.0%"}
+              for i in range(1, 5)]
+    # One worker, so the later calls are still queued when the first insight arrives
+    executor = ThreadPoolExecutor(max_workers=1)
+    with mock.patch.object(chatbot_service, 'get_stone_specific_info', slow_insight), \
+            mock.patch.object(chatbot_service, '_insight_executor', executor):
+        insights = chatbot_service.iter_stone_insights(stones, timeout=5)
+        first = next(insights)
+        insights.close()  # The client went away after the first stone
+        executor.shutdown(wait=True)
+
+    print(f"   first {first}, calls made {calls}")
+    if first == (1, "Insight 1") and len(calls) <= 2:
+        print("✅ Queued insight calls cancelled when the generator closed")
+        return True
+    print("❌ Insight calls kept running after the generator closed")
+    return False
+
+def test_chat_stream():
+    assert check_chat_stream()
+
+def test_client_disconnect():
+    assert check_client_disconnect()
+
+def test_session_tiers():
+    assert check_session_tiers()
+
+def test_insights_closed_early():
+    assert check_insights_closed_early()
+
+def main():
+    """Run streaming chat tests"""
+    print("🚀 Starting Streaming Chat Tests\n")
+    results = [check_chat_stream(), check_client_disconnect(), check_session_tiers(), check_insights_closed_early()]
+    print(f"\n{'🎉 All streaming tests passed' if all(results) else '⚠️  Some streaming tests failed'}")
+
+if __name__ == "__main__":
+    main()
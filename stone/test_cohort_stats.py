@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Test script for the incremental cohort statistics: running totals against a
+full recompute, t-digest accuracy and snapshot/replay across restarts
+"""
+
+import os
+import tempfile
+import numpy as np
+from cohort_stats import CohortStats, TDigest
+from scan_history import ScanHistoryStore
+
+POSITIONS = [f"{v}-{h}" for v in ('top', 'middle', 'bottom') for h in ('left', 'center', 'right')]
+
+def severity_level(count, burden):
+    """Same thresholds as calculate_severity in flask_app"""
+    if count <= 2 and burden < 5:
+        return 'Normal'
+    if (count <= 4 and burden <= 10) or (count <= 2 and burden < 10):
+        return 'Moderate'
+    return 'Severe'
+
+def record_random_scans(store, rng, count):
+    for _ in range(count):
+        stones = [{
+            'diameter_mm': float(rng.gamma(2.0, 2.5)),
+            'confidence': float(rng.uniform(0.3, 1.0)),
+            'position': POSITIONS[rng.integers(len(POSITIONS))]
+        } for _ in range(rng.integers(0, 6))]
+        store.record_scan(f"PT-{rng.integers(50)}", stones)
+
+def check_incremental_matches_full():
+    """Totals folded in over many refreshes equal one pass over the history"""
+    print("=== Testing Incremental vs Full Recompute ===")
+    rng = np.random.default_rng(7)
+    with tempfile.TemporaryDirectory() as workdir:
+        store = ScanHistoryStore(os.path.join(workdir, 'history'))
+        stats = CohortStats(store, severity_level)
+        for _ in range(5):
+            record_random_scans(store, rng, 40)
+            stats.refresh()
+        record_random_scans(store, rng, 10)
+
+        result = stats.verify()
+        incremental = result['incremental']
+        print(f"   analyses {incremental['analyses']}, severity {incremental['severity']}, "
+              f"p90 {incremental['diameter_quantiles_mm']['p90']} vs {result['full']['diameter_quantiles_mm']['p90']}")
+        if result['consistent'] and incremental['analyses'] == 210:
+            print("✅ Incremental totals match the full recompute")
+            return True
+        print(f"❌ Mismatched fields: {result['mismatches']}")
+        return False
+
+def check_digest_accuracy():
+    """Quantiles from the digest stay close to exact ones with bounded centroids"""
+    print("=== Testing T-Digest Accuracy ===")
+    values = np.random.default_rng(3).lognormal(1.0, 0.6, 200000)
+    digest = TDigest()
+    for chunk in np.array_split(values, 400):
+        digest.update(chunk)
+
+    errors = {q: abs(digest.quantile(q) - np.quantile(values, q)) / np.quantile(values, q) for q in (0.5, 0.9, 0.99)}
+    print(f"   centroids {len(digest.means)}, relative errors {', '.join(f'p{round(q * 100)} {e:.4f}' for q, e in errors.items())}")
+    if max(errors.values()) < 0.01 and len(digest.means) <= 120:
+        print("✅ Quantiles within 1% using a bounded set of centroids")
+        return True
+    print("❌ Digest quantiles too far off")
+    return False
+
+def check_snapshot_replay():
+    """A restarted instance loads its snapshot and replays only newer scans"""
+    print("=== Testing Snapshot and Replay ===")
+    rng = np.random.default_rng(11)
+    with tempfile.TemporaryDirectory() as workdir:
+        store = ScanHistoryStore(os.path.join(workdir, 'history'))
+        snapshot = os.path.join(workdir, 'cohort.npz')
+        record_random_scans(store, rng, 60)
+        first = CohortStats(store, severity_level, snapshot_path=snapshot)
+        first.refresh()
+        first.save_snapshot()
+
+        record_random_scans(store, rng, 25)
+        restarted = CohortStats(ScanHistoryStore(os.path.join(workdir, 'history')), severity_level, snapshot_path=snapshot)
+        loaded = restarted.applied_scans
+        replayed = restarted.refresh()
+        result = restarted.verify()
+        print(f"   loaded {loaded} scans from snapshot, replayed {replayed}")
+        if loaded == 60 and replayed == 25 and result['consistent']:
+            print("✅ Snapshot resumed and caught up with the history")
+            return True
+        print(f"❌ Snapshot replay failed: {result['mismatches']}")
+        return False
+
+def test_incremental_matches_full():
+    assert check_incremental_matches_full()
+
+def test_digest_accuracy():
+    assert check_digest_accuracy()
+
+def test_snapshot_replay():
+    assert check_snapshot_replay()
+
+def main():
+    print("🚀 Starting Cohort Statistics Tests\n")
+    results = [check_incremental_matches_full(), check_digest_accuracy(), check_snapshot_replay()]
+    print(f"\n{'🎉 All cohort statistics tests passed' if all(results) else '⚠️  Some cohort statistics tests failed'}")
+
+if __name__ == "__main__":
+    main()
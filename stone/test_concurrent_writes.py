@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Stress test for the CSV data managers under many writer processes
+
+Each process runs several threads that register users, upsert doctor
+contacts, add patients and record scans against shared files. Compaction
+and flush thresholds are kept low so rewrites happen while appends are in
+flight. Afterwards every write is checked for in a fresh process.
+
+Usage:
+    python test_concurrent_writes.py [--processes 8] [--threads 4] [--ops 60]
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from multiprocessing import get_context
+
+SCAN_TARGETS = 5
+
+def make_managers(workdir):
+    from simple_user_manager import SimpleUserDataManager
+    from patient_data_manager import PatientDataManager
+    users = SimpleUserDataManager(os.path.join(workdir, 'user_data.csv'), os.path.join(workdir, 'doctor_contacts.csv'))
+    patients = PatientDataManager(os.path.join(workdir, 'patient_data.csv'))
+    return users, patients
+
+def worker(args):
+    """Hammer the managers from one process; returns writer stats"""
+    workdir, process_id, threads, ops, scan_targets = args
+    os.environ.update({
+        'DOCTOR_LOG_COMPACT_THRESHOLD': '50', 'DOCTOR_LOG_COMPACT_RATIO': '0', 'DOCTOR_LOG_COMPACT_INTERVAL': '0.2',
+        'SCAN_FLUSH_THRESHOLD': '40', 'SCAN_FLUSH_INTERVAL': '0.2'
+    })
+    users, patients = make_managers(workdir)
+    failures = []
+
+    def run(thread_id):
+        for i in range(ops):
+            key = f"p{process_id}_t{thread_id}_{i}"
+            ok = users.save_user_data({'user_id': key, 'first_name': 'Load', 'last_name': key, 'email': f"{key}@example.com"})
+            # Every contact is written twice; the second value must win
+            ok &= users.save_doctor_contact({'user_id': key, 'doctor_phone': 'first'})
+            ok &= users.save_doctor_contact({'user_id': key, 'doctor_phone': f"final-{key}"})
+            ok &= patients.add_patient({'patient_id': f"PT-{key}", 'first_name': 'Load', 'last_name': key,
+                                        'email': f"{key}@example.com"}) is not None
+            ok &= patients.update_patient_scan_info(scan_targets[i % len(scan_targets)])
+            if not ok:
+                failures.append(key)
+
+    pool = [threading.Thread(target=run, args=(t,)) for t in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return {
+        'failures': failures,
+        'users': users.user_writer.get_stats(),
+        'patients': patients.writer.get_stats(),
+        'scans': patients.scan_log.log_writer.get_stats()
+    }
+
+def check_rows(path, fields):
+    """Every data row must parse with the header's column count"""
+    with open(path, 'r', newline='', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        return header == fields and all(len(row) == len(fields) for row in reader)
+
+def check_concurrent_writes(processes=8, threads=4, ops=60):
+    print(f"=== Testing {processes} processes x {threads} threads x {ops} operations ===")
+    from simple_user_manager import USER_FIELDS, DOCTOR_FIELDS
+    from patient_data_manager import PATIENT_FIELDS
+
+    with tempfile.TemporaryDirectory() as workdir:
+        _, patients = make_managers(workdir)
+        scan_targets = [patients.add_patient({'first_name': 'Scan', 'last_name': f"Target{i}", 'email': f"t{i}@example.com"})
+                        for i in range(SCAN_TARGETS)]
+
+        with get_context('spawn').Pool(processes) as pool:
+            results = pool.map(worker, [(workdir, p, threads, ops, scan_targets) for p in range(processes)])
+
+        users, patients = make_managers(workdir)
+        users.doctor_contacts.compact()
+        patients.scan_log.flush()
+        keys = [f"p{p}_t{t}_{i}" for p in range(processes) for t in range(threads) for i in range(ops)]
+        passed = True
+
+        failures = [key for result in results for key in result['failures']]
+        lost_users = [key for key in keys if users.get_user_by_id(key) is None]
+        lost_contacts = [key for key in keys
+                         if (users.get_doctor_contact(key) or {}).get('doctor_phone') != f"final-{key}"]
+        stored_ids = {row['patient_id'] for row in patients.get_all_patients()}
+        lost_patients = [key for key in keys if f"PT-{key}" not in stored_ids]
+        scans = sum(int(patients.get_patient_by_id(pid)['total_scans']) for pid in scan_targets)
+
+        checks = [
+            ("Manager calls reported success", not failures, f"{len(failures)} failed calls"),
+            ("No lost users", not lost_users, f"{len(lost_users)} missing"),
+            ("Latest doctor contact wins", not lost_contacts, f"{len(lost_contacts)} wrong or missing"),
+            ("No lost patients", not lost_patients, f"{len(lost_patients)} missing"),
+            ("No lost scans", scans == len(keys), f"{scans} of {len(keys)} counted"),
+            ("CSV rows intact", check_rows(users.csv_file_path, USER_FIELDS)
+             and check_rows(users.doctor_csv_path, DOCTOR_FIELDS)
+             and check_rows(patients.csv_file_path, PATIENT_FIELDS), "malformed rows"),
+        ]
+        for name, ok, detail in checks:
+            print(f"{'✅' if ok else '❌'} {name}" + ("" if ok else f": {detail}"))
+            passed &= ok
+
+        for writer in ('users', 'patients', 'scans'):
+            commits = sum(result[writer]['commits'] for result in results)
+            appends = sum(result[writer]['appends'] for result in results)
+            print(f"   {writer}: {appends} appends in {commits} fsyncs ({appends / max(commits, 1):.2f} per fsync)")
+        return passed
+
+def crash_mid_flush(patients):
+    """Flush, then put the scan log and journal back as if the process died before resetting the log"""
+    with open(patients.scan_log.log_path, 'rb') as file:
+        events = file.read()
+    patients.scan_log.flush()
+    with open(patients.csv_file_path, 'rb') as file:
+        sha256 = hashlib.sha256(file.read()).hexdigest()
+    with open(patients.scan_log.journal_path, 'w', encoding='utf-8') as file:
+        json.dump({'sha256': sha256}, file)
+    with open(patients.scan_log.log_path, 'wb') as file:
+        file.write(events)
+
+def check_interrupted_flush():
+    """Scans folded in by a flush that died before resetting its log are not counted twice"""
+    print("=== Testing Recovery From an Interrupted Scan Flush ===")
+    from patient_data_manager import PatientDataManager
+    from sqlite_storage import migrate_csv_to_sqlite
+
+    with tempfile.TemporaryDirectory() as workdir:
+        csv_path = os.path.join(workdir, 'patient_data.csv')
+        patients = PatientDataManager(csv_path)
+        patient_id = patients.add_patient({'first_name': 'Crash', 'last_name': 'Flush', 'email': 'crash@example.com'})
+        patients.update_patient_scan_info(patient_id)
+        patients.update_patient_scan_info(patient_id)
+
+        # An append must not change the file before the journal is checked
+        crash_mid_flush(patients)
+        patients.add_patient({'first_name': 'Next', 'last_name': 'Patient', 'email': 'next@example.com'})
+        after_append = patients.get_patient_by_id(patient_id)['total_scans']
+        # A process starting up settles the journal too
+        patients.update_patient_scan_info(patient_id)
+        crash_mid_flush(patients)
+        after_restart = PatientDataManager(csv_path).get_patient_by_id(patient_id)['total_scans']
+        # Migration folds in scans that were never flushed
+        patients.update_patient_scan_info(patient_id)
+        db_path = os.path.join(workdir, 'stone_data.db')
+        migrate_csv_to_sqlite(db_path, None, None, csv_path)
+        with sqlite3.connect(db_path) as conn:
+            migrated = conn.execute("SELECT total_scans FROM patients WHERE patient_id = ?", (patient_id,)).fetchone()[0]
+
+    print(f"   total_scans after append {after_append}, after restart {after_restart}, migrated {migrated}")
+    if (after_append, after_restart, migrated) == ('2', '3', 4):
+        print("✅ Interrupted flush recovered without double counting; migration keeps unflushed scans")
+        return True
+    print("❌ Scan counts wrong after an interrupted flush")
+    return False
+
+def check_search_during_appends(adders=4, searchers=4, patients_each=150):
+    """Searches racing appends neither miss nor double-index the new rows"""
+    print("=== Testing Search While Patients Are Added ===")
+    from patient_data_manager import PatientDataManager
+
+    with tempfile.TemporaryDirectory() as workdir:
+        patients = PatientDataManager(os.path.join(workdir, 'patient_data.csv'))
+        done = threading.Event()
+        duplicated = []
+
+        def add(adder_id):
+            for i in range(patients_each):
+                patients.add_patient({'first_name': 'Race', 'last_name': 'Interleave', 'email': f"a{adder_id}_{i}@example.com"})
+
+        def search():
+            while not done.is_set():
+                ids = [row['patient_id'] for row in patients.search_patients('interleave')]
+                if len(ids) != len(set(ids)):
+                    duplicated.append(len(ids) - len(set(ids)))
+
+        search_pool = [threading.Thread(target=search) for _ in range(searchers)]
+        add_pool = [threading.Thread(target=add, args=(a,)) for a in range(adders)]
+        for thread in search_pool + add_pool:
+            thread.start()
+        for thread in add_pool:
+            thread.join()
+        done.set()
+        for thread in search_pool:
+            thread.join()
+        ids = [row['patient_id'] for row in patients.search_patients('interleave')]
+
+    expected = adders * patients_each
+    print(f"   {len(ids)} results, {len(set(ids))} unique, {len(duplicated)} searches saw duplicates")
+    if len(ids) == len(set(ids)) == expected and not duplicated:
+        print(f"✅ All {expected} patients found exactly once")
+        return True
+    print("❌ Search results missing or duplicated")
+    return False
+
+def test_concurrent_writes():
+    assert check_concurrent_writes()
+
+def test_interrupted_flush():
+    assert check_interrupted_flush()
+
+def test_search_during_appends():
+    assert check_search_during_appends()
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent write stress test for the CSV managers')
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--ops', type=int, default=60)
+    args = parser.parse_args()
+
+    print("🚀 Starting Concurrent Write Tests\n")
+    passed = check_concurrent_writes(args.processes, args.threads, args.ops)
+    passed &= check_interrupted_flush()
+    passed &= check_search_during_appends()
+    print(f"\n{'🎉 All writes accounted for' if passed else '⚠️  Some writes were lost'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Test script for the detector evaluation harness: stub backends built from
+the data/test labels give known mAP and recall, and the report is written
+as JSON and markdown
+"""
+
+import json
+import os
+import tempfile
+import numpy as np
+from evaluate_detector import (SMALL_STONE_MM, average_precision, load_dataset, match_predictions,
+                               run_evaluation, save_report)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SAMPLES = load_dataset(os.path.join(HERE, 'data', 'test', 'images'), os.path.join(HERE, 'data', 'test', 'labels'))
+
+def label_backend(transform):
+    """Backend answering each image, in dataset order, with its label boxes passed through transform(boxes, sample)"""
+    queue = list(SAMPLES)
+
+    def detect(images):
+        answers = []
+        for _ in images:
+            sample = queue.pop(0)
+            boxes = transform(sample['boxes'].copy(), sample)
+            answers.append((boxes, np.full(len(boxes), 0.9)))
+        return answers
+    return detect
+
+def check_ap_and_matching():
+    """Hand-checked AP and one-to-one matching"""
+    print("=== Testing AP and Matching ===")
+    tp = np.array([[True], [False], [True]])
+    ap = average_precision(tp, np.array([0.9, 0.8, 0.7]), gt_count=2)[0]
+    # Two predictions on one stone: only the better overlap counts
+    gt = np.array([[10, 10, 20, 20]], dtype=np.float64)
+    matched, found = match_predictions(np.array([[10, 10, 20, 21], [10, 10, 20, 20]], dtype=np.float64), gt)
+    print(f"   AP {ap:.4f}, tp {matched[:, 0].tolist()}, found {found[:, 0].tolist()}")
+    if abs(ap - (51 + 50 * 2 / 3) / 101) < 1e-9 and matched[:, 0].tolist() == [False, True] and found.all():
+        print("✅ AP interpolation and matching correct")
+        return True
+    print("❌ AP or matching wrong")
+    return False
+
+def check_stub_backends():
+    """Perfect, shifted and small-stone-blind backends score as expected on data/test"""
+    print("=== Testing Evaluation on data/test ===")
+
+    def shift(boxes, sample):
+        # Shift right by a fifth of the width: IoU 0.8 / 1.2 = 0.67
+        boxes[:, [0, 2]] += (boxes[:, 2:3] - boxes[:, 0:1]) * 0.2
+        return boxes
+
+    def drop_small(boxes, sample):
+        diameters = (boxes[:, 2:] - boxes[:, :2]).max(axis=1, initial=0) * sample['pixel_to_mm']
+        return boxes[diameters >= SMALL_STONE_MM]
+
+    backends = [('oracle', label_backend(lambda boxes, sample: boxes)), ('shifted', label_backend(shift)),
+                ('no_small', label_backend(drop_small))]
+    # No warm-up: it would take answers from the stub queues
+    report = run_evaluation(backends, SAMPLES, batch_size=4, warmup=0)
+    oracle, shifted, no_small = report['results']
+    print(f"   {report['dataset']}, oracle {oracle['map50_95']}, shifted {shifted['map50']}/{shifted['map50_95']}, "
+          f"no_small recall {no_small['recall']} small {no_small['small_recall']}")
+
+    passed = True
+    if report['dataset']['images'] == 123 and report['dataset']['stones'] == 224 and oracle['map50_95'] == 1.0 and oracle['small_recall'] == 1.0:
+        print("✅ Label boxes score mAP50-95 1.0")
+    else:
+        print("❌ Oracle backend not perfect")
+        passed = False
+    if shifted['map50'] == 1.0 and abs(shifted['map50_95'] - 0.4) < 0.01:
+        print("✅ IoU-0.67 boxes pass 4 of 10 thresholds")
+    else:
+        print("❌ Shifted backend scored wrong")
+        passed = False
+    small_share = report['dataset']['small_stones'] / report['dataset']['stones']
+    if no_small['small_recall'] == 0.0 and abs(no_small['recall'] - (1 - small_share)) < 1e-3 and report['deltas']['no_small']['small_recall'] == -1.0:
+        print("✅ Small-stone recall reported separately, with deltas against the first backend")
+    else:
+        print("❌ Small-stone recall or deltas wrong")
+        passed = False
+
+    with tempfile.TemporaryDirectory() as workdir:
+        json_path, markdown_path = save_report(report, os.path.join(workdir, 'report'))
+        with open(json_path, encoding='utf-8') as file:
+            saved = json.load(file)
+        with open(markdown_path, encoding='utf-8') as file:
+            markdown = file.read()
+    if saved['results'][1]['backend'] == 'shifted' and '| oracle | 1.000 | 1.000 |' in markdown and 'p50_ms' in saved['results'][0]['latency']:
+        print("✅ JSON and markdown reports written")
+    else:
+        print("❌ Report files incomplete")
+        passed = False
+    return passed
+
+def test_ap_and_matching():
+    assert check_ap_and_matching()
+
+def test_stub_backends():
+    assert check_stub_backends()
+
+def main():
+    print("🚀 Starting Evaluation Harness Tests\n")
+    results = [check_ap_and_matching(), check_stub_backends()]
+    print(f"\n{'🎉 All evaluation harness tests passed' if all(results) else '⚠️  Some evaluation harness tests failed'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Test script for the watch-folder ingestion daemon with a stub analyser:
+partially written files are held back, settled ones are batched, results
+land in the JSONL file and images are moved aside (inotify and polling)
+"""
+
+import json
+import os
+import tempfile
+import time
+from PIL import Image
+from ingest_daemon import IngestDaemon
+
+def fake_analyze(batches):
+    def analyze(images):
+        batches.append(len(images))
+        return [{"detections": [], "summary": {"total_stones": 0}, "image_dimensions": f"{image.width}x{image.height}"}
+                for image in images]
+    return analyze
+
+def write_scan(path, size=64):
+    Image.new('RGB', (size, size), 'gray').save(path, 'JPEG')
+
+def run_until(daemon, condition, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline and not condition():
+        daemon.run_once(timeout=0.1)
+
+def check_mode(polling):
+    mode = 'polling' if polling else 'inotify'
+    print(f"=== Testing Ingestion ({mode}) ===")
+    with tempfile.TemporaryDirectory() as workdir:
+        watch = os.path.join(workdir, 'incoming')
+        results = os.path.join(workdir, 'results.jsonl')
+        batches = []
+        daemon = IngestDaemon(watch, fake_analyze(batches), results, batch_size=4,
+                              settle_seconds=0.3, poll_interval=0.1, polling=polling)
+
+        for i in range(6):
+            write_scan(os.path.join(watch, f"1-3-46-670589-33-1-{i}_png_jpg.jpg"))
+        # A slice still being copied: half the bytes now, the rest later
+        partial_path = os.path.join(watch, "1-3-46-670589-33-1-slow_png_jpg.jpg")
+        write_scan(os.path.join(workdir, 'slow.jpg'), size=256)
+        with open(os.path.join(workdir, 'slow.jpg'), 'rb') as file:
+            data = file.read()
+        with open(partial_path, 'wb') as file:
+            file.write(data[:len(data) // 2])
+
+        run_until(daemon, lambda: daemon.get_stats()['files_processed'] >= 6)
+        held_back = os.path.exists(partial_path)
+        with open(partial_path, 'ab') as file:
+            file.write(data[len(data) // 2:])
+        run_until(daemon, lambda: daemon.get_stats()['files_processed'] >= 7)
+
+        with open(results, encoding='utf-8') as file:
+            records = [json.loads(line) for line in file]
+        stats = daemon.get_stats()
+        processed = sorted(os.listdir(daemon.processed_dir))
+        print(f"   mode {stats['mode']}, batches {batches}, records {len(records)}, "
+              f"failed {stats['files_failed']}, retries {stats['incomplete_retries']}, avg lag {stats['avg_lag_seconds']}s, backlog {stats['backlog_files']}")
+        daemon.watcher.close()
+
+        passed = True
+        if stats['mode'] == mode and held_back and max(batches) <= 4:
+            print("✅ Partial file held back until settled, images batched")
+        else:
+            print("❌ Partial file processed early or batches too large")
+            passed = False
+        if (len(records) == 7 and len(processed) == 7 and stats['files_failed'] == 0
+                and stats['backlog_files'] == 0 and records[-1]['image_dimensions'] == '256x256'):
+            print("✅ Every image written to JSONL and moved aside")
+        else:
+            print("❌ Results or moved files missing")
+            passed = False
+        return passed
+
+def test_ingest_inotify():
+    """inotify mode (falls back to polling where unavailable)"""
+    assert check_mode(polling=False) or os.name != 'posix'
+
+def test_ingest_polling():
+    assert check_mode(polling=True)
+
+def main():
+    print("🚀 Starting Ingestion Daemon Tests\n")
+    results = [check_mode(polling=False), check_mode(polling=True)]
+    print(f"\n{'🎉 All ingestion tests passed' if all(results) else '⚠️  Some ingestion tests failed'}")
+
+if __name__ == "__main__":
+    main()
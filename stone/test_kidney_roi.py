@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Test script for the kidney ROI stage: the fitted prior keeps the labelled
+test stones, and detections on the crops map back to full-image
+coordinates (a stub detector that finds bright squares stands in for YOLO)
+"""
+
+import os
+import numpy as np
+from PIL import Image, ImageDraw
+import stone_inference
+from kidney_roi import DEFAULT_ROI_REGIONS, roi_coverage
+from stone_inference import analyze_images, suppress_duplicates
+
+TEST_LABELS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'test', 'labels')
+
+class StubArray:
+    def __init__(self, values):
+        self.values = np.asarray(values, dtype=np.float64)
+        self.shape = self.values.shape
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.values
+
+class StubResult:
+    names = {0: 'kidney_stone'}
+
+    def __init__(self, image):
+        # One box per run of columns containing bright pixels
+        pixels = np.asarray(image.convert('L')) > 200
+        columns = np.flatnonzero(pixels.any(axis=0))
+        boxes = []
+        for run in np.split(columns, np.flatnonzero(np.diff(columns) > 1) + 1) if len(columns) else []:
+            rows = np.flatnonzero(pixels[:, run].any(axis=1))
+            boxes.append([run[0], rows[0], run[-1] + 1, rows[-1] + 1])
+        self.boxes = type('Boxes', (), {'xyxy': StubArray(boxes or np.empty((0, 4))), 'conf': StubArray([0.9] * len(boxes)),
+                                        'cls': StubArray([0] * len(boxes))})()
+
+class StubModel:
+    def __init__(self):
+        self.sizes = []
+        self.imgsz = []
+
+    def predict(self, source, imgsz=None, save=False, verbose=False, **kwargs):
+        images = source if isinstance(source, list) else [source]
+        self.sizes.extend(image.size for image in images)
+        self.imgsz.extend(imgsz for _ in images)
+        return [StubResult(image) for image in images]
+
+def check_prior_coverage():
+    """The default regions keep (nearly) every labelled test stone while dropping a third of the image"""
+    print("=== Testing ROI Prior Coverage ===")
+    coverage = roi_coverage(TEST_LABELS)
+    print(f"   {coverage['boxes']} boxes, {coverage['inside']:.2%} inside, {coverage['area_fraction']:.1%} of area kept")
+    if coverage['inside'] >= 0.99 and coverage['area_fraction'] <= 0.7:
+        print("✅ ROI prior keeps the test stones")
+        return True
+    print("❌ ROI prior drops stones or keeps too much of the image")
+    return False
+
+def check_boxes_mapped_back():
+    """Stones found on the crops come back in full-image coordinates, with positions from the full image"""
+    print("=== Testing ROI Box Mapping ===")
+    image = Image.new('RGB', (391, 320), 'black')
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([100, 200, 109, 209], fill='white')
+    draw.rectangle([300, 150, 305, 155], fill='white')
+
+    stub = StubModel()
+    previous, stone_inference._model = stone_inference._model, stub
+    try:
+        roi = analyze_images([image], roi_regions=DEFAULT_ROI_REGIONS)[0]
+        crop_pixels = sum(width * height for width, height in stub.sizes)
+        full = analyze_images([image])[0]
+    finally:
+        stone_inference._model = previous
+
+    boxes = [stone['bbox'] for stone in roi['detections']]
+    print(f"   ROI boxes {boxes}, positions {[stone['position'] for stone in roi['detections']]}")
+    passed = True
+    if boxes == [[100.0, 200.0, 110.0, 210.0], [300.0, 150.0, 306.0, 156.0]]:
+        print("✅ Crop boxes shifted back to image coordinates")
+    else:
+        print("❌ Crop boxes not mapped back")
+        passed = False
+    if roi['detections'] == full['detections'] and crop_pixels < 0.7 * 391 * 320:
+        print(f"✅ ROI mode matches whole-image detections on {crop_pixels / (391 * 320):.0%} of the pixels")
+    else:
+        print("❌ ROI and whole-image results differ")
+        passed = False
+    return passed
+
+def check_crop_scale():
+    """Crops run at a size that scales them at least as much as the whole image at 640"""
+    print("=== Testing ROI Crop Scale ===")
+    image = Image.new('RGB', (391, 320), 'black')
+    stub = StubModel()
+    previous, stone_inference._model = stone_inference._model, stub
+    try:
+        analyze_images([image], roi_regions=DEFAULT_ROI_REGIONS)
+        fixed = StubModel()
+        stone_inference._model = fixed
+        analyze_images([image], roi_regions=DEFAULT_ROI_REGIONS, roi_imgsz=320)
+    finally:
+        stone_inference._model = previous
+
+    full_scale = 640 / max(image.size)
+    scales = [imgsz / max(size) for size, imgsz in zip(stub.sizes, stub.imgsz)]
+    print(f"   crop sizes {stub.sizes} at imgsz {stub.imgsz}, scale {min(scales):.3f} vs whole image {full_scale:.3f}")
+    if min(scales) >= full_scale and all(imgsz % 32 == 0 and imgsz < 640 for imgsz in stub.imgsz) and fixed.imgsz == [320, 320]:
+        print("✅ Derived crop size keeps the whole-image scale; an explicit ROI_IMGSZ is used as given")
+        return True
+    print("❌ Crops shrunk below the whole-image scale")
+    return False
+
+def check_suppress_duplicates():
+    """A stone seen by two overlapping crops is reported once"""
+    print("=== Testing Duplicate Suppression ===")
+    boxes = np.array([[10, 10, 20, 20], [11, 10, 21, 20], [50, 50, 60, 60]], dtype=np.float64)
+    keep = suppress_duplicates(boxes, np.array([0.6, 0.9, 0.5]))
+    if keep == [1, 2]:
+        print("✅ Lower-confidence duplicate dropped")
+        return True
+    print(f"❌ Kept {keep}")
+    return False
+
+def test_prior_coverage():
+    assert check_prior_coverage()
+
+def test_boxes_mapped_back():
+    assert check_boxes_mapped_back()
+
+def test_crop_scale():
+    assert check_crop_scale()
+
+def test_suppress_duplicates():
+    assert check_suppress_duplicates()
+
+def main():
+    print("🚀 Starting Kidney ROI Tests\n")
+    results = [check_prior_coverage(), check_boxes_mapped_back(), check_crop_scale(), check_suppress_duplicates()]
+    print(f"\n{'🎉 All kidney ROI tests passed' if all(results) else '⚠️  Some kidney ROI tests failed'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Test script for the resilient LLM client against local mock completions servers
+"""
+
+import time
+from mock_llm_server import start_mock_server
+from llm_client import ResilientLLMClient, LLMUnavailableError
+
+MESSAGES = [{"role": "user", "content": "How much water should I drink?"}]
+
+def check_hedged_request():
+    """A slow primary should be beaten by the hedged fallback request"""
+    print("=== Testing Hedged Request ===")
+
+    # One mock, two models: the primary is slow, the fallback answers at once with its own text
+    server, url = start_mock_server(model_latency={"slow-model": 2.0, "fast-model": 0.0},
+                                    model_responses={"fast-model": "Fallback answer"})
+    client = ResilientLLMClient(url, "test-key", fallback_model="fast-model", timeout=5, hedge_after=0.3)
+    try:
+        started = time.perf_counter()
+        completion = client.create_completion(model="slow-model", messages=MESSAGES)
+        elapsed = time.perf_counter() - started
+        stats = client.get_stats()
+        print(f"   Answered in {elapsed:.2f}s by {completion.model}, stats: {stats}")
+        if (completion.model == "fast-model" and completion.choices[0].message.content == "Fallback answer"
+                and stats['hedged'] == 1 and stats['hedge_wins'] == 1 and elapsed < 1.5):
+            print("✅ Fallback answer won the race")
+            return True
+        print("❌ Hedge was not issued or did not win")
+        return False
+    finally:
+        server.shutdown()
+
+def check_deadline():
+    """A hung upstream must not block longer than the configured timeout"""
+    print("=== Testing Per-Call Deadline ===")
+
+    hung_server, hung_url = start_mock_server(latency=10.0)
+    client = ResilientLLMClient(hung_url, "test-key", timeout=1.0)
+    try:
+        started = time.perf_counter()
+        client.create_completion(model="mock-model", messages=MESSAGES)
+        print("❌ Call unexpectedly succeeded")
+        return False
+    except LLMUnavailableError:
+        elapsed = time.perf_counter() - started
+        print(f"{'✅' if elapsed < 2.0 else '❌'} Gave up after {elapsed:.2f}s")
+        return elapsed < 2.0
+    finally:
+        hung_server.shutdown()
+
+def check_circuit_breaker():
+    """Repeated upstream failures should open the circuit and fail fast"""
+    print("=== Testing Circuit Breaker ===")
+
+    failing_server, failing_url = start_mock_server(fail=True)
+    client = ResilientLLMClient(failing_url, "test-key", failure_threshold=3, reset_timeout=60)
+    try:
+        for _ in range(3):
+            try:
+                client.create_completion(model="mock-model", messages=MESSAGES)
+            except LLMUnavailableError:
+                pass
+
+        started = time.perf_counter()
+        try:
+            client.create_completion(model="mock-model", messages=MESSAGES)
+        except LLMUnavailableError as e:
+            elapsed = time.perf_counter() - started
+            print(f"✅ Failed fast in {elapsed * 1000:.1f}ms: {e}")
+            return client.get_stats()['circuit_state'] == 'open' and elapsed < 0.5
+        print("❌ Circuit did not open")
+        return False
+    finally:
+        failing_server.shutdown()
+
+def test_hedged_request():
+    assert check_hedged_request()
+
+def test_deadline():
+    assert check_deadline()
+
+def test_circuit_breaker():
+    assert check_circuit_breaker()
+
+def main():
+    """Run resilience tests"""
+    print("🚀 Starting LLM Client Resilience Tests\n")
+
+    results = [check_hedged_request(), check_deadline(), check_circuit_breaker()]
+
+    print("\n" + "="*50)
+    if all(results):
+        print("🎉 ALL RESILIENCE TESTS PASSED!")
+    else:
+        print("⚠️  SOME TESTS FAILED")
+    print("="*50)
+
+if __name__ == "__main__":
+    main()
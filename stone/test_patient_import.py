@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Test script for bulk patient import through /patients/import on the CSV
+and SQLite backends: row validation, atomic uploads, duplicate patient IDs,
+NDJSON numbers, and the admin token check
+"""
+
+import json
+import os
+import tempfile
+from app_harness import app_client
+from sqlite_storage import SQLitePatientDataManager
+
+TOKEN = 'import-test-token'
+HEADERS = {'X-Admin-Token': TOKEN}
+
+CSV_UPLOAD = (
+    "patient_id,first_name,last_name,email,phone\n"
+    "PT-IMPORT1,Ada,Lovelace,ada@example.com,555-123-4567\n"
+    ",Alan,Turing,not-an-email,555-000-1111\n"
+    ",Grace,,grace@example.com,123\n"
+    "PT-IMPORT1,Ada,Again,ada2@example.com,\n"
+)
+
+def post_import(client, body, **params):
+    query = '&'.join(f"{key}={value}" for key, value in params.items())
+    return client.post(f"/patients/import?{query}", data=body, headers=HEADERS)
+
+def check_backend(backend):
+    """One backend: validation errors, atomic rejection, duplicate IDs and NDJSON phones"""
+    print(f"=== Testing Patient Import ({backend}) ===")
+    previous_token = os.environ.get('ADMIN_API_TOKEN')
+    os.environ['ADMIN_API_TOKEN'] = TOKEN
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            flask_app, client = app_client(workdir)
+            if backend == 'sqlite':
+                flask_app.patient_manager = SQLitePatientDataManager(os.path.join(workdir, 'stone_data.db'))
+            patients = flask_app.patient_manager
+
+            atomic = post_import(client, CSV_UPLOAD, format='csv', atomic='true').get_json()
+            after_atomic = len(patients.get_all_patients())
+            partial = post_import(client, CSV_UPLOAD, format='csv').get_json()
+            repeat = post_import(client, CSV_UPLOAD, format='csv').get_json()
+            ndjson = (json.dumps({'first_name': 'Num', 'last_name': 'Phone', 'email': 'num@example.com', 'phone': 5551234567})
+                      + '\n' + json.dumps({'first_name': 'No', 'last_name': 'Phone', 'email': 'none@example.com'}) + '\n')
+            numbers = post_import(client, ndjson, format='ndjson').get_json()
+            phones = [patients.get_patient_by_id(patient_id)['phone'] for patient_id in numbers['patient_ids']]
+            stored_ids = [row['patient_id'] for row in patients.get_all_patients()]
+    finally:
+        if previous_token is None:
+            os.environ.pop('ADMIN_API_TOKEN', None)
+        else:
+            os.environ['ADMIN_API_TOKEN'] = previous_token
+
+    errors = {error['row']: error['errors'] for error in partial['errors']}
+    print(f"   atomic {atomic['imported']}, partial {partial['imported']} errors {errors}, "
+          f"repeat {repeat['imported']}, phones {phones}")
+    passed = True
+    if atomic['imported'] == 0 and after_atomic == 0 and len(atomic['errors']) == 3:
+        print("✅ atomic=true writes nothing when a row is invalid")
+    else:
+        print("❌ Atomic import wrote rows or missed errors")
+        passed = False
+    if (partial['imported'] == 1 and partial['patient_ids'] == ['PT-IMPORT1']
+            and errors[2] == ['Please enter a valid email address']
+            and errors[3] == ['Last Name is required', 'Please enter a valid phone number']
+            and errors[4] == ['Patient ID duplicated in file']):
+        print("✅ Invalid rows and in-file duplicate IDs reported per row")
+    else:
+        print("❌ Row errors wrong")
+        passed = False
+    if repeat['imported'] == 0 and ['Patient ID already exists'] in [e['errors'] for e in repeat['errors']] \
+            and stored_ids.count('PT-IMPORT1') == 1:
+        print("✅ Re-importing an existing patient ID is rejected, not duplicated or silently dropped")
+    else:
+        print("❌ Existing patient IDs imported again or miscounted")
+        passed = False
+    if numbers['imported'] == 2 and phones == ['5551234567', '']:
+        print("✅ NDJSON numeric phone kept as written")
+    else:
+        print("❌ NDJSON phone numbers mangled")
+        passed = False
+    return passed
+
+def check_admin_token():
+    """Import and export stay closed without a configured token and reject a wrong one"""
+    print("=== Testing Admin Token ===")
+    previous_token = os.environ.pop('ADMIN_API_TOKEN', None)
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            _, client = app_client(workdir)
+            unconfigured = client.get('/patients/export', headers=HEADERS).status_code
+            os.environ['ADMIN_API_TOKEN'] = TOKEN
+            wrong = client.post('/patients/import?format=csv', data=CSV_UPLOAD, headers={'X-Admin-Token': 'nope'}).status_code
+            missing = client.get('/patients/export').status_code
+            allowed = client.get('/patients/export', headers=HEADERS).status_code
+    finally:
+        os.environ.pop('ADMIN_API_TOKEN', None)
+        if previous_token is not None:
+            os.environ['ADMIN_API_TOKEN'] = previous_token
+
+    print(f"   unconfigured {unconfigured}, wrong {wrong}, missing {missing}, correct {allowed}")
+    if (unconfigured, wrong, missing, allowed) == (503, 401, 401, 200):
+        print("✅ Admin endpoints fail closed")
+        return True
+    print("❌ Admin token check wrong")
+    return False
+
+def test_import_csv_backend():
+    assert check_backend('csv')
+
+def test_import_sqlite_backend():
+    assert check_backend('sqlite')
+
+def test_admin_token():
+    assert check_admin_token()
+
+def main():
+    print("🚀 Starting Patient Import Tests\n")
+    results = [check_backend('csv'), check_backend('sqlite'), check_admin_token()]
+    print(f"\n{'🎉 All patient import tests passed' if all(results) else '⚠️  Some patient import tests failed'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Test script for the columnar scan history: crash recovery (torn tails and
+the scan_stone_end commit marker), picking up scans written by another
+process, out-of-order scan times and since/until filters
+"""
+
+import tempfile
+from array import array
+from multiprocessing import get_context
+from scan_history import ScanHistoryStore
+
+DAY = 86400
+T0 = 1_700_000_000
+
+def stones(*diameters):
+    return [{'diameter_mm': d, 'confidence': 0.9, 'position': 'middle-left'} for d in diameters]
+
+def largest(history):
+    return [entry['largest_stone_mm'] for entry in history]
+
+def append_bytes(store, name, data):
+    with open(store._column_path(name), 'ab') as file:
+        file.write(data)
+
+def crash_mid_append(store, patient_id):
+    """Leave the files as a writer that died partway through record_scan would"""
+    append_bytes(store, 'stone_diameter_mm', array('f', [9.0, 9.5]).tobytes())
+    append_bytes(store, 'stone_confidence', array('f', [0.5, 0.5]).tobytes())
+    append_bytes(store, 'stone_position', array('H', [0, 0]).tobytes())
+    append_bytes(store, 'scan_patient', array('I', [store.codes['patients'][patient_id]]).tobytes())
+    append_bytes(store, 'scan_time', array('d', [T0 + 5 * DAY]).tobytes())
+    append_bytes(store, 'scan_stone_end', array('I', [99]).tobytes()[:2])  # torn commit marker
+    with open(store._dictionary_path('positions'), 'a', encoding='utf-8') as file:
+        file.write('half-writ')  # torn dictionary line
+
+def check_crash_recovery():
+    """Bytes past the last complete scan_stone_end are invisible to readers and trimmed by the next writer"""
+    print("=== Testing Crash Mid-Append ===")
+    with tempfile.TemporaryDirectory() as workdir:
+        store = ScanHistoryStore(workdir)
+        store.record_scan('PT-A', stones(4.0), scanned_at=T0)
+        crash_mid_append(store, 'PT-A')
+
+        reader = ScanHistoryStore(workdir)
+        before = reader.get_history('PT-A')
+        reader.record_scan('PT-A', stones(2.0, 3.0), scanned_at=T0 + DAY)
+        after = ScanHistoryStore(workdir).get_history('PT-A', include_stones=True)
+        reloaded = ScanHistoryStore(workdir)
+        stats = reloaded.get_stats()
+        positions = reloaded.values['positions']
+
+    print(f"   before {largest(before)}, after {largest(after)}, stats {stats}, positions {positions}")
+    if (largest(before) == [4.0] and largest(after) == [4.0, 3.0]
+            and [s['diameter_mm'] for s in after[1]['stones']] == [2.0, 3.0]
+            and (stats['scans'], stats['stones']) == (2, 3) and positions == ['middle-left']):
+        print("✅ Torn tail ignored on read and trimmed before the next append")
+        return True
+    print("❌ Partial scan visible or torn tail left in place")
+    return False
+
+def check_commit_marker():
+    """A scan whose scan_stone_end entry was never written does not exist yet"""
+    print("=== Testing Commit Marker ===")
+    with tempfile.TemporaryDirectory() as workdir:
+        store = ScanHistoryStore(workdir)
+        store.record_scan('PT-A', stones(4.0), scanned_at=T0)
+        # Stones, patient and time written; the process died before scan_stone_end
+        append_bytes(store, 'stone_diameter_mm', array('f', [7.0]).tobytes())
+        append_bytes(store, 'stone_confidence', array('f', [0.8]).tobytes())
+        append_bytes(store, 'stone_position', array('H', [0]).tobytes())
+        append_bytes(store, 'scan_patient', array('I', [0]).tobytes())
+        append_bytes(store, 'scan_time', array('d', [T0 + DAY]).tobytes())
+        uncommitted = ScanHistoryStore(workdir).get_history('PT-A')
+        store.record_scan('PT-A', stones(5.0), scanned_at=T0 + 2 * DAY)
+        committed = ScanHistoryStore(workdir).get_history('PT-A')
+
+    print(f"   without marker {largest(uncommitted)}, after next scan {largest(committed)}")
+    if largest(uncommitted) == [4.0] and largest(committed) == [4.0, 5.0]:
+        print("✅ Only scans with a scan_stone_end entry are read")
+        return True
+    print("❌ Uncommitted scan read")
+    return False
+
+def record_in_child(args):
+    workdir, patient_id, scanned_at, diameter = args
+    return ScanHistoryStore(workdir).record_scan(patient_id, stones(diameter), scanned_at=scanned_at)
+
+def check_refresh_across_processes():
+    """An open store sees scans another process recorded after it loaded"""
+    print("=== Testing Refresh Across Processes ===")
+    with tempfile.TemporaryDirectory() as workdir:
+        store = ScanHistoryStore(workdir)
+        store.record_scan('PT-A', stones(4.0), scanned_at=T0)
+        before = store.get_history('PT-A')
+        with get_context('spawn').Pool(2) as pool:
+            recorded = pool.map(record_in_child, [(workdir, 'PT-A', T0 + DAY, 5.0), (workdir, 'PT-B', T0, 1.0)])
+        after = store.get_history('PT-A')
+        other = store.get_history('PT-B')
+        stats = store.get_stats()
+
+    print(f"   before {largest(before)}, after {largest(after)}, PT-B {largest(other)}, scans {stats['scans']}")
+    if all(recorded) and largest(after) == [4.0, 5.0] and largest(other) == [1.0] and stats['scans'] == 3:
+        print("✅ Scans from other processes picked up on the next read")
+        return True
+    print("❌ Open store missed scans written elsewhere")
+    return False
+
+def check_out_of_order_and_filters():
+    """Scans recorded out of time order come back oldest first; since/until bound the range"""
+    print("=== Testing Out-of-Order Scans and since/until ===")
+    with tempfile.TemporaryDirectory() as workdir:
+        store = ScanHistoryStore(workdir)
+        for day, diameter in [(2, 3.0), (0, 1.0), (3, 4.0), (1, 2.0)]:
+            store.record_scan('PT-A', stones(diameter), scanned_at=T0 + day * DAY)
+        history = store.get_history('PT-A')
+        fresh = ScanHistoryStore(workdir).get_history('PT-A')
+        window = store.get_history('PT-A', since=T0 + DAY, until=T0 + 2 * DAY)
+        since = store.get_history('PT-A', since=T0 + 2 * DAY + 1)
+        trend = store.get_trend('PT-A', until=T0 + DAY)
+
+    print(f"   order {largest(history)}, reloaded {largest(fresh)}, window {largest(window)}, "
+          f"since {largest(since)}, trend {trend and trend['largest_stone_mm']}")
+    if (largest(history) == largest(fresh) == [1.0, 2.0, 3.0, 4.0] and largest(window) == [2.0, 3.0]
+            and largest(since) == [4.0] and trend['largest_stone_mm'] == [1.0, 2.0]
+            and trend['change_since_last_scan']['direction'] == 'increased'):
+        print("✅ History sorted by scan time and filtered inclusively")
+        return True
+    print("❌ Scan order or filters wrong")
+    return False
+
+def test_crash_recovery():
+    assert check_crash_recovery()
+
+def test_commit_marker():
+    assert check_commit_marker()
+
+def test_refresh_across_processes():
+    assert check_refresh_across_processes()
+
+def test_out_of_order_and_filters():
+    assert check_out_of_order_and_filters()
+
+def main():
+    print("🚀 Starting Scan History Tests\n")
+    results = [check_crash_recovery(), check_commit_marker(), check_refresh_across_processes(),
+               check_out_of_order_and_filters()]
+    print(f"\n{'🎉 All scan history tests passed' if all(results) else '⚠️  Some scan history tests failed'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Test script for multi-slice series analysis with a stub detector: stones
+seen on adjacent slices merge into one track, slices stream through in
+bounded batches, and exported slice names sort into acquisition order
+"""
+
+import io
+import numpy as np
+from PIL import Image
+from series_analysis import analyze_series, order_slices, StoneTracker
+
+# (first slice, last slice, centre x, centre y, peak diameter in mm)
+STONES = [(20, 34, 120, 200, 6.0), (150, 152, 300, 310, 3.2), (160, 200, 310, 300, 11.5)]
+
+def stub_detections(slice_index, rng):
+    detections = []
+    for first, last, x, y, peak in STONES:
+        if first <= slice_index <= last:
+            # Widest in the middle of the stone, with a little box jitter per slice
+            fraction = 1 - abs(slice_index - (first + last) / 2) / ((last - first) / 2 + 1)
+            diameter = peak * (0.5 + 0.5 * fraction)
+            half = diameter / 0.25 / 2
+            jitter = rng.normal(0, 1.0, 2)
+            detections.append({
+                "bbox": [x - half + jitter[0], y - half + jitter[1], x + half + jitter[0], y + half + jitter[1]],
+                "diameter_mm": round(diameter, 2), "confidence": 0.8, "position": "middle-left"
+            })
+    return detections
+
+def check_series_tracks():
+    """A 300-slice series reports each stone once with its largest diameter, in bounded batches"""
+    print("=== Testing Series Stone Tracking ===")
+    rng = np.random.default_rng(5)
+    state = {"decoded": 0, "analysed": 0, "max_outstanding": 0}
+
+    def slices(count=300):
+        for _ in range(count):
+            buffer = io.BytesIO()
+            Image.new('RGB', (32, 32), 'gray').save(buffer, 'PNG')
+            buffer.seek(0)
+            state["decoded"] += 1
+            state["max_outstanding"] = max(state["max_outstanding"], state["decoded"] - state["analysed"])
+            yield buffer
+
+    def analyze(images):
+        analyses = [{"detections": stub_detections(state["analysed"] + offset, rng), "image_dimensions": "32x32"}
+                    for offset in range(len(images))]
+        state["analysed"] += len(images)
+        return analyses
+
+    result = analyze_series(slices(), analyze, batch_size=16)
+    summary = result['summary']
+    diameters = [stone['max_diameter_mm'] for stone in result['stones']]
+    print(f"   slices {summary['slices']}, raw detections {summary['raw_detections']}, stones {summary['total_stones']}, "
+          f"diameters {diameters}, severity {summary['severity']['level']}, max in flight {state['max_outstanding']}")
+
+    passed = True
+    spans = [(stone['first_slice'], stone['last_slice']) for stone in result['stones']]
+    if spans == [(first, last) for first, last, *_ in STONES] and summary['raw_detections'] == 59:
+        print("✅ 59 per-slice boxes merged into 3 stones")
+    else:
+        print(f"❌ Unexpected tracks {spans}")
+        passed = False
+    if np.allclose(diameters, [peak for *_, peak in STONES], atol=0.6) and summary['severity']['level'] == 'Severe':
+        print("✅ Stones report their maximum diameter and severity uses the merged burden")
+    else:
+        print("❌ Diameters or severity wrong")
+        passed = False
+    if state["max_outstanding"] <= 16:
+        print("✅ No more than one batch of slices decoded at a time")
+    else:
+        print("❌ Slices were not streamed")
+        passed = False
+    return passed
+
+def check_tracker_gap_and_order():
+    """One missed slice does not split a stone; exported names sort by acquisition"""
+    print("=== Testing Gap Bridging and Slice Order ===")
+    tracker = StoneTracker(iou_threshold=0.3, max_gap=1)
+    box = {"bbox": [10, 10, 30, 30], "diameter_mm": 5.0, "confidence": 0.9, "position": "top-left"}
+    for index in (0, 1, 3, 4, 7):
+        tracker.add_slice(index, [box])
+    stones = tracker.close()
+
+    names = [
+        "1-3-46-670589-33-1-63742939456749458500001-4953850576413253802_png_jpg.rf.a.jpg",
+        "1-3-46-670589-33-1-63742939456580448800001-5305208767418446842_png_jpg.rf.b.jpg",
+        "1-3-46-670589-33-1-63742939456616450900001-4874858110489948158_png_jpg.rf.c.jpg",
+    ]
+    order = order_slices(names)
+    print(f"   tracks {[(stone['first_slice'], stone['last_slice']) for stone in stones]}, order {order}")
+    if [(stone['first_slice'], stone['last_slice']) for stone in stones] == [(0, 4), (7, 7)] and order == [1, 2, 0]:
+        print("✅ Gap of one slice bridged, longer gap starts a new stone, names ordered")
+        return True
+    print("❌ Gap handling or ordering wrong")
+    return False
+
+def test_series_tracks():
+    assert check_series_tracks()
+
+def test_tracker_gap_and_order():
+    assert check_tracker_gap_and_order()
+
+def main():
+    print("🚀 Starting Series Analysis Tests\n")
+    results = [check_series_tracks(), check_tracker_gap_and_order()]
+    print(f"\n{'🎉 All series analysis tests passed' if all(results) else '⚠️  Some series analysis tests failed'}")
+
+if __name__ == "__main__":
+    main()
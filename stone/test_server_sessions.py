@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Test script for server-side sessions: the cookie carries only the session
+ID, payloads are found again by that ID (also from a second worker sharing
+the SQLite store), and cookie bytes and would-be overflows are counted
+"""
+
+import os
+import tempfile
+import time
+from flask import Flask, jsonify, session
+from server_sessions import COOKIE_SIZE_LIMIT, ServerSessionInterface, SessionStore
+from ttl_store import TTLStore
+
+def make_app(store, refresh_each_request=True):
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    app.config['SESSION_REFRESH_EACH_REQUEST'] = refresh_each_request
+    app.session_interface = ServerSessionInterface(store)
+
+    @app.route('/set/<int:size>')
+    def set_value(size):
+        session['stones'] = 'x' * size
+        return jsonify({'ok': True})
+
+    @app.route('/get')
+    def get_value():
+        return jsonify({'stones': session.get('stones')})
+
+    @app.route('/clear')
+    def clear():
+        session.clear()
+        return jsonify({'ok': True})
+    return app
+
+def check_session_lookup():
+    """A session saved by one request is found by the next, by another worker, and not after clearing"""
+    print("=== Testing Session Lookup ===")
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, 'sessions.db')
+        app = make_app(SessionStore(db_path=db_path))
+        client = app.test_client()
+        client.get('/set/10')
+        same_worker = client.get('/get').get_json()['stones']
+        sid = client.get_cookie('session').value
+
+        # A second worker with an empty memory tier reads the SQLite table
+        other = make_app(SessionStore(db_path=db_path))
+        other_client = other.test_client()
+        other_client.set_cookie('session', sid)
+        other_worker = other_client.get('/get').get_json()['stones']
+        other_stats = other.session_interface.get_stats()['store']
+
+        stranger = app.test_client()
+        stranger.set_cookie('session', 'unknown-sid')
+        unknown = stranger.get('/get').get_json()['stones']
+        client.get('/clear')
+        cleared = other_client.get('/get').get_json()['stones']
+
+    print(f"   same worker {same_worker!r}, other worker {other_worker!r}, unknown {unknown!r}, after clear {cleared!r}")
+    if same_worker == other_worker == 'x' * 10 and len(sid) < 64 and other_stats['persistent_hits'] == 1 and unknown is None and cleared is None:
+        print("✅ Sessions found by ID across requests and workers, dropped when cleared")
+        return True
+    print("❌ Session lookup wrong")
+    return False
+
+def check_cookie_accounting():
+    """Cookie bytes stay at the ID's size while payloads past the cookie limit are counted"""
+    print("=== Testing Cookie Size Accounting ===")
+    app = make_app(SessionStore())
+    client = app.test_client()
+    client.get('/set/100')
+    response = client.get(f'/set/{COOKIE_SIZE_LIMIT + 500}')
+    set_cookie = response.headers.getlist('Set-Cookie')[-1]
+    client.get('/get')
+    stats = app.session_interface.get_stats()
+    print(f"   {stats}")
+
+    passed = True
+    if stats['requests'] == 3 and stats['cookie_bytes_out'] == 2 * len(set_cookie) and stats['cookie_bytes_in'] > 0:
+        print(f"✅ Cookie bytes counted ({len(set_cookie)} bytes per Set-Cookie)")
+    else:
+        print("❌ Cookie bytes miscounted")
+        passed = False
+    if stats['cookie_overflow_events'] == 1 and stats['largest_payload_bytes'] > COOKIE_SIZE_LIMIT and len(set_cookie) < 200:
+        print("✅ Oversized payload counted as a cookie overflow while the cookie stays small")
+    else:
+        print("❌ Overflow accounting wrong")
+        passed = False
+    return passed
+
+def check_expiry_and_eviction():
+    """Entries expire after the TTL and the least recently used entry is evicted first"""
+    print("=== Testing TTL and LRU ===")
+    store = TTLStore('entries', max_entries=2, ttl_seconds=0.2)
+    store.set('a', '1')
+    store.set('b', '2')
+    store.get('a')
+    store.set('c', '3')
+    evicted = store.get('b')
+    time.sleep(0.3)
+    expired = store.get('a')
+    stats = store.get_stats()
+    if evicted is None and expired is None and stats['evictions'] == 1 and stats['hits'] == 1:
+        print("✅ Least recently used entry evicted, stale entry expired")
+        return True
+    print(f"❌ TTL/LRU wrong: {stats}")
+    return False
+
+def check_sliding_expiry():
+    """Reading a session keeps it alive when SESSION_REFRESH_EACH_REQUEST is on, and only then"""
+    print("=== Testing Sliding Session Expiry ===")
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for refresh in (True, False):
+            app = make_app(SessionStore(ttl_seconds=0.4, db_path=os.path.join(workdir, f"sessions-{refresh}.db")),
+                           refresh_each_request=refresh)
+            client = app.test_client()
+            client.get('/set/10')
+            for _ in range(4):
+                time.sleep(0.15)
+                results[refresh] = client.get('/get').get_json()['stones']
+
+    print(f"   after 0.6s of reads: refresh on {results[True]!r}, refresh off {results[False]!r}")
+    if results[True] == 'x' * 10 and results[False] is None:
+        print("✅ Each request restarts the session TTL")
+        return True
+    print("❌ Session TTL not extended on read")
+    return False
+
+def test_session_lookup():
+    assert check_session_lookup()
+
+def test_cookie_accounting():
+    assert check_cookie_accounting()
+
+def test_expiry_and_eviction():
+    assert check_expiry_and_eviction()
+
+def test_sliding_expiry():
+    assert check_sliding_expiry()
+
+def main():
+    print("🚀 Starting Server Session Tests\n")
+    results = [check_session_lookup(), check_cookie_accounting(), check_expiry_and_eviction(), check_sliding_expiry()]
+    print(f"\n{'🎉 All server session tests passed' if all(results) else '⚠️  Some server session tests failed'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Test script for the SQLite storage backend: saving users by user_id and
+re-running the CSV migration
+"""
+
+import os
+import tempfile
+from simple_user_manager import SimpleUserDataManager
+from patient_data_manager import PatientDataManager
+from sqlite_storage import SQLiteUserDataManager, migrate_csv_to_sqlite
+
+USER = {'user_id': 'uid-1', 'first_name': 'Ada', 'last_name': 'Lovelace', 'email': 'ada@example.com',
+        'registration_date': '2024-01-02'}
+
+def check_save_user_data():
+    """Re-saving a user updates it and keeps the registration date; an empty user_id is rejected"""
+    print("=== Testing SQLite save_user_data ===")
+    with tempfile.TemporaryDirectory() as workdir:
+        users = SQLiteUserDataManager(os.path.join(workdir, 'stone_data.db'))
+        first = users.save_user_data(USER)
+        again = users.save_user_data({**USER, 'last_name': 'King', 'registration_date': '2025-05-05'})
+        blank = [users.save_user_data({**USER, 'user_id': user_id, 'email': f"{i}@example.com"})
+                 for i, user_id in enumerate(['', '  '])]
+        saved = users.get_user_by_id('uid-1')
+        count = users.db.connection().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    print(f"   saves {first}/{again}, blank {blank}, stored {saved}, rows {count}")
+    if first and again and blank == [False, False] and count == 1 \
+            and saved['last_name'] == 'King' and saved['registration_date'] == '2024-01-02':
+        print("✅ Existing user updated in place, blank user_id rejected")
+        return True
+    print("❌ save_user_data result or stored row wrong")
+    return False
+
+def check_migration_rerun():
+    """A second migration run inserts nothing new"""
+    print("=== Testing Repeated Migration ===")
+    with tempfile.TemporaryDirectory() as workdir:
+        user_csv = os.path.join(workdir, 'user_data.csv')
+        doctor_csv = os.path.join(workdir, 'doctor_contacts.csv')
+        patient_csv = os.path.join(workdir, 'patient_data.csv')
+        users = SimpleUserDataManager(user_csv, doctor_csv)
+        users.save_user_data(USER)
+        users.save_doctor_contact({'user_id': 'uid-1', 'doctor_email': 'dr@example.com'})
+        PatientDataManager(patient_csv).add_patient({'first_name': 'Pat', 'last_name': 'One', 'email': 'pat@example.com'})
+
+        db_path = os.path.join(workdir, 'stone_data.db')
+        first = migrate_csv_to_sqlite(db_path, user_csv, doctor_csv, patient_csv)
+        second = migrate_csv_to_sqlite(db_path, user_csv, doctor_csv, patient_csv)
+
+    print(f"   first {first}, second {second}")
+    if first == {'users': 1, 'doctor_contacts': 1, 'patients': 1} and second['users'] == second['patients'] == 0:
+        print("✅ Re-running the migration skips rows already copied")
+        return True
+    print("❌ Migration copied rows twice")
+    return False
+
+def test_save_user_data():
+    assert check_save_user_data()
+
+def test_migration_rerun():
+    assert check_migration_rerun()
+
+def main():
+    print("🚀 Starting SQLite Storage Tests\n")
+    results = [check_save_user_data(), check_migration_rerun()]
+    print(f"\n{'🎉 All SQLite storage tests passed' if all(results) else '⚠️  Some SQLite storage tests failed'}")
+
+if __name__ == "__main__":
+    main()
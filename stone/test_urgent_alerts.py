@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Test script for the urgent-case index and the doctor notification outbox,
+using the local SMTP sink and the SMS log stub
+"""
+
+import io
+import json
+import os
+import tempfile
+from PIL import Image
+from alerts import AlertStore, NotificationWorker, SmtpEmailSender, LogSmsSender
+from app_harness import app_client
+from mock_smtp_server import start_mock_smtp_server
+
+CONTACT = {'doctor_email': 'dr.house@example.com', 'doctor_phone': '555-123-4567'}
+
+def make_worker(workdir, smtp_port, **options):
+    store = AlertStore(os.path.join(workdir, 'alerts.db'))
+    senders = {
+        'email': SmtpEmailSender(port=smtp_port, timeout=2),
+        'sms': LogSmsSender(os.path.join(workdir, 'sms.log'))
+    }
+    return store, NotificationWorker(store, senders, **options)
+
+def check_index_and_dedupe():
+    """Severe scans notify once per window; Moderate scans are indexed without notifying"""
+    print("=== Testing Urgent Index and Dedupe ===")
+    server, port = start_mock_smtp_server()
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            store, worker = make_worker(workdir, port)
+            queued = store.record_analysis('PT-1', 'Severe', 5, 14.2, 6.1, CONTACT)
+            queued += store.record_analysis('PT-1', 'Severe', 6, 15.0, 6.3, CONTACT)
+            queued += store.record_analysis('PT-2', 'Moderate', 3, 7.5, 3.0, CONTACT)
+            queued += store.record_analysis('PT-3', 'Normal', 1, 2.0, 2.0, CONTACT)
+            worker.run_once()
+
+            cases = store.get_urgent_cases()
+            with open(os.path.join(workdir, 'sms.log'), encoding='utf-8') as file:
+                texts = [json.loads(line) for line in file]
+            print(f"   queued {queued}, emails {len(server.messages)}, texts {len(texts)}, cases {[c['level'] for c in cases]}")
+
+            passed = True
+            if queued == 2 and len(server.messages) == 1 and len(texts) == 1:
+                print("✅ Severe case notified once per channel")
+            else:
+                print("❌ Notifications were not deduplicated")
+                passed = False
+            if [case['patient_id'] for case in cases] == ['PT-2', 'PT-1', 'PT-1']:
+                print("✅ Severe and recent Moderate cases indexed, Normal skipped")
+            else:
+                print("❌ Unexpected urgent cases")
+                passed = False
+            return passed
+    finally:
+        server.shutdown()
+
+def check_dedupe_window():
+    """The dedupe window runs from the last notification, not from fixed calendar buckets"""
+    print("=== Testing Dedupe Window ===")
+    with tempfile.TemporaryDirectory() as workdir:
+        store = AlertStore(os.path.join(workdir, 'alerts.db'), dedupe_window_seconds=86400)
+        midnight = 1_700_006_400  # a multiple of the window, where the old buckets rolled over
+        across_boundary = [store.record_analysis('PT-1', 'Severe', 5, 14.2, 6.1, CONTACT, created_at=midnight + offset)
+                           for offset in (-30, 30)]
+        other_doctor = store.record_analysis('PT-1', 'Severe', 5, 14.2, 6.1, {'doctor_email': 'dr.wilson@example.com'},
+                                             created_at=midnight + 60)
+        other_patient = store.record_analysis('PT-2', 'Severe', 5, 14.2, 6.1, CONTACT, created_at=midnight + 60)
+        next_day = store.record_analysis('PT-1', 'Severe', 5, 14.2, 6.1, CONTACT, created_at=midnight + 86400)
+
+    print(f"   across boundary {across_boundary}, other doctor {other_doctor}, other patient {other_patient}, "
+          f"next day {next_day}")
+    if across_boundary == [2, 0] and other_doctor == 1 and other_patient == 2 and next_day == 2:
+        print("✅ Scans a minute apart across a day boundary notify once; a day later notifies again")
+        return True
+    print("❌ Dedupe window wrong")
+    return False
+
+def check_retry_after_outage():
+    """A send that fails while SMTP is down is retried and delivered later"""
+    print("=== Testing Retry After SMTP Outage ===")
+    server, port = start_mock_smtp_server()
+    server.shutdown()
+    server.server_close()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        store, worker = make_worker(workdir, port, retry_backoff=0.0)
+        store.record_analysis('PT-9', 'Severe', 7, 20.0, 9.0, {'doctor_email': 'dr@example.com'})
+        worker.run_once()
+        after_outage = store.get_stats()['outbox']
+
+        server, _ = start_mock_smtp_server(port)
+        try:
+            worker.run_once()
+            stats = worker.get_stats()
+            print(f"   after outage {after_outage}, now {stats['outbox']}, retries {stats['retries_scheduled']}")
+            if after_outage == {'pending': 1} and stats['outbox'] == {'sent': 1} and len(server.messages) == 1:
+                print("✅ Message retried and delivered")
+                return True
+            print("❌ Message was not retried")
+            return False
+        finally:
+            server.shutdown()
+
+def check_predict_queues_alert():
+    """A Severe /predict for a signed-in user queues their doctor's alerts; without user_id nothing is queued"""
+    print("=== Testing /predict Alert Queueing ===")
+    with tempfile.TemporaryDirectory() as workdir:
+        flask_app, client = app_client(workdir)
+        stones = [{"id": i, "bbox": [10.0 * i, 10.0, 10.0 * i + 8, 18.0], "confidence": 0.9, "diameter_px": 8.0,
+                   "diameter_mm": 3.0, "type": "kidney_stone", "position": "middle-left"} for i in range(1, 6)]
+        previous, flask_app.detect_stones = flask_app.detect_stones, lambda image, **kwargs: stones
+        try:
+            client.post('/save-doctor-contact', json={'user_id': 'uid-123', **CONTACT})
+            patient_id = flask_app.patient_manager.add_patient({'first_name': 'Alert', 'last_name': 'Route',
+                                                                 'email': 'route@example.com'})
+            image = io.BytesIO()
+            Image.new('RGB', (64, 64), 'black').save(image, 'PNG')
+
+            def predict(**fields):
+                data = {'image': (io.BytesIO(image.getvalue()), 'scan.png', 'image/png'), 'patient_id': patient_id, **fields}
+                return client.post('/predict', data=data, content_type='multipart/form-data')
+
+            anonymous = predict()
+            without_user = flask_app.alert_store.get_stats()['outbox']
+            response = predict(user_id='uid-123')
+            stats = flask_app.alert_store.get_stats()
+        finally:
+            flask_app.detect_stones = previous
+
+    level = response.get_json()['summary']['severity']['level']
+    print(f"   statuses {anonymous.status_code}/{response.status_code}, level {level}, outbox {without_user} -> {stats['outbox']}")
+    if response.status_code == 200 and level == 'Severe' and not without_user and stats['outbox'] == {'pending': 2}:
+        print("✅ Doctor contact found by user_id; email and SMS queued")
+        return True
+    print("❌ /predict did not queue the doctor alerts")
+    return False
+
+def test_index_and_dedupe():
+    assert check_index_and_dedupe()
+
+def test_dedupe_window():
+    assert check_dedupe_window()
+
+def test_retry_after_outage():
+    assert check_retry_after_outage()
+
+def test_predict_queues_alert():
+    assert check_predict_queues_alert()
+
+def main():
+    print("🚀 Starting Urgent Alert Tests\n")
+    results = [check_index_and_dedupe(), check_dedupe_window(), check_retry_after_outage(), check_predict_queues_alert()]
+    print(f"\n{'🎉 All alert tests passed' if all(results) else '⚠️  Some alert tests failed'}")
+
+if __name__ == "__main__":
+    main()
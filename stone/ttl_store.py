@@ -0,0 +1,145 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLStore:
+    """
+    String values by key: an in-process LRU with TTL in front of an optional
+    SQLite table, which survives restarts and is shared between workers.
+    Without db_path every worker keeps its own entries. With memory_tier
+    off every lookup goes to SQLite, so changes made by other workers are
+    seen at once.
+    """
+
+    name = "store"
+
+    def __init__(self, table, max_entries=1000, ttl_seconds=24 * 3600, db_path=None, memory_tier=True):
+        self.table = table
+        self.memory_tier = memory_tier or not db_path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "persistent_hits": 0, "misses": 0, "stores": 0, "deletes": 0, "evictions": 0}
+        if self.db_path:
+            self._init_db()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def get(self, key):
+        """Return the value stored for key, or None if unknown or expired"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return value
+                del self._entries[key]
+
+        if self.db_path:
+            try:
+                with self._connect() as conn:
+                    row = conn.execute(
+                        f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+                    ).fetchone()
+                if row and row[1] > now:
+                    with self._lock:
+                        self._put_memory(key, row[0], row[1])
+                        self.stats["persistent_hits"] += 1
+                    return row[0]
+            except sqlite3.Error as e:
+                print(f"Error reading {self.name}: {e}")
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def set(self, key, value):
+        """Store a value in both tiers; the TTL restarts on every set"""
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._put_memory(key, value, expires_at)
+            self.stats["stores"] += 1
+
+        if self.db_path:
+            try:
+                with self._connect() as conn:
+                    conn.execute(
+                        f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                        (key, value, expires_at)
+                    )
+                    conn.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (time.time(),))
+            except sqlite3.Error as e:
+                print(f"Error writing {self.name}: {e}")
+
+    def touch(self, key):
+        """Restart the TTL of a live entry without rewriting its value"""
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries[key] = (entry[0], expires_at)
+                self._entries.move_to_end(key)
+
+        if self.db_path:
+            try:
+                with self._connect() as conn:
+                    conn.execute(
+                        f"UPDATE {self.table} SET expires_at = ? WHERE key = ? AND expires_at > ?",
+                        (expires_at, key, now)
+                    )
+            except sqlite3.Error as e:
+                print(f"Error touching {self.name}: {e}")
+
+    def delete(self, key):
+        """Remove key from both tiers"""
+        with self._lock:
+            self._entries.pop(key, None)
+            self.stats["deletes"] += 1
+        if self.db_path:
+            try:
+                with self._connect() as conn:
+                    conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            except sqlite3.Error as e:
+                print(f"Error deleting from {self.name}: {e}")
+
+    def _put_memory(self, key, value, expires_at):
+        if not self.memory_tier:
+            return
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._entries.clear()
+        if self.db_path:
+            with self._connect() as conn:
+                conn.execute(f"DELETE FROM {self.table}")
+
+    def get_stats(self):
+        """Return hit/miss counters and the overall hit rate"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["persistent_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["hits"] + stats["persistent_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
@@ -36,6 +36,12 @@ export async function POST(request) {
     // Create FormData for Flask API
     const flaskFormData = new FormData();
     flaskFormData.append('image', file);
+    for (const field of ['patient_id', 'user_id']) {
+      const value = formData.get(field);
+      if (value) {
+        flaskFormData.append(field, value);
+      }
+    }
 
     // Forward the request to Flask API
     const flaskApiUrl = process.env.FLASK_API_URL || 'http://localhost:5000';
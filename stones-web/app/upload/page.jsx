@@ -105,6 +105,9 @@ const UploadPage = () => {
       // Create FormData for the upload
       const formData = new FormData();
       formData.append('image', selectedFile);
+      if (user?.uid) {
+        formData.append('user_id', user.uid);  // Severe results alert this user's doctor
+      }
 
       // Simulate upload progress
       const progressInterval = setInterval(() => {